@@ -1,7 +1,9 @@
-from authx import AuthX, AuthXConfig, TokenPayload
-from fastapi import Depends, Request, Header
+from authx import AuthX, AuthXConfig, TokenPayload, RequestToken
+from fastapi import Depends, Request, Header, HTTPException, WebSocket
 from typing import Annotated
-from services.user_service import User
+from services.user_service import User, Subject
+from services.token_service import TokenCache
+from instrumentation import phase
 import os
 import datetime
 
@@ -13,18 +15,76 @@ config.JWT_REFRESH_TOKEN_EXPIRES = datetime.timedelta(minutes=int(os.getenv("REF
 
 security = AuthX(config=config)
 
-async def get_current_subject(payload: TokenPayload = Depends(security.access_token_required)):
-    uid = await User.get_from_uuid(payload.sub)
-    return uid
+async def verify_access_token(request: Request) -> TokenPayload:
+    """Same checks as security.access_token_required, but a header token is verified once and then served from TokenCache"""
+    request_token = await security.get_access_token_from_request(request)
+    verify_csrf = config.JWT_COOKIE_CSRF_PROTECT and request.method.upper() in config.JWT_CSRF_METHODS
+    return await _verify(request_token, verify_csrf)
+
+async def _verify(request_token: RequestToken, verify_csrf: bool) -> TokenPayload:
+    # the authx blocklist callback, if one is set, may revoke a token that is already cached
+    if await security.is_token_in_blocklist(request_token.token):
+        raise HTTPException(401, "Token has been revoked")
+    cacheable = request_token.location in ("headers", "query")
+    payload = TokenCache.get(request_token.token) if cacheable else None
+    if payload is not None:
+        return payload
+
+    payload = security.verify_token(request_token, verify_type=True, verify_fresh=False, verify_csrf=verify_csrf)
+    if await TokenCache.is_revoked(request_token.token, payload):
+        raise HTTPException(401, "Token has been revoked")
+    if cacheable:
+        TokenCache.set(request_token.token, payload)
+    return payload
+
+async def _resolve_subject(payload: TokenPayload) -> Subject:
+    subject = await User.get_subject(payload.sub)
+    if subject is None or not subject.is_active:
+        raise HTTPException(401, "Unknown or inactive user")
+    return subject
+
+async def authenticate(request: Request) -> Subject:
+    return await _resolve_subject(await verify_access_token(request))
+
+async def authenticate_websocket(websocket: WebSocket) -> Subject:
+    """authenticate() for a WebSocket handshake, browsers cannot set headers there so the token may also be the `token` query parameter"""
+    header = websocket.headers.get(config.JWT_HEADER_NAME)
+    if header is not None:
+        request_token = RequestToken(token=header.removeprefix(f"{config.JWT_HEADER_TYPE} "), location="headers")
+    elif config.JWT_QUERY_STRING_NAME in websocket.query_params:
+        request_token = RequestToken(token=websocket.query_params[config.JWT_QUERY_STRING_NAME], location="query")
+    else:
+        raise HTTPException(401, "Missing access token")
+    return await _resolve_subject(await _verify(request_token, verify_csrf=False))
+
+async def get_current_subject(request: Request):
+    subject = await authenticate(request)
+    return subject.id
+
+async def get_current_admin(request: Request):
+    subject = await authenticate(request)
+    if not subject.is_admin:
+        raise HTTPException(403, "Administrator rights required")
+    return subject.id
 
 class Ctx:
 
-    def __init__(self, request: Request, user_agent: Annotated[str | None, Header()], uid: int = None):
+    __slots__ = ("request", "user_agent", "uid")
+
+    def __init__(self, request: Request, user_agent: str | None, uid: int = None):
         self.request = request
         self.user_agent = user_agent
         self.uid = uid
 
-async def ctx(request: Request, user_agent: Annotated[str | None, Header()], uid = Depends(get_current_subject)):
+async def ctx(request: Request, user_agent: Annotated[str | None, Header()]):
+    with phase("auth"):
+        subject = await authenticate(request)
+    return Ctx(request, user_agent, subject.id)
+
+# Administrator Context
+async def actx(request: Request, user_agent: Annotated[str | None, Header()]):
+    with phase("auth"):
+        uid = await get_current_admin(request)
     return Ctx(request, user_agent, uid)
 
 # Unchecked Context
@@ -0,0 +1,47 @@
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv()
+from dbm import DataBaseManager
+import models
+
+class QueryCounter:
+
+	def __init__(self):
+		self.statements = []
+
+	def __call__(self, sql: str, params, elapsed: float):
+		self.statements.append((sql, elapsed))
+
+	@property
+	def count(self) -> int:
+		return len(self.statements)
+
+	@property
+	def seconds(self) -> float:
+		return sum(elapsed for _, elapsed in self.statements)
+
+	def reset(self):
+		self.statements.clear()
+
+async def connect() -> DataBaseManager:
+	manager = DataBaseManager.from_env()
+	await manager.bind(models)
+	return manager
+
+@contextmanager
+def measure(manager: DataBaseManager, results: list, label: str):
+	counter = QueryCounter()
+	manager.add_query_hook(counter)
+	started = time.perf_counter()
+	try:
+		yield counter
+	finally:
+		elapsed = time.perf_counter() - started
+		manager.remove_query_hook(counter)
+		results.append((label, counter.count, elapsed * 1000, counter.seconds * 1000))
+
+def print_results(results: list):
+	print(f"{'operation':<36} {'queries':>8} {'total ms':>10} {'db ms':>10}")
+	for label, count, total, db in results:
+		print(f"{label:<36} {count:>8} {total:>10.2f} {db:>10.2f}")
@@ -0,0 +1,128 @@
+"""
+Query plan regression check. Runs the user, server, group and permission service operations against
+the MySQL database from the MYSQL_* environment, captures every SELECT, UPDATE and DELETE they issue
+and runs EXPLAIN on it. Exits with 1 when a table is read by a full scan without any usable index:
+
+	python -m benchmarks.explain_queries [--output plans.json]
+
+On a nearly empty database MySQL may prefer a scan even where an index exists, so only plans with
+no possible key count as failures, the others are listed. --output keeps all plans for diffing
+between commits. Everything the run created is removed at the end
+"""
+import sys
+import json
+import argparse
+import asyncio
+import shortuuid
+from benchmarks.common import connect
+from models import UserModel
+from services.server_service import Server, Group
+from services.user_service import User, UserChronicle
+from services.permission_service import Permission
+
+class Capture:
+
+	def __init__(self):
+		self.statements = {}
+
+	def __call__(self, sql: str, params, elapsed: float):
+		# compound reads start with "(SELECT"
+		if sql.lstrip("( \t\r\n")[:6].upper() in ("SELECT", "UPDATE", "DELETE"):
+			self.statements.setdefault(sql, params)
+
+async def workload():
+	name = shortuuid.ShortUUID().random(length=12)
+	owner = await User.create(name=f"eo{name}", email=f"eo{name}@bench.local", password="explain-password")
+	member = await User.create(name=f"em{name}", email=f"em{name}@bench.local", password="explain-password")
+	member_uuid = (await UserModel.aio_get(id=member)).uuid
+	sid = None
+	try:
+		await User.authentication(f"eo{name}", "explain-password")
+		await User.get_subject(member_uuid)
+		await User.read_info(member)
+		await User.change_email(member, f"em{name}@explain.local")
+		await UserChronicle.history(member)
+
+		sid = await Server.create(name="explain", module="default", address="127.0.0.1", port=4711, hash="-", uid=owner)
+		await Server.change(sid, name="explain2", port=4712)
+		await Server.set_hash(sid, "--")
+		await Server.read_info(sid)
+		await Server.get_all()
+		gid = await Group.create(name="Moderator", permissions=["kick", "ban"], sid=sid)
+		await Group.rename(gid, "Moderators")
+		pid = await Group.set_permission(gid, "say")
+		usgid = await Group.assign(gid, member)
+		await Group.assign_many(gid, [owner, member])
+		await Group.set_permissions(gid, ["kick", "map_*"], replace=True)
+		await Server.get_all_for_user(member)
+		await Server.get_users_for_server(sid)
+		servers, _ = await Server.get_all_for_user(owner)
+		await Server.get_id_for_uuid(servers[0]["uuid"], member)
+		await Server.get_targets(owner, uuids=[servers[0]["uuid"]])
+		await Server.get_targets(member, group="moderators")
+		Permission.invalidate_server(sid)
+		await Permission.resolve_many(member, [sid])
+		await Group.get_id_for_slug("moderators", sid)
+		await Group.get_all_for_server(sid)
+		await Group.get_permissions(gid)
+		await Group.delete_permission(pid)
+		await Group.revoke(usgid)
+		await Group.revoke_many(gid, [owner, member])
+		await Group.delete(gid)
+	finally:
+		if sid is not None:
+			await Server.delete(sid)
+		await User.delete(owner)
+		await User.delete(member)
+
+async def explain(manager, sql: str, params) -> list:
+	async def fetch(cursor):
+		columns = [column[0] for column in cursor.description]
+		return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+	return await manager.database.aio_execute_sql("EXPLAIN " + sql, params, fetch_results=fetch)
+
+def classify(row: dict) -> str | None:
+	# derived tables and UNION results are materialised by MySQL itself, scanning them is expected
+	if row["table"] is None or row["table"].startswith("<"):
+		return None
+	if row["type"] == "ALL":
+		return "scan" if row["possible_keys"] else "full scan"
+	if row["type"] == "index":
+		return "index scan"
+	return None
+
+async def main(output: str | None) -> int:
+	manager = await connect()
+	capture = Capture()
+	manager.add_query_hook(capture)
+	try:
+		await workload()
+	finally:
+		manager.remove_query_hook(capture)
+
+	plans = []
+	failures = 0
+	try:
+		for sql, params in capture.statements.items():
+			rows = await explain(manager, sql, params)
+			plans.append({"sql": sql, "plan": rows})
+			for row in rows:
+				verdict = classify(row)
+				if verdict is None:
+					continue
+				failed = verdict == "full scan"
+				failures += failed
+				print(f"{'FAIL' if failed else 'note'} {verdict} of {row['table']} (possible keys: {row['possible_keys']}, rows: {row['rows']})\n     {sql}")
+	finally:
+		await manager.close()
+
+	if output:
+		with open(output, "w", encoding="utf8") as file:
+			json.dump(plans, file, indent=1, default=str)
+	print(f"{len(plans)} statements explained, {failures} full scans without a usable index")
+	return 1 if failures else 0
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="EXPLAIN every service query and fail on full scans")
+	parser.add_argument("--output", default=None, help="write all plans to this JSON file")
+	sys.exit(asyncio.run(main(parser.parse_args().output)))
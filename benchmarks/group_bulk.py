@@ -0,0 +1,71 @@
+"""
+Bulk group operations against their per-row counterparts: statements issued and wall time for
+onboarding `--users` members to a group, removing them again and copying a permission set.
+Runs against the MySQL database from the MYSQL_* environment and removes everything it created:
+
+	python -m benchmarks.group_bulk [--users 200]
+"""
+import argparse
+import asyncio
+import shortuuid
+from benchmarks.common import connect, measure, print_results
+from models import UserModel, UserServerGroupModel, ServerGroupPermissionModel
+from services.server_service import Server, Group
+
+PERMISSIONS = ["kick", "ban", "say", "map_*", "slots", "restart", "rcon", "warn", "mute", "unban"]
+
+async def main(users: int):
+	manager = await connect()
+	results = []
+	name = shortuuid.ShortUUID().random(length=12)
+	owner = await UserModel.aio_create(name=f"go{name}", email=f"go{name}@bench.local", hash="-")
+	await UserModel.insert_many([(f"g{name}{i}", f"g{name}{i}@bench.local", "-") for i in range(users)], fields=[UserModel.name, UserModel.email, UserModel.hash]).aio_execute()
+	uids = [row.id for row in await UserModel.select(UserModel.id).where(UserModel.name.startswith(f"g{name}")).order_by(UserModel.id).aio_execute()]
+	sid = None
+
+	try:
+		sid = await Server.create(name="bench", module="default", address="127.0.0.1", port=4711, hash="-", uid=owner.id)
+		single = await Group.create(name="Single", permissions=[], sid=sid)
+		bulk = await Group.create(name="Bulk", permissions=[], sid=sid)
+
+		with measure(manager, results, f"Group.assign x{users}"):
+			for uid in uids:
+				await Group.assign(single, uid)
+		with measure(manager, results, f"Group.assign_many {users}"):
+			outcomes = await Group.assign_many(bulk, uids)
+		assert all(outcome == "assigned" for outcome in outcomes.values())
+		with measure(manager, results, f"Group.assign_many {users} again"):
+			outcomes = await Group.assign_many(bulk, uids)
+		assert all(outcome == "already_member" for outcome in outcomes.values())
+
+		usgids = [row.id for row in await UserServerGroupModel.select(UserServerGroupModel.id).where(UserServerGroupModel.group == single).aio_execute()]
+		with measure(manager, results, f"Group.revoke x{users}"):
+			for usgid in usgids:
+				await Group.revoke(usgid)
+		with measure(manager, results, f"Group.revoke_many {users}"):
+			await Group.revoke_many(bulk, uids)
+
+		with measure(manager, results, f"Group.set_permission x{len(PERMISSIONS)}"):
+			for value in PERMISSIONS:
+				await Group.set_permission(single, value)
+		with measure(manager, results, f"Group.set_permissions {len(PERMISSIONS)}"):
+			await Group.set_permissions(bulk, PERMISSIONS)
+
+		pids = [row.id for row in await ServerGroupPermissionModel.select(ServerGroupPermissionModel.id).where(ServerGroupPermissionModel.group == single).aio_execute()]
+		with measure(manager, results, f"Group.delete_permission x{len(pids)}"):
+			for pid in pids:
+				await Group.delete_permission(pid)
+		with measure(manager, results, "Group.set_permissions replace 2"):
+			await Group.set_permissions(bulk, ["kick", "ban"], replace=True)
+	finally:
+		if sid is not None:
+			await Server.delete(sid)
+		await UserModel.delete().where(UserModel.name.startswith(f"g{name}") | (UserModel.id == owner.id)).aio_execute()
+		await manager.close()
+
+	print_results(results)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Bulk group operations against the per-row ones")
+	parser.add_argument("--users", type=int, default=200)
+	asyncio.run(main(parser.parse_args().users))
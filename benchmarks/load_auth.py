@@ -0,0 +1,237 @@
+"""
+Load test of the auth API and the server service against the MySQL from the MYSQL_* environment and
+either an in-process fake Redis (default, needs fakeredis[lua]) or the Redis from REDIS_*. Requests
+go through the real application in process, so the numbers are the API cost without the network:
+
+	python -m benchmarks.load_auth [--users 200] [--concurrency 20] [--redis fake|env] [--only login,users_me]
+
+Every run is appended to benchmarks/results/load_auth.jsonl together with the current commit and
+compared with the previous run, so a regression shows up before it is deployed. Everything the run
+created is removed at the end. SQLite is not an option: peewee-async only drives MySQL and PostgreSQL
+"""
+import os
+import json
+import time
+import random
+import string
+import argparse
+import asyncio
+import datetime
+import subprocess
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Load test of the auth API and the server service")
+	parser.add_argument("--users", type=int, default=200, help="users registered and driven by the run")
+	parser.add_argument("--concurrency", type=int, default=20)
+	parser.add_argument("--redis", choices=("fake", "env"), default="fake")
+	parser.add_argument("--only", default=None, help="comma separated scenario names")
+	parser.add_argument("--keep-limits", action="store_true", help="keep the LIMITER_* settings instead of lifting them")
+	parser.add_argument("--results", default=os.path.join(os.path.dirname(__file__), "results", "load_auth.jsonl"))
+	return parser.parse_args()
+
+ARGS = parse_args()
+if not ARGS.keep_limits:
+	# the suite measures the API, not how fast the limiter says 429
+	for limit in ("GENERAL", "LOGIN", "REFRESH", "CHANGE_PASSWORD"):
+		os.environ[f"LIMITER_{limit}_TIMES"] = "1000000000"
+		os.environ[f"LIMITER_{limit}_SECONDS"] = "1"
+
+import httpx
+import redis.asyncio as redis
+from fastapi_limiter import FastAPILimiter
+from benchmarks.common import QueryCounter
+from dbm import DataBaseManager
+import models
+import main
+from models import UserModel
+from services.user_service import LoginTiming
+from services.chronicle_service import chronicle_writer
+from services.server_service import Server, Group
+
+class Result:
+
+	def __init__(self, name: str):
+		self.name = name
+		self.latencies = []
+		self.errors = 0
+		self.queries = 0
+		self.elapsed = 0.0
+
+	def percentile(self, value: float) -> float:
+		if not self.latencies:
+			return 0.0
+		ordered = sorted(self.latencies)
+		return ordered[min(len(ordered) - 1, int(len(ordered) * value))] * 1000
+
+	def summary(self) -> dict:
+		count = len(self.latencies)
+		return {
+			"requests": count,
+			"errors": self.errors,
+			"throughput": round(count / self.elapsed, 1) if self.elapsed else 0.0,
+			"p50_ms": round(self.percentile(0.50), 3),
+			"p95_ms": round(self.percentile(0.95), 3),
+			"p99_ms": round(self.percentile(0.99), 3),
+			"queries_per_request": round(self.queries / (count or 1), 2),
+		}
+
+async def drive(name: str, total: int, concurrency: int, call, counter: QueryCounter) -> Result:
+	"""Runs call(i) for i in range(total), `concurrency` at a time. call returns True on success"""
+	result = Result(name)
+	indexes = iter(range(total))
+
+	async def worker():
+		for i in indexes:
+			started = time.perf_counter()
+			try:
+				ok = await call(i)
+			except Exception:
+				ok = False
+			result.latencies.append(time.perf_counter() - started)
+			if not ok:
+				result.errors += 1
+
+	counter.reset()
+	started = time.perf_counter()
+	await asyncio.gather(*(worker() for _ in range(concurrency)))
+	result.elapsed = time.perf_counter() - started
+	result.queries = counter.count
+	return result
+
+async def setup() -> DataBaseManager:
+	manager = DataBaseManager.from_env()
+	manager.migrate(models)
+	await manager.bind(models)
+
+	if ARGS.redis == "fake":
+		import fakeredis
+		connection = fakeredis.FakeAsyncRedis()
+	else:
+		connection = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=int(os.getenv("REDIS_PORT")), db=int(os.getenv("REDIS_DB")))
+	await FastAPILimiter.init(connection, prefix=f"load-auth-{time.time_ns()}")
+	await LoginTiming.start()
+	chronicle_writer.start()
+	main.app.state.dbm = manager
+	return manager
+
+def commit() -> str:
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except Exception:
+		return "unknown"
+
+def report(scenarios: dict):
+	previous = None
+	if os.path.exists(ARGS.results):
+		with open(ARGS.results, encoding="utf8") as file:
+			lines = file.read().splitlines()
+			previous = json.loads(lines[-1]) if lines else None
+
+	print(f"{'scenario':<18} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'q/req':>7} {'errors':>7}  vs previous run")
+	for name, row in scenarios.items():
+		change = ""
+		before = (previous or {}).get("scenarios", {}).get(name)
+		if before and before["throughput"] and before["p95_ms"]:
+			change = f"req/s {(row['throughput'] / before['throughput'] - 1) * 100:+.1f}%, p95 {(row['p95_ms'] / before['p95_ms'] - 1) * 100:+.1f}% ({previous['commit']})"
+		print(f"{name:<18} {row['throughput']:>9.1f} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['queries_per_request']:>7.2f} {row['errors']:>7}  {change}")
+
+	os.makedirs(os.path.dirname(ARGS.results), exist_ok=True)
+	with open(ARGS.results, "a", encoding="utf8") as file:
+		file.write(json.dumps({
+			"timestamp": datetime.datetime.now().isoformat(),
+			"commit": commit(),
+			"users": ARGS.users,
+			"concurrency": ARGS.concurrency,
+			"redis": ARGS.redis,
+			"scenarios": scenarios,
+		}) + "\n")
+
+async def run():
+	manager = await setup()
+	counter = QueryCounter()
+	manager.add_query_hook(counter)
+	only = set(ARGS.only.split(",")) if ARGS.only else None
+	run_id = "".join(random.choices(string.ascii_lowercase + string.digits, k=8))
+	password = "Load-Test-Password-1"
+	users = [f"lt{run_id}{i}" for i in range(ARGS.users)]
+	tokens = {}
+	etags = {}
+	uids = []
+	servers = []
+	scenarios = {}
+
+	async def scenario(name: str, total: int, call, required: bool = False):
+		if required or only is None or name in only:
+			result = await drive(name, total, ARGS.concurrency, call, counter)
+			if only is None or name in only:
+				scenarios[name] = result.summary()
+
+	async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://load", headers={"User-Agent": "load-auth"}) as client:
+
+		async def register(i: int):
+			response = await client.post("/auth/register", json={"name": users[i], "email": f"{users[i]}@load.local", "password": password})
+			return response.status_code == 200
+
+		async def login(i: int):
+			response = await client.post("/auth/login", json={"name": users[i], "password": password})
+			if response.status_code != 200:
+				return False
+			tokens[i] = response.json()
+			return True
+
+		async def refresh(i: int):
+			response = await client.post("/auth/refresh", json={"refresh_token": tokens[i]["refresh_token"]})
+			return response.status_code == 200
+
+		async def users_me(i: int):
+			response = await client.get("/auth/users/me", headers={"Authorization": f"Bearer {tokens[i]['access_token']}"})
+			etags[i] = response.headers.get("etag")
+			return response.status_code == 200
+
+		async def users_me_etag(i: int):
+			response = await client.get("/auth/users/me", headers={"Authorization": f"Bearer {tokens[i]['access_token']}", "If-None-Match": etags.get(i) or "*"})
+			return response.status_code == 304
+
+		async def server_create(i: int):
+			servers.append(await Server.create(name=f"load {i}", module="default", address="127.0.0.1", port=4711, hash="-", uid=uids[i]))
+			return True
+
+		async def group_assign(i: int):
+			gid = await Group.create(name="Moderators", permissions=["kick", "ban"], sid=servers[i])
+			await Group.assign(gid, uids[(i + 1) % len(uids)])
+			return True
+
+		async def server_list(i: int):
+			await Server.get_all_for_user(uids[i])
+			return True
+
+		async def server_users(i: int):
+			await Server.get_users_for_server(servers[i])
+			return True
+
+		try:
+			await scenario("register", ARGS.users, register, required=True)
+			await scenario("login", ARGS.users, login, required=True)
+			await scenario("refresh", ARGS.users, refresh)
+			await scenario("users_me", ARGS.users, users_me)
+			await scenario("users_me_etag", ARGS.users, users_me_etag)
+
+			uids.extend(row.id for row in await UserModel.select(UserModel.id).where(UserModel.name.in_(users)).order_by(UserModel.id).aio_execute())
+			if only is None or only & {"server_create", "group_assign", "server_list", "server_users"}:
+				await scenario("server_create", len(uids), server_create, required=True)
+				await scenario("group_assign", len(servers), group_assign)
+				await scenario("server_list", len(uids), server_list)
+				await scenario("server_users", len(servers), server_users)
+		finally:
+			for sid in servers:
+				await Server.delete(sid)
+			await chronicle_writer.stop()
+			await UserModel.delete().where(UserModel.name.in_(users)).aio_execute()
+			manager.remove_query_hook(counter)
+			await FastAPILimiter.close()
+			await manager.close()
+
+	report(scenarios)
+
+if __name__ == "__main__":
+	asyncio.run(run())
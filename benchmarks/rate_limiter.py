@@ -0,0 +1,66 @@
+"""
+Requests per second through an endpoint guarded by fastapi_limiter alone (one Redis round trip per
+request) and by limiter.RateLimiter (local token bucket, Redis only on sync). Needs the Redis from
+the REDIS_* environment:
+
+	python -m benchmarks.rate_limiter [requests] [concurrency]
+"""
+import os
+import sys
+import time
+import asyncio
+import httpx
+from dotenv import load_dotenv
+load_dotenv()
+import redis.asyncio as redis
+from fastapi import FastAPI, Depends
+from fastapi_limiter import FastAPILimiter
+from fastapi_limiter.depends import RateLimiter as RedisRateLimiter
+from limiter import RateLimiter
+
+async def run(app: FastAPI, path: str, requests: int, concurrency: int) -> tuple:
+	statuses = {}
+	queue = iter(range(requests))
+
+	async def worker(client: httpx.AsyncClient):
+		for _ in queue:
+			response = await client.get(path)
+			statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+	async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+		started = time.perf_counter()
+		await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+		elapsed = time.perf_counter() - started
+	return requests / elapsed, statuses
+
+def build(path: str, dependency) -> FastAPI:
+	app = FastAPI()
+
+	@app.get(path, dependencies=[Depends(dependency)] if dependency else [])
+	async def stress():
+		return {"result": 1}
+
+	return app
+
+async def main(requests: int, concurrency: int):
+	connection = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=int(os.getenv("REDIS_PORT")), db=int(os.getenv("REDIS_DB")))
+	await FastAPILimiter.init(connection, prefix=f"bench-limiter-{time.time_ns()}")
+
+	cases = [
+		("no limiter", None),
+		("redis limiter, under limit", RedisRateLimiter(times=requests * 2, seconds=60)),
+		("two-tier limiter, under limit", RateLimiter(times=requests * 2, seconds=60)),
+		("redis limiter, flood", RedisRateLimiter(times=100, seconds=60)),
+		("two-tier limiter, flood", RateLimiter(times=100, seconds=60)),
+	]
+	print(f"{'case':<32} {'req/s':>10}  statuses")
+	for number, (label, dependency) in enumerate(cases):
+		# the default identifier keys on the path, every case gets its own counters
+		path = f"/stress/{number}"
+		rate, statuses = await run(build(path, dependency), path, requests, concurrency)
+		print(f"{label:<32} {rate:>10.0f}  {statuses}")
+	print(RateLimiter.stats())
+	await FastAPILimiter.close()
+
+if __name__ == "__main__":
+	asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 50))
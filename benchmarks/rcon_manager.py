@@ -0,0 +1,45 @@
+"""
+Command latency of services.rcon_service against local fake BF2142 RCON servers, no database needed:
+
+	python -m benchmarks.rcon_manager [servers] [commands per server]
+"""
+import sys
+import time
+import asyncio
+import statistics
+from services.rcon_service import RconManager
+from tests.fake_rcon import FakeRconServer
+
+async def main(servers: int, commands: int):
+	fakes = [FakeRconServer() for _ in range(servers)]
+	manager = RconManager(max_connections=servers)
+	for sid, fake in enumerate(fakes):
+		manager.register(sid, "127.0.0.1", await fake.start(), fake.password)
+
+	latencies = []
+
+	async def timed(sid: int, number: int):
+		started = time.perf_counter()
+		assert await manager.invoke(sid, f"echo {number}") == f"echo {number}"
+		latencies.append(time.perf_counter() - started)
+
+	try:
+		started = time.perf_counter()
+		await asyncio.gather(*(timed(sid, 0) for sid in range(servers)))
+		print(f"connect + first command on {servers} servers: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+		latencies.clear()
+		started = time.perf_counter()
+		await asyncio.gather(*(timed(sid, number) for sid in range(servers) for number in range(commands)))
+		elapsed = time.perf_counter() - started
+		latencies.sort()
+		print(f"{servers * commands} pipelined commands: {elapsed * 1000:.2f} ms, {servers * commands / elapsed:.0f} commands/s")
+		print(f"latency p50 {statistics.median(latencies) * 1000:.2f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+		print(f"sessions opened {sum(fake.sessions for fake in fakes)}, manager {manager.stats()}")
+	finally:
+		await manager.close()
+		for fake in fakes:
+			await fake.close()
+
+if __name__ == "__main__":
+	asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100, int(sys.argv[2]) if len(sys.argv) > 2 else 50))
@@ -0,0 +1,50 @@
+"""
+Serialization cost per response of a large server listing (the shape of Server.get_all_for_user),
+no database needed:
+
+	python -m benchmarks.serialization [rows] [repeats]
+"""
+import sys
+import json
+import time
+import datetime
+from fastapi.encoders import jsonable_encoder
+from responses import dumps
+from routers.servers import ServerPageOut
+from routers.internal import ServerPageOut as AdminServerPageOut
+
+def build(rows: int) -> tuple[dict, dict]:
+	now = datetime.datetime.now()
+	page = {"items": [
+		{"id": i, "uuid": f"{i:018d}", "name": f"server {i}", "group_name": "Moderators", "group_slug": "moderators", "usg_id": i * 3}
+		for i in range(rows)
+	], "next_cursor": "MTAwMA"}
+	admin_page = {"items": [
+		{"id": i, "uuid": f"{i:018d}", "name": f"server {i}", "module": "modmanager", "operator": i % 50, "datetime_create": now - datetime.timedelta(minutes=i)}
+		for i in range(rows)
+	], "next_cursor": None}
+	return page, admin_page
+
+def timed(function, repeats: int) -> float:
+	started = time.perf_counter()
+	for _ in range(repeats):
+		function()
+	return (time.perf_counter() - started) / repeats * 1000
+
+def main(rows: int, repeats: int):
+	page, admin_page = build(rows)
+	print(f"{'path':<44} {'servers ms':>11} {'with datetimes ms':>18}")
+	cases = [
+		("jsonable_encoder + json.dumps (FastAPI)", lambda data, model: json.dumps(jsonable_encoder(data)).encode()),
+		("response model validate + json.dumps", lambda data, model: json.dumps(model.model_validate(data).model_dump(mode="json")).encode()),
+		("response model validate + dump_json", lambda data, model: model.model_validate(data).model_dump_json().encode()),
+		("response model validate + orjson", lambda data, model: dumps(model.model_validate(data).model_dump())),
+		("orjson on the rows (responses.dumps)", lambda data, model: dumps(data)),
+	]
+	for label, function in cases:
+		plain = timed(lambda: function(page, ServerPageOut), repeats)
+		dated = timed(lambda: function(admin_page, AdminServerPageOut), repeats)
+		print(f"{label:<44} {plain:>11.3f} {dated:>18.3f}")
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,67 @@
+"""
+Number of SQL statements issued by every services.server_service operation (BEGIN/COMMIT are not counted).
+Runs against the MySQL database from the MYSQL_* environment and removes everything it created:
+
+	python -m benchmarks.server_service_queries
+"""
+import asyncio
+import shortuuid
+from benchmarks.common import connect, measure, print_results
+from models import UserModel
+from services.server_service import Server, Group
+
+async def main():
+	manager = await connect()
+	results = []
+	name = shortuuid.ShortUUID().random(length=12)
+	owner = await UserModel.aio_create(name=f"bo{name}", email=f"bo{name}@bench.local", hash="-")
+	member = await UserModel.aio_create(name=f"bm{name}", email=f"bm{name}@bench.local", hash="-")
+
+	try:
+		with measure(manager, results, "Server.create"):
+			sid = await Server.create(name="bench", module="default", address="127.0.0.1", port=4711, hash="-", uid=owner.id)
+		with measure(manager, results, "Server.change"):
+			await Server.change(sid, name="bench2", port=4712)
+		with measure(manager, results, "Server.set_hash"):
+			await Server.set_hash(sid, "--")
+		with measure(manager, results, "Server.get_all"):
+			await Server.get_all()
+		with measure(manager, results, "Group.create"):
+			gid = await Group.create(name="Moderator", permissions=["kick", "ban"], sid=sid)
+		with measure(manager, results, "Group.rename"):
+			await Group.rename(gid, "Moderators")
+		with measure(manager, results, "Group.set_permission"):
+			pid = await Group.set_permission(gid, "say")
+		with measure(manager, results, "Group.assign"):
+			usgid = await Group.assign(gid, member.id)
+		with measure(manager, results, "Server.get_all_for_user"):
+			await Server.get_all_for_user(member.id)
+		with measure(manager, results, "Server.get_users_for_server"):
+			await Server.get_users_for_server(sid)
+		servers, _ = await Server.get_all_for_user(owner.id)
+		with measure(manager, results, "Server.get_id_for_uuid"):
+			await Server.get_id_for_uuid(servers[0]["uuid"], member.id)
+		with measure(manager, results, "Group.has_permission"):
+			await Group.has_permission(sid, member.id, "kick")
+		with measure(manager, results, "Group.get_id_for_slug"):
+			await Group.get_id_for_slug("moderators", sid)
+		with measure(manager, results, "Group.get_all_for_server"):
+			await Group.get_all_for_server(sid)
+		with measure(manager, results, "Group.get_permissions"):
+			await Group.get_permissions(gid)
+		with measure(manager, results, "Group.delete_permission"):
+			await Group.delete_permission(pid)
+		with measure(manager, results, "Group.revoke"):
+			await Group.revoke(usgid)
+		with measure(manager, results, "Group.delete"):
+			await Group.delete(gid)
+		with measure(manager, results, "Server.delete"):
+			await Server.delete(sid)
+	finally:
+		await UserModel.delete().where(UserModel.id.in_([owner.id, member.id])).aio_execute()
+		await manager.database.aio_close()
+
+	print_results(results)
+
+if __name__ == "__main__":
+	asyncio.run(main())
@@ -0,0 +1,34 @@
+"""
+Cold import time of the application, the part of a worker boot that needs no database, measured in
+fresh interpreters. Run it before and after a change to catch boot regressions:
+
+	python -m benchmarks.startup [runs]
+"""
+import os
+import sys
+import statistics
+import subprocess
+
+SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+def main(runs: int):
+	env = os.environ | {"PYTHONDONTWRITEBYTECODE": "0"}
+	samples = []
+	for _ in range(runs):
+		output = subprocess.run([sys.executable, "-c", SNIPPET], capture_output=True, text=True, env=env, check=True)
+		samples.append(float(output.stdout.strip().splitlines()[-1]) * 1000)
+	print(f"import main: median {statistics.median(samples):.1f} ms, min {min(samples):.1f} ms, max {max(samples):.1f} ms over {runs} runs")
+
+	output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], capture_output=True, text=True, env=env, check=True)
+	rows = []
+	for line in output.stderr.splitlines()[1:]:
+		_, cumulative, name = line.split("|")
+		# one level below the top, i.e. what main and its siblings import directly
+		if name.startswith("   ") and not name.startswith("    "):
+			rows.append((int(cumulative), name.strip()))
+	print("slowest imports of main:")
+	for cumulative, name in sorted(rows, reverse=True)[:15]:
+		print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -1,10 +1,131 @@
 #from playhouse.pool import PooledMySQLDatabase
 import peewee_async
-import inspect
+import os
+import time
+import asyncio
+import weakref
+import itertools
+import peewee
+from playhouse.migrate import MySQLMigrator
+from collections import deque
+from contextvars import ContextVar
+
+# set once the current request wrote to the primary, later reads of that request stay there
+_primary_pinned: ContextVar[bool] = ContextVar("primary_pinned", default=False)
+
+class InstrumentedPoolBackend(peewee_async.MysqlPoolBackend):
+
+	def __init__(self, *, database: str, acquire_timeout: float = None, **kwargs):
+		super().__init__(database=database, **kwargs)
+		self.acquire_timeout = acquire_timeout
+		self.acquisitions = 0
+		self.timeouts = 0
+		self.opened = 0
+		self.wait_seconds = 0.0
+		self.max_wait_seconds = 0.0
+		self.__recent = deque(maxlen=10000)
+		self.__seen = weakref.WeakSet()
+
+	async def acquire(self):
+		started = time.perf_counter()
+		try:
+			if self.acquire_timeout:
+				connection = await asyncio.wait_for(super().acquire(), self.acquire_timeout)
+			else:
+				connection = await super().acquire()
+		except asyncio.TimeoutError:
+			self.timeouts += 1
+			raise
+
+		waited = time.perf_counter() - started
+		self.acquisitions += 1
+		self.wait_seconds += waited
+		self.max_wait_seconds = max(self.max_wait_seconds, waited)
+		self.__recent.append(started)
+		if connection not in self.__seen:
+			self.__seen.add(connection)
+			self.opened += 1
+		return connection
+
+	def stats(self, window: float = 10.0) -> dict:
+		now = time.perf_counter()
+		recent = sum(1 for moment in self.__recent if now - moment <= window)
+		size = self.pool.size if self.pool is not None else 0
+		idle = self.pool.freesize if self.pool is not None else 0
+		return {
+			"connected": self.is_connected,
+			"minsize": self.connect_params.get("minsize"),
+			"maxsize": self.connect_params.get("maxsize"),
+			"pool_recycle": self.connect_params.get("pool_recycle"),
+			"acquire_timeout": self.acquire_timeout,
+			"size": size,
+			"in_use": size - idle,
+			"idle": idle,
+			"acquisitions": self.acquisitions,
+			"acquisitions_per_second": round(recent / window, 3),
+			"acquire_timeouts": self.timeouts,
+			"avg_wait_ms": round(self.wait_seconds / (self.acquisitions or 1) * 1000, 3),
+			"max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+			"opened": self.opened,
+			"recycled": max(self.opened - size, 0),
+		}
+
+class InstrumentedMySQLDatabase(peewee_async.PooledMySQLDatabase):
+
+	pool_backend_cls = InstrumentedPoolBackend
+
+	def __init__(self, *args, primary: bool = True, **kwargs):
+		self.query_hooks = []
+		self.primary = primary
+		super().__init__(*args, **kwargs)
+
+	async def aio_execute_sql(self, sql: str, params=None, fetch_results=None):
+		# compound reads are rendered as "(SELECT ...) UNION (SELECT ...)"
+		if self.primary and not sql.lstrip("( \t\r\n")[:6].upper() == "SELECT":
+			_primary_pinned.set(True)
+		if not self.query_hooks:
+			return await super().aio_execute_sql(sql, params, fetch_results=fetch_results)
+
+		started = time.perf_counter()
+		try:
+			return await super().aio_execute_sql(sql, params, fetch_results=fetch_results)
+		finally:
+			elapsed = time.perf_counter() - started
+			for hook in self.query_hooks:
+				hook(sql, params, elapsed)
+
+class Replica:
+
+	def __init__(self, address: str, port: int, database: InstrumentedMySQLDatabase):
+		self.address = address
+		self.port = port
+		self.database = database
+		self.healthy = True
+		self.failures = 0
+		self.last_error = None
+
+	def mark_down(self, error: Exception):
+		self.healthy = False
+		self.failures += 1
+		self.last_error = repr(error)
+
+	def stats(self) -> dict:
+		return {
+			"address": f"{self.address}:{self.port}",
+			"healthy": self.healthy,
+			"failures": self.failures,
+			"last_error": self.last_error,
+			"pool": self.database.pool_backend.stats(),
+		}
 
 class DataBaseManager:
 
-	def __init__(self, name: str, user: str, password: str, address: str, port: int):
+	current: "DataBaseManager" = None
+	replica_errors = (peewee.OperationalError, peewee.InterfaceError, asyncio.TimeoutError, OSError)
+
+	def __init__(self, name: str, user: str, password: str, address: str, port: int,
+			minsize: int = 2, maxsize: int = 10, pool_recycle: int = 3600, acquire_timeout: float = None, connect_timeout: int = 10,
+			replicas: list = None, health_interval: float = 5.0):
 
 		self.__mysql_name = name
 		self.__mysql_user = user
@@ -12,7 +133,14 @@ class DataBaseManager:
 		self.__mysql_address = address
 		self.__mysql_port = port
 
-		self.__database = peewee_async.PooledMySQLDatabase(
+		pool_params = {
+			"minsize": minsize,
+			"maxsize": maxsize,
+			"pool_recycle": pool_recycle,
+			"acquire_timeout": acquire_timeout
+		}
+
+		self.__database = InstrumentedMySQLDatabase(
 
 
 			self.__mysql_name,
@@ -20,27 +148,175 @@ class DataBaseManager:
 			password=self.__mysql_password,
 			host=self.__mysql_address,
 			port=self.__mysql_port,
-			pool_params={
-				"minsize": 2,
-				"maxsize": 10,
-				"pool_recycle": 2
-    		}
+			connect_timeout=connect_timeout,
+			pool_params=dict(pool_params)
 		)
 		self.__database.set_allow_sync(False)
 
+		self.__replicas = []
+		for replica_address, replica_port in replicas or []:
+			database = InstrumentedMySQLDatabase(
+				self.__mysql_name,
+				primary=False,
+				user=self.__mysql_user,
+				password=self.__mysql_password,
+				host=replica_address,
+				port=replica_port,
+				connect_timeout=connect_timeout,
+				pool_params=dict(pool_params)
+			)
+			database.set_allow_sync(False)
+			self.__replicas.append(Replica(replica_address, replica_port, database))
+		self.__replica_cycle = itertools.cycle(self.__replicas) if self.__replicas else None
+		self.__health_interval = health_interval
+		self.__health_task = None
 
-	def __load_models_from_module(self, module: object):
-		members = inspect.getmembers(module, inspect.isclass)
-		model_classes = [cls for name, cls in members if name.lower().endswith('model')]
-		return model_classes
 
+	@property
+	def database(self) -> InstrumentedMySQLDatabase:
+		return self.__database
+
+	def add_query_hook(self, hook):
+		self.__database.query_hooks.append(hook)
 
-	async def bind(self, model_module: object):
+	def remove_query_hook(self, hook):
+		self.__database.query_hooks.remove(hook)
+
+	def stats(self) -> dict:
+		return self.__database.pool_backend.stats() | {"replicas": [replica.stats() for replica in self.__replicas]}
+
+	def reader(self) -> Replica | None:
+		if not self.__replicas or _primary_pinned.get():
+			return None
+		for _ in range(len(self.__replicas)):
+			replica = next(self.__replica_cycle)
+			if replica.healthy:
+				return replica
+		return None
+
+	async def read(self, query):
+		replica = self.reader()
+		if replica is not None:
+			try:
+				return await query.aio_execute(replica.database)
+			except DataBaseManager.replica_errors as error:
+				replica.mark_down(error)
+		return await query.aio_execute(self.__database)
+
+	async def __check_replicas(self):
+		while True:
+			await asyncio.sleep(self.__health_interval)
+			for replica in self.__replicas:
+				try:
+					await asyncio.wait_for(replica.database.aio_execute_sql("SELECT 1"), self.__health_interval)
+					replica.healthy = True
+				except Exception as error:
+					replica.mark_down(error)
+
+	@classmethod
+	def from_env(cls, **overrides) -> "DataBaseManager":
+		params = {
+			"name": os.getenv("MYSQL_NAME"),
+			"user": os.getenv("MYSQL_USER"),
+			"password": os.getenv("MYSQL_PASSWORD"),
+			"address": os.getenv("MYSQL_ADDRESS"),
+			"port": int(os.getenv("MYSQL_PORT")),
+			"minsize": int(os.getenv("MYSQL_POOL_MINSIZE", 2)),
+			"maxsize": int(os.getenv("MYSQL_POOL_MAXSIZE", 10)),
+			"pool_recycle": int(os.getenv("MYSQL_POOL_RECYCLE", 3600)),
+			"acquire_timeout": float(os.getenv("MYSQL_POOL_ACQUIRE_TIMEOUT", 5)),
+			"connect_timeout": int(os.getenv("MYSQL_CONNECT_TIMEOUT", 10)),
+			"replicas": [(host, int(port)) for host, port in (replica.strip().rsplit(":", 1) for replica in os.getenv("MYSQL_REPLICAS", "").split(",") if replica.strip())],
+			"health_interval": float(os.getenv("MYSQL_REPLICA_HEALTH_INTERVAL", 5)),
+		}
+		return cls(**(params | overrides))
+
+	def __load_models_from_module(self, module: object):
+		model_classes = [value for name, value in vars(module).items() if name.lower().endswith("model") and isinstance(value, type) and issubclass(value, peewee.Model)]
+		return peewee.sort_models(model_classes)
+
+	def migrate(self, model_module: object, apply: bool = True) -> list:
+		"""
+		Brings the schema up to the models: creates missing tables, adds missing columns and creates
+		missing indexes. The only thing ever dropped is the single-column index of a field that no
+		longer asks for one, once the new indexes exist. Returns the steps taken, or only the steps
+		that would be taken with `apply` off
+		"""
 		models = self.__load_models_from_module(model_module)
+		steps = []
 		with self.__database.allow_sync():
 			self.__database.bind(models)
-			self.__database.create_tables(models)
+			migrator = MySQLMigrator(self.__database)
+			for model in models:
+				table = model._meta.table_name
+				if not model.table_exists():
+					steps.append(f"create table {table}")
+					if apply:
+						model.create_table(safe=True)
+					continue
+
+				columns = {column.name for column in self.__database.get_columns(table)}
+				for field in model._meta.sorted_fields:
+					if field.column_name not in columns:
+						steps.append(f"add column {table}.{field.column_name}")
+						if apply:
+							migrator.add_column(table, field.column_name, field).run()
+
+				indexes = {index.name for index in self.__database.get_indexes(table)}
+				for index in model._meta.fields_to_index():
+					if index._name not in indexes:
+						steps.append(f"create index {index._name} on {table}")
+						if apply:
+							self.__database.execute(model._schema._create_index(index, safe=False))
+
+				for field in model._meta.sorted_fields:
+					name = peewee.ModelIndex(model, (field,))._name
+					if not (field.index or field.unique or field.primary_key) and name in indexes:
+						steps.append(f"drop index {name} on {table}")
+						if apply:
+							migrator.drop_index(table, name).run()
+		return steps
+
+	async def bind(self, model_module: object, create_tables: bool = False):
+		models = self.__load_models_from_module(model_module)
+		if create_tables:
+			self.migrate(model_module)
+		self.__database.bind(models)
+		await self.warm_up()
+		if self.__replicas:
+			self.__health_task = asyncio.create_task(self.__check_replicas())
+		DataBaseManager.current = self
+
+	async def warm_up(self):
+		# creating the pool opens `minsize` connections, the ping makes sure they are usable
+		await self.__database.aio_connect()
+		await self.__database.aio_execute_sql("SELECT 1")
+		for replica in self.__replicas:
+			try:
+				await replica.database.aio_connect()
+				await replica.database.aio_execute_sql("SELECT 1")
+			except Exception as error:
+				replica.mark_down(error)
 
 	async def close(self):
-		with self.__database.allow_sync():
-			self.__database.close()
\ No newline at end of file
+		if self.__health_task is not None:
+			self.__health_task.cancel()
+		for replica in self.__replicas:
+			await replica.database.aio_close()
+		await self.__database.aio_close()
+		if DataBaseManager.current is self:
+			DataBaseManager.current = None
+
+def pin_primary():
+	"""Sends the remaining reads of the current request to the primary"""
+	_primary_pinned.set(True)
+
+async def read(query):
+	"""Runs a read-only query on a healthy replica unless the current request already wrote to the primary"""
+	if DataBaseManager.current is None:
+		return await query.aio_execute()
+	return await DataBaseManager.current.read(query)
+
+async def read_first(query):
+	rows = await read(query.limit(1))
+	return rows[0] if rows else None
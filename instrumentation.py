@@ -0,0 +1,272 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import functools
+import collections
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+# phase -> [seconds, count] of the request being handled, None outside of a request
+_timings: ContextVar[dict | None] = ContextVar("timings", default=None)
+
+def record(name: str, seconds: float):
+	timings = _timings.get()
+	if timings is None:
+		return
+	entry = timings.get(name)
+	if entry is None:
+		timings[name] = [seconds, 1]
+	else:
+		entry[0] += seconds
+		entry[1] += 1
+
+@contextmanager
+def phase(name: str):
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		record(name, time.perf_counter() - started)
+
+def query_hook(sql: str, params, elapsed: float):
+	"""DataBaseManager query hook, every statement of a request adds to its "db" phase"""
+	record("db", elapsed)
+
+class InstrumentedRoute(APIRoute):
+	"""Times the endpoint function itself, the "handler" phase, and marks its end so that the rest up to the response is "serialize" """
+
+	def __init__(self, path: str, endpoint, **kwargs):
+		if asyncio.iscoroutinefunction(endpoint):
+			endpoint = InstrumentedRoute.wrap(endpoint)
+		super().__init__(path, endpoint, **kwargs)
+
+	@staticmethod
+	def wrap(endpoint):
+		@functools.wraps(endpoint)
+		async def timed(*args, **kwargs):
+			started = time.perf_counter()
+			try:
+				return await endpoint(*args, **kwargs)
+			finally:
+				finished = time.perf_counter()
+				record("handler", finished - started)
+				timings = _timings.get()
+				if timings is not None:
+					timings["_handled"] = finished
+		return timed
+
+class Histogram:
+	"""Request durations in fixed millisecond buckets, percentiles are read as the upper bound of their bucket"""
+
+	bounds = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+	__slots__ = ("counts", "count", "total", "max")
+
+	def __init__(self):
+		self.counts = [0] * len(Histogram.bounds)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def observe(self, ms: float):
+		for index, bound in enumerate(Histogram.bounds):
+			if ms <= bound:
+				self.counts[index] += 1
+				break
+		self.count += 1
+		self.total += ms
+		self.max = max(self.max, ms)
+
+	def percentile(self, value: float) -> float:
+		rank = self.count * value
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= rank and count:
+				return min(Histogram.bounds[index], self.max)
+		return self.max
+
+	def stats(self) -> dict:
+		return {
+			"count": self.count,
+			"avg_ms": round(self.total / (self.count or 1), 3),
+			"p50_ms": round(self.percentile(0.50), 3),
+			"p95_ms": round(self.percentile(0.95), 3),
+			"p99_ms": round(self.percentile(0.99), 3),
+			"max_ms": round(self.max, 3),
+			"buckets": {str(bound): count for bound, count in zip(Histogram.bounds, self.counts) if count},
+		}
+
+class Metrics:
+	"""
+	Per route histograms of the whole request and of every phase it went through. Phases nest:
+	"db" and "bcrypt" time is also part of "auth" or "handler", "delay" is the login padding
+	"""
+
+	enabled = os.getenv("INSTRUMENTATION", "1") == "1"
+	# off by default, the header would tell a client how long bcrypt and the login padding took
+	server_timing = os.getenv("SERVER_TIMING", "0") == "1"
+	routes: dict[str, dict[str, Histogram]] = {}
+
+	@staticmethod
+	def observe(route: str, timings: dict, elapsed: float):
+		histograms = Metrics.routes.get(route)
+		if histograms is None:
+			histograms = Metrics.routes[route] = {}
+		for name, value in (("total", [elapsed, 1]), *timings.items()):
+			if name.startswith("_"):
+				continue
+			histogram = histograms.get(name)
+			if histogram is None:
+				histogram = histograms[name] = Histogram()
+			histogram.observe(value[0] * 1000)
+
+	@staticmethod
+	def header(timings: dict, elapsed: float) -> str:
+		parts = [f"{name};dur={value[0] * 1000:.3f}" + (f';desc="{value[1]} queries"' if name == "db" else "") for name, value in timings.items() if not name.startswith("_")]
+		parts.append(f"total;dur={elapsed * 1000:.3f}")
+		return ", ".join(parts)
+
+	@staticmethod
+	def stats() -> dict:
+		return {
+			"enabled": Metrics.enabled,
+			"server_timing": Metrics.server_timing,
+			"routes": {route: {name: histogram.stats() for name, histogram in histograms.items()} for route, histograms in Metrics.routes.items()},
+		}
+
+class SamplingProfiler:
+	"""
+	Samples the stack of the event loop thread every `interval` seconds into a ring buffer of the
+	last `window` seconds. When a request took longer than `threshold` the samples taken while it
+	ran are written to `directory` in the folded format of flamegraph.pl and speedscope. The loop
+	serves other requests meanwhile, so their stacks show up in the same file
+	"""
+
+	def __init__(self, threshold: float, interval: float = 0.005, window: float = 30.0, directory: str = "profiles", min_dump_interval: float = 10.0):
+		self.threshold = threshold
+		self.interval = interval
+		self.directory = directory
+		self.min_dump_interval = min_dump_interval
+		self.__samples = collections.deque(maxlen=max(int(window / interval), 1))
+		self.__thread = None
+		self.__thread_id = None
+		self.__stop = threading.Event()
+		self.__last_dump = 0.0
+		self.__dumps = 0
+		self.__skipped = 0
+
+	@property
+	def running(self) -> bool:
+		return self.__thread is not None
+
+	def start(self):
+		"""Call from the event loop thread"""
+		if self.__thread is not None or self.threshold <= 0:
+			return
+		self.__thread_id = threading.get_ident()
+		self.__stop.clear()
+		self.__thread = threading.Thread(target=self.__run, name="sampling-profiler", daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		if self.__thread is None:
+			return
+		self.__stop.set()
+		self.__thread.join()
+		self.__thread = None
+
+	def __run(self):
+		while not self.__stop.wait(self.interval):
+			frame = sys._current_frames().get(self.__thread_id)
+			if frame is not None:
+				self.__samples.append((time.perf_counter(), SamplingProfiler.fold(frame)))
+
+	@staticmethod
+	def fold(frame) -> str:
+		stack = []
+		while frame is not None:
+			stack.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}")
+			frame = frame.f_back
+		return ";".join(reversed(stack))
+
+	async def dump(self, label: str, started: float, finished: float) -> str | None:
+		if finished - self.__last_dump < self.min_dump_interval:
+			self.__skipped += 1
+			return None
+		self.__last_dump = finished
+		stacks = collections.Counter(stack for moment, stack in list(self.__samples) if started <= moment <= finished)
+		if not stacks:
+			return None
+
+		name = f"{int(time.time())}-{label}-{int((finished - started) * 1000)}ms.folded"
+		path = os.path.join(self.directory, "".join(char if char.isalnum() or char in "-_." else "_" for char in name))
+		await asyncio.to_thread(self.__write, path, stacks)
+		self.__dumps += 1
+		return path
+
+	def __write(self, path: str, stacks: collections.Counter):
+		os.makedirs(self.directory, exist_ok=True)
+		with open(path, "w", encoding="utf8") as file:
+			for stack, count in stacks.most_common():
+				file.write(f"{stack} {count}\n")
+
+	def stats(self) -> dict:
+		return {
+			"running": self.running,
+			"threshold_ms": round(self.threshold * 1000, 3),
+			"interval_ms": round(self.interval * 1000, 3),
+			"samples": len(self.__samples),
+			"dumps": self.__dumps,
+			"skipped_dumps": self.__skipped,
+		}
+
+profiler = SamplingProfiler(
+	threshold=float(os.getenv("PROFILE_SLOW_MS", 0)) / 1000,
+	interval=float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000,
+	window=float(os.getenv("PROFILE_WINDOW", 30)),
+	directory=os.getenv("PROFILE_DIR", "profiles"),
+	min_dump_interval=float(os.getenv("PROFILE_MIN_DUMP_INTERVAL", 10)),
+)
+
+class InstrumentationMiddleware:
+	"""
+	Collects the phase timings of every HTTP request into Metrics, adds them as a Server-Timing
+	header when enabled and hands slow requests to the sampling profiler
+	"""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http" or not Metrics.enabled:
+			return await self.app(scope, receive, send)
+
+		timings = {}
+		token = _timings.set(timings)
+		started = time.perf_counter()
+
+		async def send_timed(message):
+			if message["type"] == "http.response.start":
+				now = time.perf_counter()
+				handled = timings.pop("_handled", None)
+				if handled is not None:
+					record("serialize", now - handled)
+				if Metrics.server_timing:
+					MutableHeaders(scope=message).append("Server-Timing", Metrics.header(timings, now - started))
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_timed)
+		finally:
+			finished = time.perf_counter()
+			_timings.reset(token)
+			route = scope.get("route")
+			path = route.path if route is not None else "unmatched"
+			Metrics.observe(f"{scope['method']} {path}", timings, finished - started)
+			if profiler.running and finished - started >= profiler.threshold:
+				await profiler.dump(f"{scope['method']}-{path}", started, finished)
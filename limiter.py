@@ -0,0 +1,136 @@
+import os
+import time
+import itertools
+from math import ceil
+import redis as pyredis
+from starlette.requests import Request
+from starlette.responses import Response
+from fastapi_limiter import FastAPILimiter
+from fastapi_limiter.depends import RateLimiter as RedisRateLimiter
+from services.cache import TTLCache
+from instrumentation import phase
+
+class Bucket:
+
+	__slots__ = ("tokens", "updated", "pending", "synced", "blocked_until", "syncing")
+
+	def __init__(self, tokens: float, now: float):
+		self.tokens = tokens
+		self.updated = now
+		self.pending = 0
+		# never synced, the first admitted request goes to Redis right away
+		self.synced = 0.0
+		self.blocked_until = 0.0
+		self.syncing = False
+
+class RateLimiter(RedisRateLimiter):
+	"""
+	Drop-in replacement for fastapi_limiter's RateLimiter with an in-process token bucket in front.
+	Every key gets `times` tokens refilled over the window, an empty bucket answers 429 without
+	touching Redis. Admitted requests are only counted locally and every `sync_interval` seconds
+	the count is added to the shared Redis window in one call; once the cluster-wide total is over
+	`times` the key is refused locally until that window ends. The cluster may overshoot by what
+	the workers admit between two syncs. Limiters of at most `strict_times` requests, such as login,
+	guard against guessing where that overshoot matters, they check Redis on every request
+	"""
+
+	enabled = os.getenv("LIMITER_LOCAL", "1") == "1"
+	sync_interval = float(os.getenv("LIMITER_SYNC_INTERVAL", 1.0))
+	strict_times = int(os.getenv("LIMITER_STRICT_TIMES", 10))
+	buckets = TTLCache(maxsize=int(os.getenv("LIMITER_LOCAL_KEYS", 100000)), ttl=3600)
+	counter = itertools.count()
+	sync_script = """local count = redis.call("INCRBY", KEYS[1], ARGV[1])
+if count == tonumber(ARGV[1]) then
+ redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return {count, redis.call("PTTL", KEYS[1])}"""
+	sync_sha = None
+
+	syncs = 0
+	local_rejections = 0
+	cluster_rejections = 0
+	sync_errors = 0
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		# limiters are created at import time in the same order in every worker, so the index is a stable key part
+		self.index = next(RateLimiter.counter)
+		self.rate = self.times / (self.milliseconds / 1000) if self.milliseconds > 0 else 0.0
+		self.interval = min(RateLimiter.sync_interval, self.milliseconds / 4000) if self.milliseconds > 0 else RateLimiter.sync_interval
+		self.strict = self.times <= RateLimiter.strict_times
+
+	async def __call__(self, request: Request, response: Response):
+		with phase("limiter"):
+			return await self.__limit(request, response)
+
+	async def __limit(self, request: Request, response: Response):
+		if not RateLimiter.enabled or self.strict:
+			return await super().__call__(request, response)
+		if not FastAPILimiter.redis:
+			raise Exception("You must call FastAPILimiter.init in startup event of fastapi!")
+
+		identifier = self.identifier or FastAPILimiter.identifier
+		callback = self.callback or FastAPILimiter.http_callback
+		key = f"{FastAPILimiter.prefix}:{await identifier(request)}:{self.index}"
+
+		now = time.monotonic()
+		bucket = RateLimiter.buckets.get(key)
+		if bucket is None:
+			bucket = Bucket(self.times, now)
+		RateLimiter.buckets.set(key, bucket, ttl=self.milliseconds / 1000 * 2 + self.interval)
+
+		if bucket.blocked_until > now:
+			RateLimiter.cluster_rejections += 1
+			return await callback(request, response, ceil((bucket.blocked_until - now) * 1000))
+
+		bucket.tokens = min(self.times, bucket.tokens + (now - bucket.updated) * self.rate)
+		bucket.updated = now
+		if bucket.tokens < 1:
+			RateLimiter.local_rejections += 1
+			return await callback(request, response, ceil((1 - bucket.tokens) / (self.rate or 1) * 1000))
+
+		bucket.tokens -= 1
+		bucket.pending += 1
+		if now - bucket.synced >= self.interval and not bucket.syncing:
+			await self.__sync(key, bucket)
+
+	async def __sync(self, key: str, bucket: Bucket):
+		bucket.syncing = True
+		pending, bucket.pending = bucket.pending, 0
+		try:
+			try:
+				count, pttl = await self.__add(key, pending)
+			except pyredis.exceptions.NoScriptError:
+				RateLimiter.sync_sha = None
+				count, pttl = await self.__add(key, pending)
+		except Exception:
+			# Redis being away only loses the cluster-wide view, the local bucket keeps limiting
+			RateLimiter.sync_errors += 1
+			bucket.pending += pending
+			return
+		finally:
+			bucket.syncing = False
+			bucket.synced = time.monotonic()
+
+		RateLimiter.syncs += 1
+		if count > self.times and pttl > 0:
+			bucket.blocked_until = time.monotonic() + pttl / 1000
+
+	async def __add(self, key: str, pending: int):
+		redis = FastAPILimiter.redis
+		if RateLimiter.sync_sha is None:
+			RateLimiter.sync_sha = await redis.script_load(RateLimiter.sync_script)
+		return await redis.evalsha(RateLimiter.sync_sha, 1, key, str(pending), str(self.milliseconds))
+
+	@staticmethod
+	def stats() -> dict:
+		return {
+			"enabled": RateLimiter.enabled,
+			"sync_interval": RateLimiter.sync_interval,
+			"strict_times": RateLimiter.strict_times,
+			"keys": len(RateLimiter.buckets),
+			"syncs": RateLimiter.syncs,
+			"sync_errors": RateLimiter.sync_errors,
+			"local_rejections": RateLimiter.local_rejections,
+			"cluster_rejections": RateLimiter.cluster_rejections,
+		}
@@ -1,55 +1,86 @@
+import time
+_import_started = time.perf_counter()
 import traceback
+import logging
 from dotenv import load_dotenv
 load_dotenv()
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
+from responses import FastJSONResponse
 from routers.auth import auth_router
+from routers.internal import internal_router
+from routers.servers import servers_router
 from dbm import DataBaseManager
 import models
-import uvicorn
 import os
 import signal
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+import asyncio
+import datetime
 import tomllib
-from services.service_exception import ServiceException
+from services.service_exception import ServiceException, ServiceUnavailableException
+from services.password_service import password_executor
+from services.user_service import LoginTiming, SubjectCache
+from services.chronicle_service import chronicle_writer, purge_chronicles
+from services.rcon_service import rcon_manager
+from services.console_service import console_hub
+from services.token_service import TokenCache
+from services.version_service import Versions
+from services.status_service import StatusStore, StatusPoller, poll_servers
+from services.scheduler_service import scheduler, scheduler_leader
+from services.metadata_service import invalidation_bus
+from services.startup_service import startup_report
+from instrumentation import InstrumentationMiddleware, query_hook, profiler
 import auth
 import redis.asyncio as redis
 from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
 
-with open("pyproject.toml", "rb") as f:
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyproject.toml"), "rb") as f:
 	data = tomllib.load(f)
 	__version__ = data["tool"]["poetry"]["version"]
 	__description__ = data["tool"]["poetry"]["description"]
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-	mysql_name = os.getenv('MYSQL_NAME')
-	mysql_user = os.getenv('MYSQL_USER')
-	mysql_password = os.getenv('MYSQL_PASSWORD')
-	mysql_address = os.getenv('MYSQL_ADDRESS')
-	mysql_port = int(os.getenv('MYSQL_PORT'))
+# heavy subsystems (scheduler, login timing calibration) are started after the worker already serves
+LAZY_INIT = os.getenv("LAZY_INIT", "0") == "1"
 
-	dbm = DataBaseManager(
-		name=mysql_name,
-		user=mysql_user,
-		password=mysql_password,
-		address=mysql_address,
-		port=mysql_port
-	)
+# uvicorn configures this logger, the startup report ends up next to its own startup lines
+logger = logging.getLogger("uvicorn.error")
 
-	jobstores = {
-		"default": SQLAlchemyJobStore(
-			url=f"mysql+pymysql://{mysql_user}:{mysql_password}@{mysql_address}:{mysql_port}/{mysql_name}")
-	}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	dbm = DataBaseManager.from_env()
+	lazy_start = None
 
 	try:
-		await dbm.bind(models)
-		redis_connection = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=int(os.getenv("REDIS_PORT")), db=int(os.getenv("REDIS_DB")))
-		await FastAPILimiter.init(redis_connection)
-		scheduler = AsyncIOScheduler(jobstores=jobstores)
+		with startup_report.phase("database"):
+			await dbm.bind(models, create_tables=os.getenv("DB_AUTO_MIGRATE", "0") == "1")
+			dbm.add_query_hook(query_hook)
+		with startup_report.phase("redis"):
+			redis_connection = redis.Redis(host=os.getenv("REDIS_ADDRESS"), port=int(os.getenv("REDIS_PORT")), db=int(os.getenv("REDIS_DB")))
+			await FastAPILimiter.init(redis_connection)
+			if os.getenv("SUBJECT_CACHE_SHARED", "0") == "1":
+				SubjectCache.bind_redis(redis_connection)
+			StatusStore.bind_redis(redis_connection)
+			TokenCache.bind_redis(redis_connection)
+			Versions.bind_redis(redis_connection)
+			scheduler_leader.bind_redis(redis_connection)
+			invalidation_bus.bind_redis(redis_connection)
+		with startup_report.phase("workers"):
+			chronicle_writer.start()
+			rcon_manager.start()
+			invalidation_bus.start()
+			profiler.start()
+			scheduler.add_job(purge_chronicles, "cron", hour=int(os.getenv("CHRONICLE_RETENTION_HOUR", 4)), id="chronicle_retention", replace_existing=True, coalesce=True, max_instances=1)
+			# the scheduler may only start much later (lazy init, leadership), the first poll still runs then
+			scheduler.add_job(poll_servers, "interval", seconds=StatusPoller.interval, next_run_time=datetime.datetime.now(), misfire_grace_time=None, id="server_status", replace_existing=True, coalesce=True, max_instances=1)
+		if LAZY_INIT:
+			lazy_start = asyncio.get_running_loop().call_later(float(os.getenv("LAZY_INIT_DELAY", 5)), scheduler_leader.start)
+			LoginTiming.start()
+		else:
+			with startup_report.phase("login_timing"):
+				await LoginTiming.start()
+			with startup_report.phase("scheduler"):
+				scheduler_leader.start()
 	except Exception as error:
 		print(traceback.format_exc())
 		print(error)
@@ -57,25 +88,49 @@ async def lifespan(app: FastAPI):
 		os.kill(os.getpid(), signal.SIGTERM)
 
 	app.state.scheduler = scheduler
+	app.state.dbm = dbm
+	app.state.login_timing = LoginTiming.calibration
+	logger.info(startup_report.summary())
 
 	yield
 
+	# a shutdown within LAZY_INIT_DELAY must not start the scheduler after it was stopped
+	if lazy_start is not None:
+		lazy_start.cancel()
+	await scheduler_leader.stop()
+	profiler.stop()
+	await console_hub.close()
+	await rcon_manager.close()
+	await invalidation_bus.stop()
 	await FastAPILimiter.close()
+	await chronicle_writer.stop(timeout=float(os.getenv("CHRONICLE_DRAIN_TIMEOUT", 10)))
+	if app.state.login_timing is not None:
+		await asyncio.gather(app.state.login_timing, return_exceptions=True)
+	password_executor.shutdown()
+	await dbm.close()
 
 app = FastAPI(
 	title="MyAdminKA API",
 	lifespan=lifespan,
 	root_path="/api",
 	version=__version__,
-	description=__description__
+	description=__description__,
+	default_response_class=FastJSONResponse if os.getenv("FAST_JSON", "1") == "1" else JSONResponse
 )
+app.add_middleware(InstrumentationMiddleware)
 app.include_router(auth_router)
+app.include_router(servers_router)
+app.include_router(internal_router)
 
 auth.security.handle_errors(app)
+startup_report.add("import", time.perf_counter() - _import_started)
 
 @app.exception_handler(ServiceException)
 async def http_service_exception_handler(request, exc):
+	if isinstance(exc, ServiceUnavailableException):
+		raise HTTPException(503, exc.detail)
 	raise HTTPException(400, exc.detail)
 
 #if __name__ == "__main__":
+#	import uvicorn
 #	uvicorn.run("main:app", port=int(os.getenv("UVICORN_PORT")), log_level=os.getenv("UVICORN_LOG_LEVEL"))
\ No newline at end of file
@@ -0,0 +1,23 @@
+"""
+Schema migration, run once per deploy instead of on every worker start:
+
+	python migrate.py          creates missing tables, columns and indexes, drops indexes the models gave up
+	python migrate.py --check  only lists them, exits with 1 while the schema is behind the models
+"""
+import sys
+from dotenv import load_dotenv
+load_dotenv()
+from dbm import DataBaseManager
+import models
+
+def main(check: bool) -> int:
+	manager = DataBaseManager.from_env()
+	steps = manager.migrate(models, apply=not check)
+	for step in steps:
+		print(("pending: " if check else "done: ") + step)
+	if not steps:
+		print("Schema is up to date")
+	return 1 if check and steps else 0
+
+if __name__ == "__main__":
+	sys.exit(main("--check" in sys.argv[1:]))
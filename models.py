@@ -20,6 +20,7 @@ class UserModel(peewee_async.AioModel):
 	hash_datetime_update = peewee.DateTimeField(default=datetime.datetime.now)
 	is_admin = peewee.BooleanField(default=False)
 	is_active = peewee.BooleanField(default=True)
+	version = peewee.IntegerField(default=1)
 
 	class Meta:
 		table_name = "myadminka_users"
@@ -31,40 +32,58 @@ class ServerModel(peewee_async.AioModel):
 	address = peewee.IPField()
 	port = peewee.SmallIntegerField()
 	hash = peewee.CharField(max_length=128)
-	operator = peewee.ForeignKeyField(UserModel, backref="own_servers")
+	# (operator, name) below also serves lookups by operator
+	operator = peewee.ForeignKeyField(UserModel, backref="own_servers", index=False)
 	datetime_create = peewee.DateTimeField(default=datetime.datetime.now)
+	version = peewee.IntegerField(default=1)
 
 	class Meta:
 		table_name = "myadminka_servers"
+		indexes = (
+			(("operator", "name"), True),
+		)
 
 class ServerGroupModel(peewee_async.AioModel):
-	server = peewee.ForeignKeyField(ServerModel, backref="server_groups")
+	# (server, slug) below also serves lookups by server
+	server = peewee.ForeignKeyField(ServerModel, backref="server_groups", index=False)
 	slug = peewee.CharField(max_length=32, index=True)
 	name = peewee.CharField(max_length=32)
 	datetime_create = peewee.DateTimeField(default=datetime.datetime.now)
 
 	class Meta:
 		table_name = "myadminka_server_groups"
+		indexes = (
+			(("server", "slug"), True),
+		)
 
 class ServerGroupPermissionModel(peewee_async.AioModel):
-	group = peewee.ForeignKeyField(ServerGroupModel, index=True)
+	# (group, value) below also serves lookups by group
+	group = peewee.ForeignKeyField(ServerGroupModel, index=False)
 	value = peewee.CharField(max_length=32)
 
 	class Meta:
 		table_name = "myadminka_server_group_perms"
+		indexes = (
+			(("group", "value"), True),
+		)
 
 class UserServerGroupModel(peewee_async.AioModel):
-	user = peewee.ForeignKeyField(UserModel, index=True)
+	# (user, group) below also serves lookups by user
+	user = peewee.ForeignKeyField(UserModel, index=False)
 	group = peewee.ForeignKeyField(ServerGroupModel, index=True)
 	datetime_create = peewee.DateTimeField(default=datetime.datetime.now)
 
 	class Meta:
 		table_name = "myadminka_users_server_group"
+		indexes = (
+			(("user", "group"), True),
+		)
 
 class UserChronicleModel(peewee_async.AioModel):
-	user_initiator = peewee.ForeignKeyField(UserModel, index=True)
+	# (user_initiator, datetime_create) and (user_target, datetime_create) below also serve lookups by user
+	user_initiator = peewee.ForeignKeyField(UserModel, index=False)
 	datetime_create = peewee.DateTimeField(default=datetime.datetime.now)
-	user_target = peewee.ForeignKeyField(UserModel, index=True, null=True)
+	user_target = peewee.ForeignKeyField(UserModel, index=False, null=True)
 	event_code = peewee.CharField(max_length=50)
 	details = peewee.CharField(null=True)
 	user_agent = peewee.CharField()
@@ -72,3 +91,9 @@ class UserChronicleModel(peewee_async.AioModel):
 
 	class Meta:
 		table_name = "myadminka_user_chronicles"
+		indexes = (
+			(("user_initiator", "datetime_create"), False),
+			(("user_target", "datetime_create"), False),
+			(("event_code", "datetime_create"), False),
+			(("datetime_create",), False),
+		)
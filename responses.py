@@ -0,0 +1,85 @@
+import os
+import hashlib
+import decimal
+import ipaddress
+import orjson
+import pydantic
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from services.cache import TTLCache
+from dbm import pin_primary
+from services.version_service import Versions
+
+bodies = TTLCache(maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 10000)), ttl=int(os.getenv("RESPONSE_CACHE_TTL", 300)))
+
+def _default(value):
+	if isinstance(value, pydantic.BaseModel):
+		return value.model_dump(mode="json")
+	if isinstance(value, (decimal.Decimal, ipaddress.IPv4Address, ipaddress.IPv6Address)):
+		return str(value)
+	if isinstance(value, (set, frozenset)):
+		return list(value)
+	if isinstance(value, bytes):
+		return value.decode("utf8")
+	return jsonable_encoder(value)
+
+def dumps(data) -> bytes:
+	"""orjson with datetimes, dataclasses and non-str keys handled natively, anything else through jsonable_encoder"""
+	return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+class FastJSONResponse(JSONResponse):
+	"""Default response class of the app when FAST_JSON is on"""
+
+	def render(self, content) -> bytes:
+		return dumps(content)
+
+def ndjson(rows) -> StreamingResponse:
+	"""Streams rows of an async iterator as newline-delimited JSON without collecting them first"""
+	async def body():
+		async for row in rows:
+			yield dumps(row) + b"\n"
+	return StreamingResponse(body(), media_type="application/x-ndjson")
+
+def _matches(request: Request, tag: str) -> bool:
+	header = request.headers.get("if-none-match")
+	if not header:
+		return False
+	candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+	return "*" in candidates or tag.removeprefix("W/") in candidates
+
+def _tagged(request: Request, body: bytes, tag: str) -> Response:
+	if _matches(request, tag):
+		return Response(status_code=304, headers={"ETag": tag})
+	return Response(body, media_type="application/json", headers={"ETag": tag})
+
+async def versioned(request: Request, kind: str, key: int, load) -> Response:
+	"""
+	JSON response of `load()`, a coroutine returning a dict with the row "version", tagged with that
+	version. While the version is known to Versions a matching If-None-Match gets 304 and a known
+	body is resent, neither calls `load()`. A row older than the known version comes from a lagging
+	replica and is loaded again from the primary, so an old body is never tagged or cached as current
+	"""
+	version = await Versions.get(kind, key)
+	if version is not None:
+		tag = f'"{kind}-{key}-{version}"'
+		if _matches(request, tag):
+			return Response(status_code=304, headers={"ETag": tag})
+		body = bodies.get((request.url.path, kind, key, version))
+		if body is not None:
+			return Response(body, media_type="application/json", headers={"ETag": tag})
+
+	data = await load()
+	if version is not None and data["version"] < version:
+		pin_primary()
+		data = await load()
+	version = data["version"]
+	await Versions.set(kind, key, version)
+	body = dumps(data)
+	bodies.set((request.url.path, kind, key, version), body)
+	return _tagged(request, body, f'"{kind}-{key}-{version}"')
+
+def hashed(request: Request, data) -> Response:
+	"""JSON response with a weak ETag over its body, for listings that have no single row version"""
+	body = dumps(data)
+	return _tagged(request, body, f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"')
@@ -1,17 +1,19 @@
 import os
 import traceback
 from typing import Annotated
-from fastapi import APIRouter, FastAPI, Request, Response, HTTPException, Header, Depends
+from fastapi import APIRouter, FastAPI, Request, Response, HTTPException, Header, Depends, Query
 from contextlib import asynccontextmanager
-from models import UserModel
-from services.user_service import User
-from fastapi_limiter.depends import RateLimiter
+from models import UserModel, UserChronicleModel
+from services.user_service import User, UserChronicle
+from services.token_service import TokenCache
+from responses import versioned
+from limiter import RateLimiter
+from instrumentation import InstrumentedRoute
 import pydantic
 import email_validator
 import re
+import datetime
 import auth
-import asyncio
-import random
 import authx
 
 @asynccontextmanager
@@ -24,7 +26,8 @@ __tags__ = ["auth"]
 auth_router = APIRouter(
 	prefix=__prefix__,
 	lifespan=lifespan,
-	tags=__tags__
+	tags=__tags__,
+	route_class=InstrumentedRoute
 )
 
 NameField = Annotated[str, pydantic.Field(min_length=3, max_length=UserModel.name.max_length)]
@@ -67,9 +70,6 @@ class RegisterItem(pydantic.BaseModel):
 	def validate_password(cls, value: str):
 		return _validate_password(value)
 
-async def delay():
-	await asyncio.sleep(round(random.uniform(1.0, 3.0), 4))
-
 @auth_router.post(
 	path="/register",
 	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
@@ -78,7 +78,6 @@ async def delay():
 async def register(item: RegisterItem, ctx = Depends(auth.uctx)):
 	#scheduler = request.app.state.scheduler
 	await User.create(name=item.name, email=item.email, password=item.password)
-	await delay()
 	return Response(status_code=200)
 
 @auth_router.get(
@@ -92,32 +91,74 @@ class LoginItem(pydantic.BaseModel):
 	name: NameField
 	password: PasswordField
 
+class TokensOut(pydantic.BaseModel):
+	access_token: str
+	refresh_token: str
+
+class LogoutItem(pydantic.BaseModel):
+	refresh_token: str | None = None
+
 @auth_router.post(
 	path='/login',
-	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_LOGIN_TIMES")), seconds=int(os.getenv("LIMITER_LOGIN_SECONDS"))))]
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_LOGIN_TIMES")), seconds=int(os.getenv("LIMITER_LOGIN_SECONDS"))))],
+	response_model=TokensOut
 )
 async def login(item: LoginItem, ctx = Depends(auth.uctx)):
 	uuid = await User.authentication(item.name, item.password)
-	await delay()
 	if uuid:
-		access_token = auth.security.create_access_token(uuid)
-		refresh_token = auth.security.create_refresh_token(uuid)
+		access_token = auth.security.create_access_token(uuid, data=TokenCache.claims())
+		refresh_token = auth.security.create_refresh_token(uuid, data=TokenCache.claims())
 		return {
 			"access_token": access_token,
 			"refresh_token": refresh_token
 		}
 	raise HTTPException(401, "Bad credentials")
 
+@auth_router.post(
+	path='/logout',
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Revokes the access token of the request and, when given, the refresh token"
+)
+async def logout(item: LogoutItem = None, ctx = Depends(auth.ctx)):
+	request_token = await auth.security.get_access_token_from_request(ctx.request)
+	await TokenCache.revoke(request_token.token)
+	if item is not None and item.refresh_token:
+		await TokenCache.revoke(item.refresh_token)
+	return Response(status_code=200)
+
 # ================================
 # [ /users/me ]
 
+class UserInfoOut(pydantic.BaseModel):
+	name: str
+	email: str
+	datetime_create: datetime.datetime
+	hash_datetime_update: datetime.datetime
+	version: int
+	is_admin: bool | None = None
+
+class ChronicleOut(pydantic.BaseModel):
+	id: int
+	datetime_create: datetime.datetime
+	event_code: str
+	details: str | None
+	user_initiator: int
+	user_target: int | None
+	user_agent: str
+	user_address: str
+
+class ChroniclePageOut(pydantic.BaseModel):
+	items: list[ChronicleOut]
+	next_cursor: str | None
+
 @auth_router.get(
 	path='/users/me',
-	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))]
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Profile of the user. Send the `ETag` back as `If-None-Match` to get 304 while it is unchanged",
+	response_model=UserInfoOut
 )
 async def user_info(ctx = Depends(auth.ctx)):
-	data = await User.read_info(ctx.uid)
-	return data
+	return await versioned(ctx.request, "user", ctx.uid, lambda: User.read_info(ctx.uid))
 
 @auth_router.delete(
 	path='/users/me',
@@ -126,6 +167,16 @@ async def user_info(ctx = Depends(auth.ctx)):
 async def user_delete(ctx = Depends(auth.ctx)):
 	await User.delete(ctx.uid)
 	return Response(status_code=200)
+
+@auth_router.get(
+	path='/users/me/history',
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Audit events of the user, newest first. Pass `next_cursor` back as `cursor` for the next page",
+	response_model=ChroniclePageOut
+)
+async def user_history(cursor: Annotated[str | None, Query(max_length=64)] = None, limit: Annotated[int, Query(ge=1, le=200)] = 50, event_code: Annotated[str | None, Query(max_length=UserChronicleModel.event_code.max_length)] = None, ctx = Depends(auth.ctx)):
+	items, next_cursor = await UserChronicle.history(ctx.uid, cursor=cursor, limit=limit, event_code=event_code)
+	return {"items": items, "next_cursor": next_cursor}
 # [ /users/me ]
 # ================================
 
@@ -174,9 +225,14 @@ async def change_user_password(item: ChangePasswordItem, ctx = Depends(auth.ctx)
 class RefreshTokenItem(pydantic.BaseModel):
 	refresh_token: str
 
+class AccessTokenOut(pydantic.BaseModel):
+	access_token: str
+	token_type: str
+
 @auth_router.post(
 	path='/refresh',
-	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_REFRESH_TIMES")), seconds=int(os.getenv("LIMITER_REFRESH_SECONDS"))))]
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_REFRESH_TIMES")), seconds=int(os.getenv("LIMITER_REFRESH_SECONDS"))))],
+	response_model=AccessTokenOut
 )
 async def refresh(request: Request, item: RefreshTokenItem):
 	"""Refresh endpoint that creates a new access token using a refresh token."""
@@ -187,9 +243,11 @@ async def refresh(request: Request, item: RefreshTokenItem):
 			location="headers",
 			type="refresh"
 		))
+		if await TokenCache.is_revoked(item.refresh_token, refresh_token_payload):
+			raise authx.exceptions.RevokedTokenError("Token has been revoked")
 
 		# Create a new access token
-		access_token = auth.security.create_access_token(refresh_token_payload.sub)
+		access_token = auth.security.create_access_token(refresh_token_payload.sub, data=TokenCache.claims())
 		return {"access_token": access_token, "token_type": "bearer"}
 	except Exception as e:
 		raise HTTPException(status_code=401, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,110 @@
+import os
+from typing import Annotated
+from fastapi import APIRouter, Depends, Request, Query
+from limiter import RateLimiter
+from instrumentation import InstrumentedRoute, Metrics, profiler
+from services.server_service import Server
+from responses import ndjson
+from services.password_service import password_executor
+from services.user_service import LoginTiming, SubjectCache
+from services.permission_service import Permission
+from services.metadata_service import Metadata, invalidation_bus
+from services.chronicle_service import chronicle_writer
+from services.rcon_service import rcon_manager
+from services.console_service import console_hub
+from services.status_service import StatusPoller
+from services.token_service import TokenCache
+from services.startup_service import startup_report
+from services.scheduler_service import scheduler, scheduler_leader
+import auth
+import pydantic
+import datetime
+
+__prefix__ = "/internal"
+__tags__ = ["internal"]
+
+internal_router = APIRouter(
+	prefix=__prefix__,
+	tags=__tags__,
+	route_class=InstrumentedRoute
+)
+
+class ServerOut(pydantic.BaseModel):
+	id: int
+	uuid: str
+	name: str
+	module: str
+	operator: int
+	datetime_create: datetime.datetime
+
+class ServerPageOut(pydantic.BaseModel):
+	items: list[ServerOut]
+	next_cursor: str | None
+
+@internal_router.get(
+	path="/stats/db",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Live statistics of the MySQL connection pool. Administrators only"
+)
+async def db_stats(ctx = Depends(auth.actx)):
+	return ctx.request.app.state.dbm.stats()
+
+@internal_router.get(
+	path="/stats/auth",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Password executor, login timing and cache statistics. Administrators only"
+)
+async def auth_stats(ctx = Depends(auth.actx)):
+	return {
+		"password_executor": password_executor.stats(),
+		"login_timing": LoginTiming.stats(),
+		"subject_cache": SubjectCache.stats(),
+		"token_cache": TokenCache.stats(),
+		"rate_limiter": RateLimiter.stats(),
+		"permission_cache": Permission.stats(),
+		"chronicle_writer": chronicle_writer.stats(),
+	}
+
+@internal_router.get(
+	path="/stats/rcon",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Persistent RCON sessions, status polling and live console upstreams of this worker. Administrators only"
+)
+async def rcon_stats(ctx = Depends(auth.actx)):
+	return rcon_manager.stats() | {"status_poller": StatusPoller.stats(), "console": console_hub.stats()}
+
+@internal_router.get(
+	path="/stats/startup",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Boot time of this worker per phase, the state of the lazily loaded scheduler and which worker runs the jobs. Administrators only"
+)
+async def startup_stats(ctx = Depends(auth.actx)):
+	return startup_report.stats() | {"scheduler": scheduler.stats(), "scheduler_leader": await scheduler_leader.stats()}
+
+@internal_router.get(
+	path="/stats/metadata",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Server and group metadata cache of this worker and the cross-worker invalidation channel. Administrators only"
+)
+async def metadata_stats(ctx = Depends(auth.actx)):
+	return Metadata.stats() | {"permission_cache": Permission.stats(), "invalidation_bus": invalidation_bus.stats()}
+
+@internal_router.get(
+	path="/stats/requests",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Per route histograms of request and phase durations seen by this worker and the sampling profiler state. Administrators only"
+)
+async def request_stats(ctx = Depends(auth.actx)):
+	return Metrics.stats() | {"profiler": profiler.stats()}
+
+@internal_router.get(
+	path="/servers",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Every registered server, keyset-paginated by id or streamed as NDJSON. Administrators only",
+	response_model=ServerPageOut
+)
+async def all_servers(cursor: Annotated[str | None, Query(max_length=64)] = None, limit: Annotated[int, Query(ge=1, le=500)] = 50, stream: bool = False, ctx = Depends(auth.actx)):
+	if stream:
+		return ndjson(Server.iter_all())
+	items, next_cursor = await Server.get_all(cursor=cursor, limit=limit)
+	return {"items": items, "next_cursor": next_cursor}
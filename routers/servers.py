@@ -0,0 +1,238 @@
+import os
+import asyncio
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from authx.exceptions import AuthXException
+import pydantic
+import datetime
+from limiter import RateLimiter
+from instrumentation import InstrumentedRoute
+from services.server_service import Server, Group
+from services.rcon_service import rcon_manager
+from services.console_service import console_hub, Viewer
+from services.permission_service import Permission
+from services.status_service import StatusStore
+from responses import ndjson, versioned, hashed
+import auth
+
+__prefix__ = "/servers"
+__tags__ = ["servers"]
+
+servers_router = APIRouter(
+	prefix=__prefix__,
+	tags=__tags__,
+	route_class=InstrumentedRoute
+)
+
+CursorQuery = Annotated[str | None, Query(max_length=64)]
+LimitQuery = Annotated[int, Query(ge=1, le=500)]
+StreamQuery = Annotated[bool, Query(description="Stream every row as NDJSON instead of returning one page")]
+
+class ServerOut(pydantic.BaseModel):
+	id: int
+	uuid: str
+	name: str
+	group_name: str
+	group_slug: str | None
+	usg_id: int | None
+
+class ServerPageOut(pydantic.BaseModel):
+	items: list[ServerOut]
+	next_cursor: str | None
+
+class ServerUserOut(pydantic.BaseModel):
+	id: int
+	name: str
+	group_name: str
+	group_slug: str | None
+	usg_id: int | None
+
+class ServerUserPageOut(pydantic.BaseModel):
+	items: list[ServerUserOut]
+	next_cursor: str | None
+
+class ServerInfoOut(pydantic.BaseModel):
+	uuid: str
+	name: str
+	module: str
+	address: str
+	port: int
+	datetime_create: datetime.datetime
+	version: int
+
+class ServerStatusOut(pydantic.BaseModel):
+	uuid: str
+	name: str
+	status: str
+	latency_ms: float | None = None
+	players: int | None = None
+	error: str | None = None
+	checked_at: datetime.datetime | None = None
+
+class CommandOut(pydantic.BaseModel):
+	result: str | None
+
+class CommandItem(pydantic.BaseModel):
+	command: Annotated[str, pydantic.Field(min_length=1, max_length=512, pattern=r"^[^\x00-\x1f]+$")]
+
+class BroadcastItem(CommandItem):
+	uuids: Annotated[list[str] | None, pydantic.Field(max_length=1000)] = None
+	group: Annotated[str | None, pydantic.Field(max_length=32)] = None
+	parallelism: Annotated[int, pydantic.Field(ge=1, le=int(os.getenv("BROADCAST_MAX_PARALLELISM", 64)))] = 16
+	timeout: Annotated[float, pydantic.Field(gt=0, le=60)] = 5.0
+
+async def get_server_id(uuid: str, ctx = Depends(auth.ctx)) -> int:
+	sid = await Server.get_id_for_uuid(uuid, ctx.uid)
+	if sid is None:
+		raise HTTPException(404, "Server not found")
+	return sid
+
+@servers_router.get(
+	path="",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Servers the user operates or belongs to through a group, ordered by id. Pass `next_cursor` back as `cursor` for the next page",
+	response_model=ServerPageOut
+)
+async def list_servers(cursor: CursorQuery = None, limit: LimitQuery = 50, stream: StreamQuery = False, ctx = Depends(auth.ctx)):
+	if stream:
+		return ndjson(Server.iter_all_for_user(ctx.uid))
+	items, next_cursor = await Server.get_all_for_user(ctx.uid, cursor=cursor, limit=limit)
+	return hashed(ctx.request, {"items": items, "next_cursor": next_cursor})
+
+@servers_router.get(
+	path="/status",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Last polled status, RCON latency and player count of every server the user can reach. Never contacts the game servers",
+	response_model=list[ServerStatusOut]
+)
+async def list_server_status(ctx = Depends(auth.ctx)):
+	servers = await Server.get_targets(ctx.uid)
+	snapshots = await StatusStore.get_many([server["id"] for server in servers])
+	return [
+		{"uuid": server["uuid"], "name": server["name"]} | snapshots.get(server["id"], {"status": "unknown"})
+		for server in servers
+	]
+
+@servers_router.post(
+	path="/broadcast",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description=(
+		"Runs an RCON command on every server the user can reach, narrowed by `uuids` and/or a group `slug`. "
+		"Per-server results are streamed as NDJSON in the order they complete. Servers without the `rcon` permission are reported first"
+	)
+)
+async def broadcast_command(item: BroadcastItem, ctx = Depends(auth.ctx)):
+	targets = {server["id"]: server for server in await Server.get_targets(ctx.uid, uuids=item.uuids, group=item.group)}
+	permissions = await Permission.resolve_many(ctx.uid, targets)
+	allowed = [sid for sid in targets if permissions[sid].has("rcon")]
+
+	async def results():
+		for sid in targets.keys() - set(allowed):
+			yield {"uuid": targets[sid]["uuid"], "name": targets[sid]["name"], "ok": False, "result": None, "error": "Not enough permissions", "elapsed_ms": 0}
+		async for result in rcon_manager.broadcast(allowed, item.command, parallelism=item.parallelism, timeout=item.timeout):
+			server = targets[result.pop("sid")]
+			yield {"uuid": server["uuid"], "name": server["name"]} | result
+
+	return ndjson(results())
+
+@servers_router.get(
+	path="/{uuid}/users",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Operator and group members of a server the user has access to",
+	response_model=ServerUserPageOut
+)
+async def list_server_users(request: Request, cursor: CursorQuery = None, limit: LimitQuery = 50, stream: StreamQuery = False, sid: int = Depends(get_server_id)):
+	if stream:
+		return ndjson(Server.iter_users_for_server(sid))
+	items, next_cursor = await Server.get_users_for_server(sid, cursor=cursor, limit=limit)
+	return hashed(request, {"items": items, "next_cursor": next_cursor})
+
+@servers_router.post(
+	path="/{uuid}/rcon",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Runs an RCON command on the server over its persistent session. Requires the `rcon` permission",
+	response_model=CommandOut
+)
+async def run_command(item: CommandItem, sid: int = Depends(get_server_id), ctx = Depends(auth.ctx)):
+	if not await Group.has_permission(sid, ctx.uid, "rcon"):
+		raise HTTPException(403, "Not enough permissions")
+	return {"result": await rcon_manager.invoke(sid, item.command)}
+
+CONSOLE_RECHECK_SECONDS = float(os.getenv("CONSOLE_RECHECK_SECONDS", 30))
+
+async def _console_guard(websocket: WebSocket, sid: int, uid: int):
+	# however busy the console is, a viewer that lost access, was deactivated or logged out stops watching within the recheck period
+	while True:
+		await asyncio.sleep(CONSOLE_RECHECK_SECONDS)
+		try:
+			subject = await auth.authenticate_websocket(websocket)
+			allowed = subject.id == uid and await Group.has_permission(sid, uid, "console")
+		except (HTTPException, AuthXException):
+			allowed = False
+		if not allowed:
+			await websocket.close(code=1008)
+			return
+
+async def _console_sender(websocket: WebSocket, viewer: Viewer):
+	while True:
+		message = await viewer.queue.get()
+		if message is None:
+			# 1013 "try again later" for a client that could not keep up, 1001 "going away" on shutdown
+			await websocket.close(code=1013 if viewer.dropped else 1001)
+			return
+		await websocket.send_text(message)
+
+async def _console_receiver(websocket: WebSocket):
+	# clients send nothing, reading only notices the disconnect
+	try:
+		while (await websocket.receive())["type"] != "websocket.disconnect":
+			pass
+	except WebSocketDisconnect:
+		pass
+
+@servers_router.websocket("/{uuid}/console")
+async def console(websocket: WebSocket, uuid: str):
+	"""
+	Live chat console of a modmanager server as JSON text frames, {"type": "lines", "lines": [...]} or
+	{"type": "error"}. Needs the `console` permission, the access token goes in the Authorization
+	header or the `token` query parameter. However many viewers a server has, each worker polls it
+	over one RCON session, so the polling grows with the number of workers serving its viewers.
+	Other modules have no console and are refused with 1003
+	"""
+	try:
+		subject = await auth.authenticate_websocket(websocket)
+		sid = await Server.get_id_for_uuid(uuid, subject.id)
+		allowed = sid is not None and await Group.has_permission(sid, subject.id, "console")
+	except (HTTPException, AuthXException):
+		allowed = False
+	if not allowed:
+		await websocket.close(code=1008)
+		return
+	if (await Server.read_info(sid))["module"] not in console_hub.commands:
+		await websocket.close(code=1003)
+		return
+
+	await websocket.accept()
+	viewer = console_hub.subscribe(sid)
+	tasks = {
+		asyncio.create_task(_console_sender(websocket, viewer)),
+		asyncio.create_task(_console_receiver(websocket)),
+		asyncio.create_task(_console_guard(websocket, sid, subject.id)),
+	}
+	try:
+		await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+	finally:
+		# before the first await, a cancelled handler must not leave the viewer subscribed
+		console_hub.unsubscribe(sid, viewer)
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+
+@servers_router.get(
+	path="/{uuid}",
+	dependencies=[Depends(RateLimiter(times=int(os.getenv("LIMITER_GENERAL_TIMES")), seconds=int(os.getenv("LIMITER_GENERAL_SECONDS"))))],
+	description="Details of a server the user has access to. Send the `ETag` back as `If-None-Match` to get 304 while it is unchanged",
+	response_model=ServerInfoOut
+)
+async def server_info(request: Request, sid: int = Depends(get_server_id)):
+	return await versioned(request, "server", sid, lambda: Server.read_info(sid))
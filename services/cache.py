@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+class TTLCache:
+	"""
+	Bounded in-process LRU cache whose entries also expire `ttl` seconds after they were stored
+	"""
+
+	__missing = object()
+
+	def __init__(self, maxsize: int, ttl: float):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.__data = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key, default=None):
+		item = self.__data.get(key, TTLCache.__missing)
+		if item is TTLCache.__missing:
+			self.misses += 1
+			return default
+
+		expires, value = item
+		if expires < time.monotonic():
+			del self.__data[key]
+			self.misses += 1
+			return default
+
+		self.__data.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def set(self, key, value, ttl: float = None):
+		self.__data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+		self.__data.move_to_end(key)
+		while len(self.__data) > self.maxsize:
+			self.__data.popitem(last=False)
+			self.evictions += 1
+
+	def pop(self, key):
+		item = self.__data.pop(key, None)
+		return item[1] if item else None
+
+	def find(self, predicate):
+		"""First live key whose value satisfies `predicate`, a full scan meant for rare lookups"""
+		now = time.monotonic()
+		for key, (expires, value) in self.__data.items():
+			if expires >= now and predicate(value):
+				return key
+		return None
+
+	def clear(self):
+		self.__data.clear()
+
+	def __len__(self) -> int:
+		return len(self.__data)
+
+	def __contains__(self, key) -> bool:
+		item = self.__data.get(key)
+		return item is not None and item[0] >= time.monotonic()
+
+	def stats(self) -> dict:
+		return {
+			"size": len(self.__data),
+			"maxsize": self.maxsize,
+			"ttl": self.ttl,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
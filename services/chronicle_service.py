@@ -0,0 +1,183 @@
+import os
+import gzip
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from models import UserChronicleModel
+
+logger = logging.getLogger(__name__)
+
+class ChronicleWriter:
+	"""
+	Write-behind pipeline for audit events: requests only enqueue, a background task bulk-inserts
+	the queue by `batch_size` or every `interval` seconds. When the queue is full the `overflow`
+	policy decides: "block" waits for room, "drop_newest" discards the new event and
+	"drop_oldest" makes room by discarding the oldest queued one
+	"""
+
+	policies = ("block", "drop_newest", "drop_oldest")
+
+	def __init__(self, batch_size: int = 200, interval: float = 1.0, queue_size: int = 10000, overflow: str = "drop_oldest", retries: int = 3):
+		if overflow not in ChronicleWriter.policies:
+			raise ValueError(f"Unknown overflow policy: {overflow}")
+
+		self.batch_size = batch_size
+		self.interval = interval
+		self.queue_size = queue_size
+		self.overflow = overflow
+		self.retries = retries
+
+		self.__queue: asyncio.Queue | None = None
+		self.__task: asyncio.Task | None = None
+		self.__closing = False
+
+		self.enqueued = 0
+		self.written = 0
+		self.dropped = 0
+		self.failed = 0
+		self.batches = 0
+		self.max_depth = 0
+
+	def __get_queue(self) -> asyncio.Queue:
+		if self.__queue is None:
+			self.__queue = asyncio.Queue(maxsize=self.queue_size)
+		return self.__queue
+
+	async def submit(self, event: dict) -> bool:
+		queue = self.__get_queue()
+		if self.__closing:
+			self.dropped += 1
+			return False
+
+		if queue.full():
+			if self.overflow == "drop_newest":
+				self.dropped += 1
+				return False
+			if self.overflow == "drop_oldest":
+				queue.get_nowait()
+				queue.task_done()
+				self.dropped += 1
+
+		await queue.put(event)
+		self.enqueued += 1
+		self.max_depth = max(self.max_depth, queue.qsize())
+		return True
+
+	async def __collect(self, queue: asyncio.Queue) -> list:
+		batch = [await queue.get()]
+		deadline = asyncio.get_running_loop().time() + self.interval
+		while len(batch) < self.batch_size:
+			timeout = deadline - asyncio.get_running_loop().time()
+			if timeout <= 0:
+				break
+			try:
+				batch.append(await asyncio.wait_for(queue.get(), timeout))
+			except asyncio.TimeoutError:
+				break
+		return batch
+
+	async def __flush(self, batch: list):
+		for attempt in range(self.retries):
+			try:
+				await UserChronicleModel.insert_many(batch).aio_execute()
+				self.written += len(batch)
+				self.batches += 1
+				return
+			except Exception:
+				if attempt == self.retries - 1:
+					logger.exception("Dropping %d audit events after %d failed inserts", len(batch), self.retries)
+				else:
+					await asyncio.sleep(0.5 * 2 ** attempt)
+		self.failed += len(batch)
+
+	async def __run(self):
+		queue = self.__get_queue()
+		while True:
+			batch = await self.__collect(queue)
+			try:
+				await self.__flush(batch)
+			finally:
+				for _ in batch:
+					queue.task_done()
+
+	def start(self):
+		if self.__task is None:
+			self.__closing = False
+			self.__task = asyncio.create_task(self.__run())
+
+	async def stop(self, timeout: float = 10.0):
+		"""Stops accepting events and waits up to `timeout` seconds until everything queued is written"""
+		self.__closing = True
+		if self.__task is None:
+			return
+		try:
+			await asyncio.wait_for(self.__get_queue().join(), timeout)
+		except asyncio.TimeoutError:
+			pass
+		self.__task.cancel()
+		self.__task = None
+
+	def stats(self) -> dict:
+		return {
+			"running": self.__task is not None,
+			"depth": self.__queue.qsize() if self.__queue is not None else 0,
+			"max_depth": self.max_depth,
+			"queue_size": self.queue_size,
+			"overflow": self.overflow,
+			"enqueued": self.enqueued,
+			"written": self.written,
+			"dropped": self.dropped,
+			"failed": self.failed,
+			"batches": self.batches,
+		}
+
+chronicle_writer = ChronicleWriter(
+	batch_size=int(os.getenv("CHRONICLE_BATCH_SIZE", 200)),
+	interval=float(os.getenv("CHRONICLE_FLUSH_INTERVAL", 1.0)),
+	queue_size=int(os.getenv("CHRONICLE_QUEUE_SIZE", 10000)),
+	overflow=os.getenv("CHRONICLE_OVERFLOW", "drop_oldest")
+)
+
+async def purge_chronicles(retention_days: int = None, chunk: int = None, archive_dir: str = None) -> int:
+	"""
+	Retention job: deletes audit events older than `retention_days` in chunks of `chunk` rows so no
+	statement holds locks for long. With `archive_dir` set every chunk is first appended to a daily
+	gzipped JSON lines file
+	"""
+	retention_days = retention_days or int(os.getenv("CHRONICLE_RETENTION_DAYS", 180))
+	chunk = chunk or int(os.getenv("CHRONICLE_PURGE_CHUNK", 5000))
+	archive_dir = archive_dir or os.getenv("CHRONICLE_ARCHIVE_DIR")
+	cutoff = datetime.now() - timedelta(days=retention_days)
+
+	purged = 0
+	while True:
+		rows = await (
+			UserChronicleModel
+			.select()
+			.where(UserChronicleModel.datetime_create < cutoff)
+			.order_by(UserChronicleModel.datetime_create, UserChronicleModel.id)
+			.limit(chunk)
+			.dicts()
+			.aio_execute()
+		)
+		if not rows:
+			break
+
+		if archive_dir:
+			await asyncio.to_thread(_archive, archive_dir, rows)
+		await UserChronicleModel.delete().where(UserChronicleModel.id.in_([row["id"] for row in rows])).aio_execute()
+		purged += len(rows)
+
+		if len(rows) < chunk:
+			break
+		await asyncio.sleep(0.1)
+
+	return purged
+
+def _archive(archive_dir: str, rows: list):
+	os.makedirs(archive_dir, exist_ok=True)
+	path = os.path.join(archive_dir, f"chronicles-{datetime.now():%Y%m%d}.jsonl.gz")
+	with gzip.open(path, "at", encoding="utf8") as file:
+		for row in rows:
+			file.write(json.dumps(row, default=str) + "\n")
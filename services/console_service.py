@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+from responses import dumps
+from . service_exception import ServiceException
+from . rcon_service import rcon_manager
+
+class Viewer:
+	"""One WebSocket client of a console. A client that lets `buffer` messages pile up is cut off"""
+
+	__slots__ = ("queue", "dropped")
+
+	def __init__(self, buffer: int):
+		self.queue = asyncio.Queue(maxsize=buffer)
+		self.dropped = False
+
+	def offer(self, message: str) -> bool:
+		try:
+			self.queue.put_nowait(message)
+			return True
+		except asyncio.QueueFull:
+			self.dropped = True
+			# the pending messages are useless to a client that is cut off, make room for the end marker
+			while not self.queue.empty():
+				self.queue.get_nowait()
+			self.queue.put_nowait(None)
+			return False
+
+	def end(self):
+		"""Ends the stream on shutdown, a full buffer gives up its oldest message for the end marker"""
+		if self.queue.full():
+			self.queue.get_nowait()
+		self.queue.put_nowait(None)
+
+class ConsoleChannel:
+	"""The single upstream poller of one server and the viewers its output is fanned out to"""
+
+	def __init__(self, hub: "ConsoleHub", sid: int):
+		self.hub = hub
+		self.sid = sid
+		self.viewers = set()
+		self.task = None
+		self.polls = 0
+		self.errors = 0
+
+	def start(self):
+		self.task = asyncio.create_task(self.__poll())
+
+	async def __poll(self):
+		while self.hub.channels.get(self.sid) is self:
+			started = time.monotonic()
+			try:
+				connection = await rcon_manager.acquire(self.sid)
+				command = ConsoleHub.commands.get(connection.target.module)
+				if command is None:
+					raise ServiceException("The server module has no console")
+				output = await rcon_manager.invoke(self.sid, command, timeout=self.hub.timeout)
+				self.polls += 1
+				# the buffer is emptied by every read, each line in it is new even if it repeats an earlier one
+				lines = [line for line in (output or "").splitlines() if line.strip()]
+				if lines:
+					self.publish({"type": "lines", "lines": lines, "at": time.time()})
+			except asyncio.CancelledError:
+				raise
+			except Exception as error:
+				self.errors += 1
+				self.publish({"type": "error", "error": getattr(error, "code", None) or str(error), "at": time.time()})
+			await asyncio.sleep(max(self.hub.interval - (time.monotonic() - started), 0))
+
+	def publish(self, message: dict):
+		# serialised once, every viewer gets the same string
+		payload = dumps(message).decode("utf8")
+		for viewer in list(self.viewers):
+			if not viewer.offer(payload):
+				self.hub.dropped += 1
+				self.viewers.discard(viewer)
+		if not self.viewers:
+			self.hub.close_channel(self)
+
+class ConsoleHub:
+	"""
+	Live console of game servers for any number of viewers with one upstream per server and worker:
+	the first viewer of a server starts polling `commands[module]` over its persistent RCON session
+	every `interval` seconds, output lines are fanned out to every viewer through bounded buffers and
+	the poller stops with the last viewer. Only modmanager servers have a console, it keeps a chat
+	buffer per RCON client that is emptied on every read, so the upstreams of several workers do not
+	take lines from each other but each of them polls the server
+	"""
+
+	commands = {
+		"modmanager": os.getenv("CONSOLE_COMMAND_MODMANAGER", "bf2cc clientchatbuffer"),
+	}
+
+	def __init__(self, interval: float = 1.0, timeout: float = 3.0, buffer: int = 64):
+		self.interval = interval
+		self.timeout = timeout
+		self.buffer = buffer
+		self.channels = {}
+		self.dropped = 0
+		self.subscribed = 0
+
+	def subscribe(self, sid: int) -> Viewer:
+		channel = self.channels.get(sid)
+		if channel is None:
+			channel = self.channels[sid] = ConsoleChannel(self, sid)
+			channel.start()
+		viewer = Viewer(self.buffer)
+		channel.viewers.add(viewer)
+		self.subscribed += 1
+		return viewer
+
+	def unsubscribe(self, sid: int, viewer: Viewer):
+		channel = self.channels.get(sid)
+		if channel is None:
+			return
+		channel.viewers.discard(viewer)
+		if not channel.viewers:
+			self.close_channel(channel)
+
+	def close_channel(self, channel: ConsoleChannel):
+		if self.channels.get(channel.sid) is channel:
+			del self.channels[channel.sid]
+		if channel.task is not None and channel.task is not asyncio.current_task():
+			channel.task.cancel()
+		channel.task = None
+
+	async def close(self):
+		for channel in list(self.channels.values()):
+			for viewer in channel.viewers:
+				# not offer(), a viewer with a full buffer would count as dropped and be closed with 1013
+				viewer.end()
+			self.close_channel(channel)
+
+	def stats(self) -> dict:
+		return {
+			"interval": self.interval,
+			"buffer": self.buffer,
+			"upstreams": len(self.channels),
+			"viewers": sum(len(channel.viewers) for channel in self.channels.values()),
+			"subscribed": self.subscribed,
+			"dropped": self.dropped,
+			"channels": {sid: {"viewers": len(channel.viewers), "polls": channel.polls, "errors": channel.errors} for sid, channel in self.channels.items()},
+		}
+
+console_hub = ConsoleHub(
+	interval=float(os.getenv("CONSOLE_POLL_INTERVAL", 1.0)),
+	timeout=float(os.getenv("CONSOLE_POLL_TIMEOUT", 3.0)),
+	buffer=int(os.getenv("CONSOLE_BUFFER", 64)),
+)
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import asyncio
+import secrets
+from models import ServerModel, ServerGroupModel
+from . cache import TTLCache
+
+class InvalidationBus:
+	"""
+	Carries cache invalidations between workers over a Redis pub/sub channel. publish() returns at
+	once, the message is sent in the background and every other worker runs the handlers registered
+	for its kind. Messages sent while a worker is not subscribed are lost, so on every (re)subscribe
+	the reset handlers drop everything that may have been missed. Without bind_redis() nothing leaves
+	the process. A publish is retried `attempts` times; once it is given up a reset is sent to
+	every worker as soon as Redis takes it again, the cache TTLs bound staleness until then
+	"""
+
+	def __init__(self, channel: str = "myadminka:invalidate", retry: float = 1.0, attempts: int = 3):
+		self.channel = channel
+		self.retry = retry
+		self.attempts = attempts
+		self.origin = secrets.token_hex(6)
+		self.redis = None
+		self.connected = False
+		self.__handlers = {}
+		self.__resets = []
+		self.__task = None
+		self.__sending = set()
+		self.__resetting = None
+		self.__lost = 0
+		self.__published = 0
+		self.__received = 0
+		self.__failed = 0
+		self.__subscribes = 0
+		self.__lag_seconds = 0.0
+		self.__max_lag_seconds = 0.0
+
+	def bind_redis(self, connection):
+		self.redis = connection
+
+	def register(self, kind: str, handler, reset=None):
+		"""`handler(key)` runs for every remote invalidation of `kind`, `reset()` whenever messages may have been lost"""
+		self.__handlers.setdefault(kind, []).append(handler)
+		if reset is not None:
+			self.__resets.append(reset)
+
+	def publish(self, kind: str, key):
+		if self.redis is None:
+			return
+		task = asyncio.get_running_loop().create_task(self.__send(json.dumps([kind, key, self.origin, time.time()])))
+		self.__sending.add(task)
+		task.add_done_callback(self.__sending.discard)
+
+	async def __send(self, message: str):
+		for attempt in range(self.attempts):
+			try:
+				await self.redis.publish(self.channel, message)
+				self.__published += 1
+				return
+			except Exception:
+				self.__failed += 1
+			await asyncio.sleep(self.retry * 2 ** attempt)
+		self.__lost += 1
+		if self.__resetting is None:
+			self.__resetting = asyncio.create_task(self.__send_reset())
+
+	async def __send_reset(self):
+		# the lost message may have been anything, every other worker drops everything it caches
+		message = json.dumps(["reset", None, self.origin, time.time()])
+		while True:
+			try:
+				await self.redis.publish(self.channel, message)
+				self.__published += 1
+				break
+			except Exception:
+				self.__failed += 1
+			await asyncio.sleep(self.retry)
+		self.__resetting = None
+
+	def start(self):
+		if self.redis is not None and self.__task is None:
+			self.__task = asyncio.create_task(self.__listen())
+
+	async def __listen(self):
+		while True:
+			pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+			try:
+				await pubsub.subscribe(self.channel)
+				self.connected = True
+				self.__subscribes += 1
+				for reset in self.__resets:
+					reset()
+				async for message in pubsub.listen():
+					if message["type"] == "message":
+						self.__dispatch(message["data"])
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				self.__failed += 1
+			finally:
+				self.connected = False
+				try:
+					await pubsub.reset()
+				except Exception:
+					pass
+			await asyncio.sleep(self.retry)
+
+	def __dispatch(self, data):
+		try:
+			kind, key, origin, sent = json.loads(data)
+		except ValueError:
+			return
+		if origin == self.origin:
+			return
+		self.__received += 1
+		lag = max(time.time() - sent, 0.0)
+		self.__lag_seconds += lag
+		self.__max_lag_seconds = max(self.__max_lag_seconds, lag)
+		if kind == "reset":
+			for reset in self.__resets:
+				reset()
+			return
+		for handler in self.__handlers.get(kind, ()):
+			handler(key)
+
+	async def stop(self):
+		if self.__task is not None:
+			task, self.__task = self.__task, None
+			task.cancel()
+			# lets the listener unsubscribe and release its connection
+			await asyncio.gather(task, return_exceptions=True)
+		if self.__resetting is not None:
+			self.__resetting.cancel()
+		if self.__sending:
+			await asyncio.gather(*self.__sending, return_exceptions=True)
+
+	def stats(self) -> dict:
+		return {
+			"shared": self.redis is not None,
+			"connected": self.connected,
+			"subscribes": self.__subscribes,
+			"published": self.__published,
+			"received": self.__received,
+			"failed": self.__failed,
+			"lost": self.__lost,
+			"avg_lag_ms": round(self.__lag_seconds / (self.__received or 1) * 1000, 3),
+			"max_lag_ms": round(self.__max_lag_seconds * 1000, 3),
+		}
+
+invalidation_bus = InvalidationBus(channel=os.getenv("INVALIDATION_CHANNEL", "myadminka:invalidate"))
+
+class Metadata:
+	"""
+	Read-through cache of rarely changing server and group rows: server uuid -> (id, operator) and
+	server id -> its groups. Rows are loaded from the primary, a lagging replica would put an old
+	row back right after an invalidation. Writes drop the entries here and, through the
+	invalidation bus, in every other worker
+	"""
+
+	servers = TTLCache(maxsize=int(os.getenv("METADATA_SERVERS_SIZE", 20000)), ttl=int(os.getenv("METADATA_CACHE_TTL", 300)))
+	# server id -> uuid, lets an invalidation by id find the uuid entry without scanning `servers`
+	uuids = TTLCache(maxsize=int(os.getenv("METADATA_SERVERS_SIZE", 20000)), ttl=int(os.getenv("METADATA_CACHE_TTL", 300)))
+	groups = TTLCache(maxsize=int(os.getenv("METADATA_GROUPS_SIZE", 5000)), ttl=int(os.getenv("METADATA_CACHE_TTL", 300)))
+	# servers with more groups than this are not cached, their lookups go to MySQL
+	max_groups = int(os.getenv("METADATA_MAX_GROUPS", 200))
+	too_many = object()
+	# raised by every invalidation, a row loaded while it changed is returned but not cached
+	epoch = 0
+
+	local_invalidations = 0
+	remote_invalidations = 0
+	stale_drops = 0
+
+	@staticmethod
+	async def server(uuid: str) -> tuple | None:
+		"""(id, operator id) of the server with this uuid"""
+		row = Metadata.servers.get(uuid)
+		if row is not None:
+			# keeps the id -> uuid entry as recently used as the row it points to
+			Metadata.uuids.get(row[0])
+			return row
+		epoch = Metadata.epoch
+		row = await ServerModel.select(ServerModel.id, ServerModel.operator).where(ServerModel.uuid == uuid).tuples().aio_first()
+		if row is None:
+			return None
+		if epoch == Metadata.epoch:
+			Metadata.servers.set(uuid, row)
+			Metadata.uuids.set(row[0], uuid)
+		return row
+
+	@staticmethod
+	async def server_groups(sid: int) -> tuple | None:
+		"""Groups of the server as dicts ordered by id, None when the server has too many to cache"""
+		groups = Metadata.groups.get(sid)
+		if groups is None:
+			epoch = Metadata.epoch
+			rows = await (
+				ServerGroupModel
+				.select(ServerGroupModel.id, ServerGroupModel.slug, ServerGroupModel.name, ServerGroupModel.datetime_create)
+				.where(ServerGroupModel.server == sid)
+				.order_by(ServerGroupModel.id)
+				.limit(Metadata.max_groups + 1)
+				.dicts()
+				.aio_execute()
+			)
+			groups = tuple(rows) if len(rows) <= Metadata.max_groups else Metadata.too_many
+			if epoch == Metadata.epoch:
+				Metadata.groups.set(sid, groups)
+		return None if groups is Metadata.too_many else groups
+
+	@staticmethod
+	def __drop_server(sid: int) -> bool:
+		Metadata.epoch += 1
+		uuid = Metadata.uuids.pop(sid)
+		if uuid is None:
+			# the id entry may have been evicted or expired apart from its row
+			uuid = Metadata.servers.find(lambda row: row[0] == sid)
+		return uuid is not None and Metadata.servers.pop(uuid) is not None
+
+	@staticmethod
+	def invalidate_server(sid: int):
+		Metadata.local_invalidations += 1
+		Metadata.__drop_server(sid)
+		invalidation_bus.publish("server", sid)
+
+	@staticmethod
+	def invalidate_groups(sid: int):
+		Metadata.local_invalidations += 1
+		Metadata.epoch += 1
+		Metadata.groups.pop(sid)
+		invalidation_bus.publish("groups", sid)
+
+	@staticmethod
+	def on_server(sid: int):
+		Metadata.remote_invalidations += 1
+		if Metadata.__drop_server(sid):
+			Metadata.stale_drops += 1
+
+	@staticmethod
+	def on_groups(sid: int):
+		Metadata.remote_invalidations += 1
+		Metadata.epoch += 1
+		if Metadata.groups.pop(sid) is not None:
+			Metadata.stale_drops += 1
+
+	@staticmethod
+	def reset():
+		Metadata.epoch += 1
+		Metadata.servers.clear()
+		Metadata.uuids.clear()
+		Metadata.groups.clear()
+
+	@staticmethod
+	def stats() -> dict:
+		return {
+			"servers": Metadata.servers.stats(),
+			"groups": Metadata.groups.stats(),
+			"local_invalidations": Metadata.local_invalidations,
+			"remote_invalidations": Metadata.remote_invalidations,
+			"stale_drops": Metadata.stale_drops,
+		}
+
+invalidation_bus.register("server", Metadata.on_server, reset=Metadata.reset)
+invalidation_bus.register("groups", Metadata.on_groups)
@@ -0,0 +1,105 @@
+import os
+import time
+import asyncio
+import bcrypt
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from . service_exception import ServiceUnavailableException
+from instrumentation import record
+
+def _hashpw(value: bytes) -> tuple[float, float, bytes]:
+	started = time.perf_counter()
+	result = bcrypt.hashpw(value, bcrypt.gensalt())
+	return started, time.perf_counter(), result
+
+def _checkpw(value: bytes, hashed: bytes) -> tuple[float, float, bool]:
+	started = time.perf_counter()
+	result = bcrypt.checkpw(value, hashed)
+	return started, time.perf_counter(), result
+
+class PasswordExecutor:
+	"""
+	Runs bcrypt off the event loop. At most `workers` hashes run at once and at most
+	`queue_limit` more may wait for a worker, everything beyond that is rejected immediately
+	"""
+
+	kinds = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+	def __init__(self, kind: str = "thread", workers: int = 4, queue_limit: int = 64):
+		if kind not in PasswordExecutor.kinds:
+			raise ValueError(f"Unknown password executor kind: {kind}")
+
+		self.kind = kind
+		self.workers = workers
+		self.queue_limit = queue_limit
+
+		self.__executor: Executor | None = None
+		self.__pending = 0
+		self.__submitted = 0
+		self.__completed = 0
+		self.__failed = 0
+		self.__rejected = 0
+		self.__max_queued = 0
+		self.__wait_seconds = 0.0
+		self.__run_seconds = 0.0
+
+	def __get_executor(self) -> Executor:
+		if self.__executor is None:
+			self.__executor = PasswordExecutor.kinds[self.kind](max_workers=self.workers)
+		return self.__executor
+
+	async def __submit(self, function, *args):
+		if self.__pending >= self.workers + self.queue_limit:
+			self.__rejected += 1
+			raise ServiceUnavailableException("Too many password operations in progress, try again later", code="password_executor_saturated")
+
+		self.__submitted += 1
+		self.__pending += 1
+		self.__max_queued = max(self.__max_queued, self.__pending - self.workers)
+		queued = time.perf_counter()
+		try:
+			started, finished, result = await asyncio.get_running_loop().run_in_executor(self.__get_executor(), function, *args)
+		except Exception:
+			self.__failed += 1
+			raise
+		finally:
+			self.__pending -= 1
+
+		self.__completed += 1
+		self.__wait_seconds += max(started - queued, 0.0)
+		self.__run_seconds += finished - started
+		record("bcrypt_wait", max(started - queued, 0.0))
+		record("bcrypt", finished - started)
+		return result
+
+	async def hash(self, value: str) -> bytes:
+		return await self.__submit(_hashpw, value.encode("utf8"))
+
+	async def verify(self, value: str, hashed: str) -> bool:
+		return await self.__submit(_checkpw, value.encode("utf8"), hashed.encode("utf8"))
+
+	def stats(self) -> dict:
+		completed = self.__completed or 1
+		return {
+			"kind": self.kind,
+			"workers": self.workers,
+			"queue_limit": self.queue_limit,
+			"in_flight": self.__pending,
+			"max_queued": self.__max_queued,
+			"submitted": self.__submitted,
+			"completed": self.__completed,
+			"failed": self.__failed,
+			"rejected": self.__rejected,
+			"avg_wait_ms": round(self.__wait_seconds / completed * 1000, 3),
+			"avg_run_ms": round(self.__run_seconds / completed * 1000, 3),
+		}
+
+	def shutdown(self):
+		if self.__executor is not None:
+			self.__executor.shutdown(wait=True, cancel_futures=True)
+			self.__executor = None
+
+password_executor = PasswordExecutor(
+	kind=os.getenv("PASSWORD_EXECUTOR", "thread"),
+	workers=int(os.getenv("PASSWORD_WORKERS", min(4, os.cpu_count() or 1))),
+	queue_limit=int(os.getenv("PASSWORD_QUEUE_LIMIT", 64))
+)
@@ -0,0 +1,144 @@
+import os
+from models import ServerModel, ServerGroupModel, UserServerGroupModel, ServerGroupPermissionModel, _get_slug
+from peewee import *
+from . cache import TTLCache
+from . metadata_service import invalidation_bus
+
+class PermissionSet:
+	"""
+	Effective permissions of one user on one server. Values are slugs, "*" grants everything and
+	"kick_*" grants every permission below "kick"
+	"""
+
+	__slots__ = ("operator", "member", "everything", "exact", "prefixes")
+
+	def __init__(self, values=(), operator: bool = False, member: bool = False):
+		self.operator = operator
+		self.member = member or operator
+		self.everything = operator
+		self.exact = set()
+		self.prefixes = set()
+		for value in values:
+			if value == "*":
+				self.everything = True
+			elif value.endswith("_*"):
+				self.prefixes.add(value[:-2])
+			else:
+				self.exact.add(value)
+
+	def has(self, permission: str) -> bool:
+		if self.everything or permission in self.exact:
+			return True
+		if self.prefixes:
+			parts = permission.split("_")
+			for i in range(1, len(parts)):
+				if "_".join(parts[:i]) in self.prefixes:
+					return True
+		return False
+
+	def has_all(self, *permissions: str) -> bool:
+		return all(self.has(permission) for permission in permissions)
+
+	def has_any(self, *permissions: str) -> bool:
+		return any(self.has(permission) for permission in permissions)
+
+	def check(self, permissions) -> dict:
+		return {permission: self.has(permission) for permission in permissions}
+
+class Permission:
+
+	cache = TTLCache(maxsize=int(os.getenv("PERMISSION_CACHE_SIZE", 10000)), ttl=int(os.getenv("PERMISSION_CACHE_TTL", 60)))
+	generations = {}
+	# raised by reset() and on_deleted(), part of every generation so sets compiled before a reset are never stored as current
+	epoch = 0
+
+	@staticmethod
+	def normalize(value: str) -> str:
+		value = value.strip()
+		if value.endswith("*"):
+			prefix = _get_slug(value[:-1])
+			return f"{prefix}_*" if prefix else "*"
+		return _get_slug(value)
+
+	@staticmethod
+	def invalidate_server(sid: int):
+		Permission.on_server(sid)
+		invalidation_bus.publish("permissions", sid)
+
+	@staticmethod
+	def on_server(sid: int):
+		Permission.generations[sid] = Permission.generations.get(sid, 0) + 1
+
+	@staticmethod
+	def forget_server(sid: int):
+		"""invalidate_server() for a deleted server, its generation is dropped instead of kept forever"""
+		Permission.on_deleted(sid)
+		invalidation_bus.publish("permissions_deleted", sid)
+
+	@staticmethod
+	def on_deleted(sid: int):
+		# a generation that starts over could match an entry cached before, the epoch outdates all of them
+		Permission.generations.pop(sid, None)
+		Permission.epoch += 1
+
+	@staticmethod
+	def reset():
+		Permission.epoch += 1
+		Permission.cache.clear()
+
+	@staticmethod
+	async def resolve(sid: int, uid: int) -> PermissionSet:
+		return (await Permission.resolve_many(uid, [sid]))[sid]
+
+	@staticmethod
+	async def resolve_many(uid: int, sids) -> dict:
+		result = {}
+		missing = []
+		for sid in set(sids):
+			generation = (Permission.epoch, Permission.generations.get(sid, 0))
+			cached = Permission.cache.get((sid, uid))
+			if cached is not None and cached[0] == generation:
+				result[sid] = cached[1]
+			else:
+				missing.append((sid, generation))
+
+		if missing:
+			compiled = await Permission.__compile(uid, [sid for sid, _ in missing])
+			for sid, generation in missing:
+				result[sid] = compiled[sid]
+				Permission.cache.set((sid, uid), (generation, compiled[sid]))
+
+		return result
+
+	@staticmethod
+	async def __compile(uid: int, sids: list) -> dict:
+		owner_query = (
+			ServerModel
+			.select(ServerModel.id.alias("sid"), Value(None).alias("value"), Value(1).alias("owner"))
+			.where((ServerModel.id.in_(sids)) & (ServerModel.operator == uid))
+		)
+		group_query = (
+			ServerGroupModel
+			.select(ServerGroupModel.server.alias("sid"), ServerGroupPermissionModel.value.alias("value"), Value(0).alias("owner"))
+			.join(UserServerGroupModel, on=(ServerGroupModel.id == UserServerGroupModel.group))
+			.join(ServerGroupPermissionModel, JOIN.LEFT_OUTER, on=(ServerGroupModel.id == ServerGroupPermissionModel.group))
+			.where((ServerGroupModel.server.in_(sids)) & (UserServerGroupModel.user == uid))
+		)
+
+		rows = {sid: [False, False, []] for sid in sids}
+		for sid, value, owner in await (owner_query + group_query).tuples().aio_execute():
+			row = rows[sid]
+			if owner:
+				row[0] = True
+			else:
+				row[1] = True
+				if value is not None: row[2].append(value)
+
+		return {sid: PermissionSet(values, operator=operator, member=member) for sid, (operator, member, values) in rows.items()}
+
+	@staticmethod
+	def stats() -> dict:
+		return Permission.cache.stats()
+
+invalidation_bus.register("permissions", Permission.on_server, reset=Permission.reset)
+invalidation_bus.register("permissions_deleted", Permission.on_deleted)
@@ -0,0 +1,381 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from models import ServerModel
+from . service_exception import ServiceException, ServiceUnavailableException
+from . metadata_service import invalidation_bus
+
+class RconException(ServiceUnavailableException):
+	pass
+
+class RconTarget:
+
+	__slots__ = ("address", "port", "password", "module")
+
+	def __init__(self, address: str, port: int, password: str, module: str = "default"):
+		self.address = address
+		self.port = port
+		self.password = password
+		self.module = module
+
+class RconConnection:
+	"""
+	One authenticated BF2142 RCON session. Commands are written as soon as they arrive and the server
+	answers them in order, each reply terminated by 0x04, so the reader task resolves the oldest
+	pending future with every reply. Up to `max_in_flight` commands share the socket at once. A
+	command that times out closes the session, the manager opens a new one for the next command
+	"""
+
+	def __init__(self, target: RconTarget, max_in_flight: int = 32):
+		self.target = target
+		self.max_in_flight = max_in_flight
+		self.connected_at = None
+		self.last_used = time.monotonic()
+		self.commands = 0
+
+		self.__reader: asyncio.StreamReader | None = None
+		self.__writer: asyncio.StreamWriter | None = None
+		self.__task: asyncio.Task | None = None
+		self.__pending = deque()
+		self.__slots = asyncio.Semaphore(max_in_flight)
+		self.__closed = False
+
+	@property
+	def closed(self) -> bool:
+		return self.__closed
+
+	@property
+	def in_flight(self) -> int:
+		return len(self.__pending)
+
+	async def connect(self, timeout: float):
+		self.__reader, self.__writer = await asyncio.wait_for(asyncio.open_connection(self.target.address, self.target.port), timeout)
+		try:
+			welcome = await asyncio.wait_for(self.__reader.readuntil(b"\n\n"), timeout)
+			prefix = b"### Digest seed: "
+			position = welcome.find(prefix)
+			if position == -1:
+				raise RconException("RCON server did not send a digest seed", code="rcon_auth")
+			seed = welcome[position + len(prefix):welcome.find(b"\n", position)]
+
+			digest = hashlib.md5(seed + self.target.password.encode("utf8")).hexdigest()
+			self.__writer.write(f"\x02login {digest}\n".encode("utf8"))
+			await self.__writer.drain()
+			reply = await asyncio.wait_for(self.__reader.readuntil(b"\n"), timeout)
+			if b"Authentication successful" not in reply:
+				raise RconException("RCON authentication failed", code="rcon_auth")
+		except BaseException:
+			await self.close()
+			raise
+
+		self.connected_at = time.monotonic()
+		self.__task = asyncio.create_task(self.__read())
+
+	async def __read(self):
+		try:
+			while True:
+				data = await self.__reader.readuntil(b"\x04")
+				future = self.__pending.popleft()
+				if not future.done():
+					future.set_result(data[:-1].decode("utf8", errors="replace"))
+		except Exception as error:
+			self.__fail(error)
+
+	def __fail(self, error: Exception):
+		self.__closed = True
+		while self.__pending:
+			future = self.__pending.popleft()
+			if not future.done():
+				future.set_exception(RconException(f"RCON connection lost: {error!r}", code="rcon_disconnected"))
+
+	async def invoke(self, command: str, timeout: float) -> str | None:
+		async with self.__slots:
+			if self.__closed:
+				raise RconException("RCON connection is closed", code="rcon_disconnected")
+
+			future = asyncio.get_running_loop().create_future()
+			self.__pending.append(future)
+			self.last_used = time.monotonic()
+			self.commands += 1
+			self.__writer.write(f"\x02{command}\n".encode("utf8"))
+			try:
+				await self.__writer.drain()
+				result = await asyncio.wait_for(future, timeout)
+			except asyncio.TimeoutError:
+				# the reply may never come, every later reply would be matched to the wrong command
+				await self.close()
+				raise RconException("RCON command timed out", code="rcon_timeout")
+			except ConnectionError as error:
+				self.__fail(error)
+				raise RconException(f"RCON connection lost: {error!r}", code="rcon_disconnected")
+			finally:
+				self.last_used = time.monotonic()
+
+		result = result.removesuffix("\n")
+		return result if result.strip() else None
+
+	async def close(self):
+		self.__closed = True
+		if self.__task is not None:
+			self.__task.cancel()
+		self.__fail(ConnectionAbortedError("closed"))
+		if self.__writer is not None:
+			self.__writer.close()
+			try:
+				await self.__writer.wait_closed()
+			except Exception:
+				pass
+
+class RconManager:
+	"""
+	Keeps one persistent RCON session per server id. Sessions open lazily on the first command,
+	close after `idle_timeout` seconds without use and are limited to `max_connections` in total,
+	the least recently used idle session is closed to make room. A server that failed to connect
+	is not retried before its backoff, doubling from `backoff` up to `backoff_max` seconds, ends.
+	Addresses and passwords are read from the primary and forgotten in every worker through the
+	invalidation bus when a server changes
+	"""
+
+	def __init__(self, max_connections: int = 500, idle_timeout: float = 300.0, connect_timeout: float = 5.0,
+			command_timeout: float = 5.0, max_in_flight: int = 32, backoff: float = 1.0, backoff_max: float = 60.0):
+		self.max_connections = max_connections
+		self.idle_timeout = idle_timeout
+		self.connect_timeout = connect_timeout
+		self.command_timeout = command_timeout
+		self.max_in_flight = max_in_flight
+		self.backoff = backoff
+		self.backoff_max = backoff_max
+
+		self.__targets = {}
+		self.__connections = OrderedDict()
+		# sid -> [lock, number of acquire() calls using it], dropped with the last one
+		self.__locks = {}
+		self.__failures = {}
+		self.__connecting = 0
+		self.__closing = set()
+		# raised whenever a target is forgotten, a target loaded meanwhile is read again
+		self.__epoch = 0
+		self.__task: asyncio.Task | None = None
+
+		self.connects = 0
+		self.connect_failures = 0
+		self.evictions = 0
+		self.commands = 0
+		self.command_failures = 0
+
+	def register(self, sid: int, address: str, port: int, password: str, module: str = "default"):
+		self.__targets[sid] = RconTarget(address, port, password, module)
+
+	def __forget(self, sid: int) -> RconConnection | None:
+		self.__epoch += 1
+		self.__targets.pop(sid, None)
+		self.__failures.pop(sid, None)
+		return self.__connections.pop(sid, None)
+
+	async def invalidate(self, sid: int):
+		"""Forgets the cached address and password of a server and closes its session, here and in every other worker"""
+		connection = self.__forget(sid)
+		invalidation_bus.publish("rcon", sid)
+		if connection is not None:
+			await connection.close()
+
+	def __close_later(self, connection: RconConnection):
+		task = asyncio.get_running_loop().create_task(connection.close())
+		self.__closing.add(task)
+		task.add_done_callback(self.__closing.discard)
+
+	def on_invalidate(self, sid: int):
+		connection = self.__forget(sid)
+		if connection is not None:
+			self.__close_later(connection)
+
+	def reset(self):
+		# invalidations may have been missed, any session may talk to an old address or password
+		self.__epoch += 1
+		self.__targets.clear()
+		for connection in self.__connections.values():
+			self.__close_later(connection)
+		self.__connections.clear()
+
+	async def __get_target(self, sid: int) -> RconTarget:
+		target = self.__targets.get(sid)
+		while target is None:
+			epoch = self.__epoch
+			# a replica may still return the row from before the change that made us forget it
+			server = await (
+				ServerModel
+				.select(ServerModel.address, ServerModel.port, ServerModel.hash, ServerModel.module)
+				.where(ServerModel.id == sid)
+				.aio_first()
+			)
+			if server is None:
+				raise ServiceException("Server not found")
+			if epoch == self.__epoch:
+				target = self.__targets[sid] = RconTarget(server.address, server.port, server.hash, server.module)
+		return target
+
+	def __reserve(self) -> RconConnection | None:
+		"""Takes a slot for a new session, connects in progress count as sessions. Returns the idle session evicted for it"""
+		evicted = None
+		if len(self.__connections) + self.__connecting >= self.max_connections:
+			for sid, connection in self.__connections.items():
+				if not connection.in_flight:
+					evicted = self.__connections.pop(sid)
+					self.evictions += 1
+					break
+			else:
+				raise RconException("Too many RCON connections", code="rcon_capacity")
+		self.__connecting += 1
+		return evicted
+
+	async def acquire(self, sid: int) -> RconConnection:
+		connection = self.__connections.get(sid)
+		if connection is not None and not connection.closed:
+			self.__connections.move_to_end(sid)
+			return connection
+
+		entry = self.__locks.get(sid)
+		if entry is None:
+			entry = self.__locks[sid] = [asyncio.Lock(), 0]
+		entry[1] += 1
+		try:
+			async with entry[0]:
+				return await self.__connect(sid)
+		finally:
+			entry[1] -= 1
+			if not entry[1]:
+				del self.__locks[sid]
+
+	async def __connect(self, sid: int) -> RconConnection:
+		connection = self.__connections.get(sid)
+		if connection is not None:
+			if not connection.closed:
+				return connection
+			del self.__connections[sid]
+			await connection.close()
+
+		failures, retry_at = self.__failures.get(sid, (0, 0.0))
+		if time.monotonic() < retry_at:
+			raise RconException("RCON server is unreachable, retrying later", code="rcon_backoff")
+
+		while True:
+			target = await self.__get_target(sid)
+			evicted = self.__reserve()
+			try:
+				if evicted is not None:
+					await evicted.close()
+				connection = RconConnection(target, self.max_in_flight)
+				try:
+					await connection.connect(self.connect_timeout)
+				except Exception as error:
+					self.connect_failures += 1
+					self.__failures[sid] = (failures + 1, time.monotonic() + min(self.backoff * 2 ** failures, self.backoff_max))
+					if isinstance(error, RconException):
+						raise
+					raise RconException(f"RCON server is unreachable: {error!r}", code="rcon_unreachable")
+			finally:
+				self.__connecting -= 1
+
+			if self.__targets.get(sid) is target:
+				break
+			# the server changed while connecting, the session may use the old address or password
+			await connection.close()
+
+		self.connects += 1
+		self.__failures.pop(sid, None)
+		self.__connections[sid] = connection
+		return connection
+
+	async def invoke(self, sid: int, command: str, timeout: float = None) -> str | None:
+		connection = await self.acquire(sid)
+		try:
+			result = await connection.invoke(command, timeout or self.command_timeout)
+		except RconException:
+			self.command_failures += 1
+			raise
+		self.commands += 1
+		return result
+
+	async def broadcast(self, sids, command: str, parallelism: int = 16, timeout: float = None):
+		"""
+		Runs `command` on every server, at most `parallelism` at a time, and yields a result dict per
+		server in completion order. `timeout` bounds connecting and the command together per server
+		"""
+		semaphore = asyncio.Semaphore(parallelism)
+		timeout = timeout or self.command_timeout
+
+		async def run(sid: int) -> dict:
+			async with semaphore:
+				started = time.perf_counter()
+				result, error = None, None
+				try:
+					result = await asyncio.wait_for(self.invoke(sid, command, timeout), timeout)
+				except asyncio.TimeoutError:
+					error = "RCON command timed out"
+				except ServiceException as exception:
+					error = exception.detail
+				except Exception as exception:
+					# a database or socket error only fails this server, the stream goes on
+					error = f"RCON command failed: {exception!r}"
+				return {"sid": sid, "ok": error is None, "result": result, "error": error, "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+		tasks = [asyncio.create_task(run(sid)) for sid in sids]
+		try:
+			for task in asyncio.as_completed(tasks):
+				yield await task
+		finally:
+			# the consumer went away, stop the servers not reached yet
+			for task in tasks:
+				task.cancel()
+
+	async def __evict_idle(self):
+		while True:
+			await asyncio.sleep(max(self.idle_timeout / 2, 1))
+			deadline = time.monotonic() - self.idle_timeout
+			for sid, connection in list(self.__connections.items()):
+				if connection.closed or (not connection.in_flight and connection.last_used < deadline):
+					if self.__connections.get(sid) is connection:
+						del self.__connections[sid]
+					self.evictions += 1
+					await connection.close()
+
+	def start(self):
+		if self.__task is None:
+			self.__task = asyncio.create_task(self.__evict_idle())
+
+	async def close(self):
+		if self.__task is not None:
+			self.__task.cancel()
+			self.__task = None
+		connections = list(self.__connections.values())
+		self.__connections.clear()
+		await asyncio.gather(*(connection.close() for connection in connections), *self.__closing, return_exceptions=True)
+
+	def stats(self) -> dict:
+		now = time.monotonic()
+		return {
+			"connections": len(self.__connections),
+			"connecting": self.__connecting,
+			"max_connections": self.max_connections,
+			"in_flight": sum(connection.in_flight for connection in self.__connections.values()),
+			"backing_off": sum(1 for _, retry_at in self.__failures.values() if retry_at > now),
+			"connects": self.connects,
+			"connect_failures": self.connect_failures,
+			"evictions": self.evictions,
+			"commands": self.commands,
+			"command_failures": self.command_failures,
+		}
+
+rcon_manager = RconManager(
+	max_connections=int(os.getenv("RCON_MAX_CONNECTIONS", 500)),
+	idle_timeout=float(os.getenv("RCON_IDLE_TIMEOUT", 300)),
+	connect_timeout=float(os.getenv("RCON_CONNECT_TIMEOUT", 5)),
+	command_timeout=float(os.getenv("RCON_COMMAND_TIMEOUT", 5)),
+	max_in_flight=int(os.getenv("RCON_MAX_IN_FLIGHT", 32)),
+	backoff=float(os.getenv("RCON_BACKOFF", 1)),
+	backoff_max=float(os.getenv("RCON_BACKOFF_MAX", 60))
+)
+
+invalidation_bus.register("rcon", rcon_manager.on_invalidate, reset=rcon_manager.reset)
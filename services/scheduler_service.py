@@ -0,0 +1,194 @@
+import os
+import time
+import socket
+import asyncio
+import secrets
+
+class LazyScheduler:
+	"""
+	AsyncIOScheduler that imports APScheduler and builds its job store only when first used. Jobs
+	added before that are kept and handed over on start(). With `jobstore_url` set the jobs are
+	persisted through SQLAlchemy, otherwise they live in memory, which is enough for jobs that are
+	registered again on every start
+	"""
+
+	def __init__(self, jobstore_url: str = None):
+		self.jobstore_url = jobstore_url
+		self.__scheduler = None
+		self.__jobs = []
+
+	@property
+	def loaded(self) -> bool:
+		return self.__scheduler is not None
+
+	@property
+	def scheduler(self):
+		if self.__scheduler is None:
+			from apscheduler.schedulers.asyncio import AsyncIOScheduler
+			jobstores = {}
+			if self.jobstore_url:
+				from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+				jobstores["default"] = SQLAlchemyJobStore(url=self.jobstore_url)
+			self.__scheduler = AsyncIOScheduler(jobstores=jobstores)
+		return self.__scheduler
+
+	@property
+	def running(self) -> bool:
+		return self.__scheduler is not None and self.__scheduler.running
+
+	def add_job(self, *args, **kwargs):
+		if self.__scheduler is None:
+			self.__jobs.append((args, kwargs))
+			return None
+		return self.__scheduler.add_job(*args, **kwargs)
+
+	def start(self):
+		if self.running:
+			return
+		scheduler = self.scheduler
+		for args, kwargs in self.__jobs:
+			scheduler.add_job(*args, **kwargs)
+		self.__jobs.clear()
+		scheduler.start()
+
+	def pause(self):
+		if self.running:
+			self.__scheduler.pause()
+
+	def resume(self):
+		if self.running:
+			self.__scheduler.resume()
+		else:
+			self.start()
+
+	def shutdown(self):
+		if self.running:
+			self.__scheduler.shutdown(wait=False)
+
+	def stats(self) -> dict:
+		return {
+			"loaded": self.loaded,
+			"running": self.running,
+			"jobstore": "sqlalchemy" if self.jobstore_url else "memory",
+			"jobs": [job.id for job in self.__scheduler.get_jobs()] if self.__scheduler is not None else [kwargs.get("id") for _, kwargs in self.__jobs],
+		}
+
+def _jobstore_url() -> str | None:
+	if os.getenv("SCHEDULER_JOBSTORE", "memory") != "sqlalchemy":
+		return None
+	return f"mysql+pymysql://{os.getenv('MYSQL_USER')}:{os.getenv('MYSQL_PASSWORD')}@{os.getenv('MYSQL_ADDRESS')}:{os.getenv('MYSQL_PORT')}/{os.getenv('MYSQL_NAME')}"
+
+class SchedulerLeader:
+	"""
+	Runs the scheduler in one worker only. Workers race for the Redis key `key` with SET NX PX, the
+	holder renews it every `ttl` / 3 seconds and runs the jobs, the others keep the scheduler paused
+	and retry at the same pace, so a dead leader is replaced within `ttl` plus one retry. Every
+	Redis call is bounded by the retry interval and a leader that has not renewed for `ttl` minus
+	one interval, counted from when the renewal was sent, steps down before its key can expire, so
+	two leaders never schedule jobs at the same time. Pausing does not stop a job run that already
+	started, it finishes while the next leader may start the same job, the jobs are idempotent.
+	Without bind_redis() the worker is its own leader
+	"""
+
+	renew_script = """if redis.call("GET", KEYS[1]) == ARGV[1] then
+ return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0"""
+	# also succeeds when an earlier SET of ours went through but its reply was lost
+	acquire_script = """local current = redis.call("GET", KEYS[1])
+if current == ARGV[1] then
+ return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+if not current then
+ redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+ return 1
+end
+return 0"""
+	release_script = """if redis.call("GET", KEYS[1]) == ARGV[1] then
+ return redis.call("DEL", KEYS[1])
+end
+return 0"""
+
+	def __init__(self, scheduler: LazyScheduler, key: str = "myadminka:scheduler:leader", ttl: float = 10.0):
+		self.scheduler = scheduler
+		self.key = key
+		self.ttl = ttl
+		self.interval = ttl / 3
+		self.identity = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+		self.redis = None
+		self.leader = False
+		self.__renewed = 0.0
+		self.__task = None
+		self.__elections = 0
+		self.__errors = 0
+
+	def bind_redis(self, connection):
+		self.redis = connection
+
+	def start(self):
+		if self.redis is None:
+			self.leader = True
+			self.scheduler.start()
+			return
+		if self.__task is None:
+			self.__task = asyncio.create_task(self.__run())
+
+	async def __run(self):
+		while True:
+			sent = time.monotonic()
+			try:
+				script = SchedulerLeader.renew_script if self.leader else SchedulerLeader.acquire_script
+				if await asyncio.wait_for(self.redis.eval(script, 1, self.key, self.identity, int(self.ttl * 1000)), self.interval):
+					self.__renewed = sent
+					if not self.leader:
+						self.__take_over()
+				elif self.leader:
+					self.__step_down()
+			except Exception:
+				self.__errors += 1
+			# the key expires on its own ttl after the last renewal, stop running jobs before another worker can start
+			if self.leader and time.monotonic() - self.__renewed >= self.ttl - self.interval:
+				self.__step_down()
+			await asyncio.sleep(self.interval)
+
+	def __take_over(self):
+		self.leader = True
+		self.__elections += 1
+		self.scheduler.resume()
+
+	def __step_down(self):
+		self.leader = False
+		self.scheduler.pause()
+
+	async def stop(self):
+		"""Hands leadership over right away instead of letting the key expire"""
+		if self.__task is not None:
+			self.__task.cancel()
+			self.__task = None
+		if self.leader and self.redis is not None:
+			try:
+				await self.redis.eval(SchedulerLeader.release_script, 1, self.key, self.identity)
+			except Exception:
+				pass
+		self.leader = False
+		self.scheduler.shutdown()
+
+	async def stats(self) -> dict:
+		current = self.identity if self.redis is None else None
+		if self.redis is not None:
+			try:
+				value = await self.redis.get(self.key)
+				current = value.decode("utf8") if value is not None else None
+			except Exception:
+				pass
+		return {
+			"identity": self.identity,
+			"leader": self.leader,
+			"current_leader": current,
+			"ttl": self.ttl,
+			"elections": self.__elections,
+			"errors": self.__errors,
+		}
+
+scheduler = LazyScheduler(jobstore_url=_jobstore_url())
+scheduler_leader = SchedulerLeader(scheduler, ttl=float(os.getenv("SCHEDULER_LEADER_TTL", 10)))
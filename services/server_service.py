@@ -1,5 +1,55 @@
 from models import UserModel, ServerModel, ServerGroupModel, UserServerGroupModel, ServerGroupPermissionModel, _get_slug
 from peewee import *
+from . service_exception import ServiceException
+from . permission_service import Permission, PermissionSet
+from . rcon_service import rcon_manager
+from . version_service import Versions
+from . metadata_service import Metadata
+from dbm import read, read_first
+
+def _atomic():
+	return ServerModel._meta.database.aio_atomic()
+
+# MySQL ER_DUP_ENTRY, uniqueness is enforced by the unique indexes in models.py
+_DUPLICATE_ENTRY = 1062
+
+def _is_duplicate(error: IntegrityError) -> bool:
+	return bool(error.args) and error.args[0] == _DUPLICATE_ENTRY
+
+def _encode_cursor(values) -> str:
+	return ".".join(str(value or 0) for value in values)
+
+def _decode_cursor(cursor: str | None, size: int) -> tuple:
+	if not cursor:
+		return (0,) * size
+	try:
+		values = tuple(int(value) for value in cursor.split("."))
+	except ValueError:
+		values = ()
+	if len(values) != size:
+		raise ServiceException("Malformed cursor")
+	return values
+
+async def _store_version(sid: int):
+	# read back from the primary once the write committed, concurrent writes can only raise it further
+	version = await ServerModel.select(ServerModel.version).where(ServerModel.id == sid).aio_scalar()
+	if version is not None:
+		await Versions.set("server", sid, version)
+
+async def _page(query, limit: int, key) -> tuple[list, str | None]:
+	"""Runs a keyset-paginated query, the cursor is only returned when another page may follow"""
+	rows = await read(query.dicts())
+	cursor = _encode_cursor(key(rows[-1])) if len(rows) == limit else None
+	return rows, cursor
+
+async def _iterate(fetch, batch: int):
+	cursor = None
+	while True:
+		rows, cursor = await fetch(cursor=cursor, limit=batch)
+		for row in rows:
+			yield row
+		if cursor is None:
+			break
 
 class Server:
 
@@ -7,45 +57,95 @@ class Server:
 	max_num_per_user = 10
 
 	@staticmethod
-	def create(name: str, module, address: str, port: int, hash: str, uid: int):
-		if ServerModel.select().where((ServerModel.operator == uid) & (ServerModel.name == name)).exists(): raise
-
-		if ServerModel.select().where(ServerModel.operator == uid).count() >= Server.max_num_per_user: raise
-
-		user = UserModel.get(id=uid)
-		server = ServerModel.create(name=name, module=module, address=address, port=port, hash=hash, operator=user)
-		Group.create(name="Administrator", permissions=["*"], sid=server)
+	async def create(name: str, module, address: str, port: int, hash: str, uid: int):
+		async with _atomic():
+			# the owner row serializes creates of one user, locking the count would only take gap locks that deadlock the inserts
+			if await UserModel.select(UserModel.id).where(UserModel.id == uid).for_update().aio_scalar() is None:
+				raise ServiceException("User not found")
+			total = await ServerModel.select(fn.COUNT(ServerModel.id)).where(ServerModel.operator == uid).aio_scalar()
+			if total >= Server.max_num_per_user: raise ServiceException(f"You can't have more than {Server.max_num_per_user} servers")
+
+			try:
+				server = await ServerModel.aio_create(name=name, module=module, address=address, port=port, hash=hash, operator=uid)
+			except IntegrityError as error:
+				if _is_duplicate(error): raise ServiceException("You already have a server with this name")
+				raise
+			await Group._insert(name="Administrator", permissions=["*"], sid=server.id)
 		return server.id
 
 	@staticmethod
-	def delete(sid: str):
-		ServerGroupModel.delete().where(ServerGroupModel.server == sid).execute()
-		ServerModel.get(id=sid).delete_instance()
+	async def delete(sid: int):
+		groups = ServerGroupModel.select(ServerGroupModel.id).where(ServerGroupModel.server == sid)
+		async with _atomic():
+			version = await ServerModel.select(ServerModel.version).where(ServerModel.id == sid).for_update().aio_scalar()
+			if version is None: raise ServiceException("Server not found")
+			await ServerGroupPermissionModel.delete().where(ServerGroupPermissionModel.group.in_(groups)).aio_execute()
+			await UserServerGroupModel.delete().where(UserServerGroupModel.group.in_(groups)).aio_execute()
+			await ServerGroupModel.delete().where(ServerGroupModel.server == sid).aio_execute()
+			await ServerModel.delete().where(ServerModel.id == sid).aio_execute()
+		Metadata.invalidate_server(sid)
+		Metadata.invalidate_groups(sid)
+		Permission.forget_server(sid)
+		await rcon_manager.invalidate(sid)
+		await Versions.set("server", sid, version + 1)
 
 	@staticmethod
-	def change(sid: int, name: str = None, address: str = None, port: int = None):
-		server = ServerModel.get(id=sid)
-		if name:
-			if ServerModel.select().where((ServerModel.id == sid) & (ServerModel.name == name)).exists(): raise
-			server.name = name
-			server.slug = _get_slug(name)
-		if address: server.address = address
-		if port: server.port = port
+	async def change(sid: int, name: str = None, address: str = None, port: int = None):
+		fields = {}
+		if name: fields[ServerModel.name] = name
+		if address: fields[ServerModel.address] = address
+		if port: fields[ServerModel.port] = port
+		if not fields:
+			if not await ServerModel.select().where(ServerModel.id == sid).aio_exists(): raise ServiceException("Server not found")
+			return
+		fields[ServerModel.version] = ServerModel.version + 1
+
+		try:
+			updated = await ServerModel.update(fields).where(ServerModel.id == sid).aio_execute()
+		except IntegrityError as error:
+			if _is_duplicate(error): raise ServiceException("You already have a server with this name")
+			raise
+		if not updated: raise ServiceException("Server not found")
+		Metadata.invalidate_server(sid)
+		await _store_version(sid)
+		if address or port:
+			await rcon_manager.invalidate(sid)
 
-		if name or address or port: server.save()
+	@staticmethod
+	async def set_hash(sid: int, new_hash: str):
+		updated = await ServerModel.update({ServerModel.hash: new_hash, ServerModel.version: ServerModel.version + 1}).where(ServerModel.id == sid).aio_execute()
+		if not updated: raise ServiceException("Server not found")
+		await _store_version(sid)
+		await rcon_manager.invalidate(sid)
 
 	@staticmethod
-	def set_hash(sid: int, new_hash: str):
-		server = ServerModel.get(id=sid)
-		server.hash = new_hash
-		server.save()
+	async def read_info(sid: int):
+		server = await read_first(
+			ServerModel
+			.select(ServerModel.uuid, ServerModel.name, ServerModel.module, ServerModel.address, ServerModel.port, ServerModel.datetime_create, ServerModel.version)
+			.where(ServerModel.id == sid)
+			.dicts()
+		)
+		if server is None:
+			raise ServiceException("Server not found")
+		return server
 
 	@staticmethod
-	def get_all(page: int = 1, paginate_by: int = 20):
-		return list(ServerModel.select(ServerModel.id, ServerModel.uuid, ServerModel.name, ServerModel.module, ServerModel.operator, ServerModel.datetime_create).paginate(page=page, paginate_by=paginate_by).dicts())
+	async def get_all(cursor: str = None, limit: int = 50):
+		after, = _decode_cursor(cursor, 1)
+		query = (
+			ServerModel
+			.select(ServerModel.id, ServerModel.uuid, ServerModel.name, ServerModel.module, ServerModel.operator, ServerModel.datetime_create)
+			.where(ServerModel.id > after)
+			.order_by(ServerModel.id)
+			.limit(limit)
+		)
+		return await _page(query, limit, lambda row: (row["id"],))
 
 	@staticmethod
-	def get_all_for_user(uid: int):
+	async def get_all_for_user(uid: int, cursor: str = None, limit: int = 50):
+		after, after_usg = _decode_cursor(cursor, 2)
+
 		owned_servers_query = (
 			ServerModel.select(
 				ServerModel.id,
@@ -55,7 +155,9 @@ class Server:
 				Value(None).alias("group_slug"),
 				Value(None).alias("usg_id"),
 			)
-			.where(ServerModel.operator == uid)
+			.where((ServerModel.operator == uid) & (ServerModel.id > after))
+			.order_by(ServerModel.id)
+			.limit(limit)
 		)
 
 		group_servers_query = (
@@ -69,18 +171,21 @@ class Server:
 			)
 			.join(ServerGroupModel, on=(ServerModel.id == ServerGroupModel.server))
 			.join(UserServerGroupModel, on=(ServerGroupModel.id == UserServerGroupModel.group))
-			.where(UserServerGroupModel.user == uid)
+			.where(
+				(UserServerGroupModel.user == uid) &
+				((ServerModel.id > after) | ((ServerModel.id == after) & (UserServerGroupModel.id > after_usg)))
+			)
+			.order_by(ServerModel.id, UserServerGroupModel.id)
+			.limit(limit)
 		)
 
-		all_servers_query = owned_servers_query | group_servers_query
-
-		all_servers_dict = list(all_servers_query.dicts())
+		all_servers_query = (owned_servers_query | group_servers_query).order_by(SQL("id"), SQL("usg_id")).limit(limit)
 
-		return all_servers_dict
+		return await _page(all_servers_query, limit, lambda row: (row["id"], row["usg_id"]))
 
 	@staticmethod
-	def get_users_for_server(sid: int):
-		server = ServerModel.get(id=sid)
+	async def get_users_for_server(sid: int, cursor: str = None, limit: int = 50):
+		after, after_usg = _decode_cursor(cursor, 2)
 
 		owner_query = (
 			UserModel.select(
@@ -90,7 +195,8 @@ class Server:
 				Value(None).alias("group_slug"),
 				Value(None).alias("usg_id"),
 			)
-			.where(UserModel.id == server.operator.id)
+			.join(ServerModel, on=(ServerModel.operator == UserModel.id))
+			.where((ServerModel.id == sid) & (UserModel.id > after))
 		)
 
 		group_users_query = (
@@ -103,118 +209,279 @@ class Server:
 			)
 			.join(UserServerGroupModel, on=(UserModel.id == UserServerGroupModel.user))
 			.join(ServerGroupModel, on=(UserServerGroupModel.group == ServerGroupModel.id))
-			.where(ServerGroupModel.server == server)
+			.where(
+				(ServerGroupModel.server == sid) &
+				((UserModel.id > after) | ((UserModel.id == after) & (UserServerGroupModel.id > after_usg)))
+			)
+			.order_by(UserModel.id, UserServerGroupModel.id)
+			.limit(limit)
 		)
 
-		all_users_query = owner_query | group_users_query
+		all_users_query = (owner_query | group_users_query).order_by(SQL("id"), SQL("usg_id")).limit(limit)
+
+		return await _page(all_users_query, limit, lambda row: (row["id"], row["usg_id"]))
+
+	@staticmethod
+	def iter_all(batch: int = 500):
+		return _iterate(Server.get_all, batch)
+
+	@staticmethod
+	def iter_all_for_user(uid: int, batch: int = 500):
+		return _iterate(lambda **page: Server.get_all_for_user(uid, **page), batch)
 
-		all_users_dict = list(all_users_query.dicts())
+	@staticmethod
+	def iter_users_for_server(sid: int, batch: int = 500):
+		return _iterate(lambda **page: Server.get_users_for_server(sid, **page), batch)
 
-		return all_users_dict
+	@staticmethod
+	async def get_id_for_uuid(uuid: str, uid: int):
+		"""Id of the server if the user operates it or belongs to one of its groups, both answered from caches when warm"""
+		server = await Metadata.server(uuid)
+		if server is None:
+			return None
+		sid, operator = server
+		if operator == uid or (await Permission.resolve(sid, uid)).member:
+			return sid
+		return None
 
 	@staticmethod
-	def get_id_for_uuid(uuid: str, uid: int):
+	async def get_targets(uid: int, uuids: list = None, group: str = None) -> list:
+		"""Servers the user operates or belongs to, narrowed to `uuids` and/or servers having a group with the `group` slug"""
 		owner_query = (
 			ServerModel
-			.select(ServerModel.id)
-			.where(
-				(ServerModel.uuid == uuid) &
-				(ServerModel.operator_id == uid)
-			)
+			.select(ServerModel.id, ServerModel.uuid, ServerModel.name)
+			.where(ServerModel.operator == uid)
 		)
-
 		group_query = (
 			ServerModel
-			.select(ServerModel.id)
-			.join(ServerGroupModel, on=(ServerModel.id == ServerGroupModel.server_id))
-			.join(UserServerGroupModel, on=(ServerGroupModel.id == UserServerGroupModel.group_id))
-			.where(
-				(ServerModel.uuid == uuid) &
-				(UserServerGroupModel.user_id == uid)
-			)
+			.select(ServerModel.id, ServerModel.uuid, ServerModel.name)
+			.join(ServerGroupModel, on=(ServerModel.id == ServerGroupModel.server))
+			.join(UserServerGroupModel, on=(ServerGroupModel.id == UserServerGroupModel.group))
+			.where(UserServerGroupModel.user == uid)
 		)
 
-		combined_query = owner_query.union(group_query)
+		# every where() call is ANDed to the branch condition
+		if uuids is not None:
+			owner_query = owner_query.where(ServerModel.uuid.in_(uuids))
+			group_query = group_query.where(ServerModel.uuid.in_(uuids))
+		if group is not None:
+			with_group = ServerGroupModel.alias()
+			servers_with_group = with_group.select(with_group.server).where(with_group.slug == _get_slug(group))
+			owner_query = owner_query.where(ServerModel.id.in_(servers_with_group))
+			group_query = group_query.where(ServerModel.id.in_(servers_with_group))
 
-		server = combined_query.first()
-		return server.id if server else None
+		return list(await read(owner_query.union(group_query).dicts()))
 
 class Group:
 
 	forbidden_groups = ["operator"]
 
 	@staticmethod
-	def create(name: str, permissions: list, sid: int):
-		if name.lower() in Group.forbidden_groups: raise
-
-		if ServerGroupModel.select().where((ServerGroupModel.server == sid) & (ServerGroupModel.slug == name)).exists(): raise
-		group = ServerGroupModel.create(server=sid, name=name, slug=_get_slug(name), permissions=permissions)
+	async def _insert(name: str, permissions: list, sid: int):
+		group = await ServerGroupModel.aio_create(server=sid, name=name, slug=_get_slug(name))
+		if permissions:
+			await ServerGroupPermissionModel.insert_many([(group.id, value) for value in dict.fromkeys(Permission.normalize(value) for value in permissions)], fields=[ServerGroupPermissionModel.group, ServerGroupPermissionModel.value]).aio_execute()
 		return group.id
 
 	@staticmethod
-	def rename(gid: int, new_name: str):
-		group = ServerGroupModel.get(id=gid)
-		if ServerGroupModel.select().where((ServerGroupModel.server == group.server) & (ServerGroupModel.slug == new_name)).exists(): raise
-		group.name = new_name
-		group.slug = _get_slug(new_name)
-		group.save()
+	async def create(name: str, permissions: list, sid: int):
+		if name.lower() in Group.forbidden_groups: raise ServiceException("This group name is reserved")
+
+		try:
+			async with _atomic():
+				gid = await Group._insert(name=name, permissions=permissions, sid=sid)
+		except IntegrityError as error:
+			if _is_duplicate(error): raise ServiceException("A group with this name already exists")
+			raise
+		Metadata.invalidate_groups(sid)
+		return gid
+
+	@staticmethod
+	async def rename(gid: int, new_name: str):
+		sid = await Group._get_server_id(gid)
+		if sid is None: raise ServiceException("Group not found")
+		try:
+			await ServerGroupModel.update({ServerGroupModel.name: new_name, ServerGroupModel.slug: _get_slug(new_name)}).where(ServerGroupModel.id == gid).aio_execute()
+		except IntegrityError as error:
+			if _is_duplicate(error): raise ServiceException("A group with this name already exists")
+			raise
+		Metadata.invalidate_groups(sid)
 
 	@staticmethod
-	def set_permission(gid: int, value: str):
-		value = _get_slug(value)
-		if ServerGroupPermissionModel.select().where((ServerGroupPermissionModel.group == gid) & (ServerGroupPermissionModel.value == value)).exists(): raise
-		permission = ServerGroupPermissionModel.create(group=gid, value=value)
+	async def _get_server_id(gid: int):
+		return await ServerGroupModel.select(ServerGroupModel.server).where(ServerGroupModel.id == gid).aio_scalar()
+
+	@staticmethod
+	async def set_permission(gid: int, value: str):
+		sid = await Group._get_server_id(gid)
+		if sid is None: raise ServiceException("Group not found")
+		try:
+			permission = await ServerGroupPermissionModel.aio_create(group=gid, value=Permission.normalize(value))
+		except IntegrityError as error:
+			if _is_duplicate(error): raise ServiceException("The group already has this permission")
+			raise
+		Permission.invalidate_server(sid)
 		return permission.id
 
 	@staticmethod
-	def delete_permission(pid: int):
-		ServerGroupPermissionModel.get(id=pid).delete_instance()
+	async def delete_permission(pid: int):
+		sid = await (
+			ServerGroupModel
+			.select(ServerGroupModel.server)
+			.join(ServerGroupPermissionModel, on=(ServerGroupPermissionModel.group == ServerGroupModel.id))
+			.where(ServerGroupPermissionModel.id == pid)
+			.aio_scalar()
+		)
+		if sid is None: raise ServiceException("Permission not found")
+		deleted = await ServerGroupPermissionModel.delete().where(ServerGroupPermissionModel.id == pid).aio_execute()
+		Permission.invalidate_server(sid)
+		if not deleted: raise ServiceException("Permission not found")
 
 	@staticmethod
-	def delete(gid: int):
-		ServerGroupModel.get(id=gid).delete_instance()
+	async def delete(gid: int):
+		sid = await Group._get_server_id(gid)
+		if sid is None: raise ServiceException("Group not found")
+		async with _atomic():
+			await ServerGroupPermissionModel.delete().where(ServerGroupPermissionModel.group == gid).aio_execute()
+			await UserServerGroupModel.delete().where(UserServerGroupModel.group == gid).aio_execute()
+			deleted = await ServerGroupModel.delete().where(ServerGroupModel.id == gid).aio_execute()
+		Metadata.invalidate_groups(sid)
+		Permission.invalidate_server(sid)
+		if not deleted: raise ServiceException("Group not found")
 
 	@staticmethod
-	def assign(gid: int, uid: int):
-		usg = UserServerGroupModel.create(user=uid, group=gid)
+	async def assign(gid: int, uid: int):
+		sid = await Group._get_server_id(gid)
+		if sid is None: raise ServiceException("Group not found")
+		try:
+			usg = await UserServerGroupModel.aio_create(user=uid, group=gid)
+		except IntegrityError as error:
+			if _is_duplicate(error): raise ServiceException("The user is already in this group")
+			raise
+		Permission.invalidate_server(sid)
 		return usg.id
 
 	@staticmethod
-	def revoke(usgid: int):
-		UserServerGroupModel.get(id=usgid).delete_instance()
+	async def revoke(usgid: int):
+		sid = await (
+			ServerGroupModel
+			.select(ServerGroupModel.server)
+			.join(UserServerGroupModel, on=(UserServerGroupModel.group == ServerGroupModel.id))
+			.where(UserServerGroupModel.id == usgid)
+			.aio_scalar()
+		)
+		if sid is None: raise ServiceException("The user is not in this group")
+		deleted = await UserServerGroupModel.delete().where(UserServerGroupModel.id == usgid).aio_execute()
+		Permission.invalidate_server(sid)
+		if not deleted: raise ServiceException("The user is not in this group")
+
+	@staticmethod
+	async def _lock(gid: int) -> int:
+		"""Locks the group row for the rest of the transaction, so bulk changes of one group run one after another"""
+		sid = await ServerGroupModel.select(ServerGroupModel.server).where(ServerGroupModel.id == gid).for_update().aio_scalar()
+		if sid is None: raise ServiceException("Group not found")
+		return sid
+
+	@staticmethod
+	async def assign_many(gid: int, uids: list) -> dict:
+		"""Adds every user to the group in one transaction. Returns uid -> "assigned", "already_member" or "user_not_found" """
+		uids = list(dict.fromkeys(uids))
+		if not uids:
+			return {}
+		async with _atomic():
+			sid = await Group._lock(gid)
+			rows = await (
+				UserModel
+				.select(UserModel.id, UserServerGroupModel.id)
+				.join(UserServerGroupModel, JOIN.LEFT_OUTER, on=((UserServerGroupModel.user == UserModel.id) & (UserServerGroupModel.group == gid)))
+				.where(UserModel.id.in_(uids))
+				.tuples()
+				.aio_execute()
+			)
+			members = {uid for uid, usgid in rows if usgid is not None}
+			known = {uid for uid, _ in rows}
+			new = [uid for uid in uids if uid in known and uid not in members]
+			if new:
+				await UserServerGroupModel.insert_many([(uid, gid) for uid in new], fields=[UserServerGroupModel.user, UserServerGroupModel.group]).on_conflict_ignore().aio_execute()
+		if new: Permission.invalidate_server(sid)
+		return {uid: "assigned" if uid in new else "already_member" if uid in members else "user_not_found" for uid in uids}
 
 	@staticmethod
-	def get_all_for_server(sid: int):
-		return list(ServerGroupModel.select(ServerGroupModel.id, ServerGroupModel.uuid, ServerGroupModel.slug, ServerGroupModel.name, ServerGroupModel.datetime_create).where(ServerGroupModel.server == sid).dicts())
+	async def revoke_many(gid: int, uids: list) -> dict:
+		"""Removes every user from the group in one transaction. Returns uid -> "revoked" or "not_member" """
+		uids = list(dict.fromkeys(uids))
+		if not uids:
+			return {}
+		async with _atomic():
+			sid = await Group._lock(gid)
+			condition = (UserServerGroupModel.group == gid) & (UserServerGroupModel.user.in_(uids))
+			members = {uid for uid, in await UserServerGroupModel.select(UserServerGroupModel.user).where(condition).tuples().aio_execute()}
+			if members:
+				await UserServerGroupModel.delete().where(condition).aio_execute()
+		if members: Permission.invalidate_server(sid)
+		return {uid: "revoked" if uid in members else "not_member" for uid in uids}
 
 	@staticmethod
-	def get_permissions(gid: int):
-		permissions = list(ServerGroupPermissionModel.select(ServerGroupPermissionModel.id, ServerGroupPermissionModel.value).where(ServerGroupPermissionModel.group == gid).dicts())
-		return permissions
+	async def set_permissions(gid: int, values: list, replace: bool = False) -> dict:
+		"""
+		Adds the permissions to the group in one transaction, with `replace` every other permission of
+		the group is removed as well. Returns value -> "added", "exists" or "removed", keyed by the
+		normalized value
+		"""
+		values = list(dict.fromkeys(Permission.normalize(value) for value in values))
+		async with _atomic():
+			sid = await Group._lock(gid)
+			existing = {value for value, in await ServerGroupPermissionModel.select(ServerGroupPermissionModel.value).where(ServerGroupPermissionModel.group == gid).tuples().aio_execute()}
+			added = [value for value in values if value not in existing]
+			removed = [value for value in existing if value not in values] if replace else []
+			if removed:
+				await ServerGroupPermissionModel.delete().where((ServerGroupPermissionModel.group == gid) & (ServerGroupPermissionModel.value.in_(removed))).aio_execute()
+			if added:
+				await ServerGroupPermissionModel.insert_many([(gid, value) for value in added], fields=[ServerGroupPermissionModel.group, ServerGroupPermissionModel.value]).on_conflict_ignore().aio_execute()
+		if added or removed: Permission.invalidate_server(sid)
+		return {value: "added" if value in added else "exists" for value in values} | {value: "removed" for value in removed}
 
 	@staticmethod
-	def has_permission(sid: int, uid: int, permission: str):
+	async def get_all_for_server(sid: int, cursor: str = None, limit: int = 100):
+		after, = _decode_cursor(cursor, 1)
+		groups = await Metadata.server_groups(sid)
+		if groups is not None:
+			rows = [dict(group) for group in groups if group["id"] > after][:limit]
+			return rows, _encode_cursor((rows[-1]["id"],)) if len(rows) == limit else None
 		query = (
-			ServerModel
-			.select()
-			.where(
-				(ServerModel.id == sid) & (ServerModel.operator == uid)
-			)
-			.union(
-				ServerGroupPermissionModel
-				.select()
-				.join(ServerGroupModel, on=(ServerGroupPermissionModel.group == ServerGroupModel.id))
-				.join(UserServerGroupModel, on=(ServerGroupModel.id == UserServerGroupModel.group))
-				.where(
-					(UserServerGroupModel.user == uid) &
-					(ServerGroupModel.server == sid) &
-					(ServerGroupPermissionModel.value == permission)
-				)
-			)
+			ServerGroupModel
+			.select(ServerGroupModel.id, ServerGroupModel.slug, ServerGroupModel.name, ServerGroupModel.datetime_create)
+			.where((ServerGroupModel.server == sid) & (ServerGroupModel.id > after))
+			.order_by(ServerGroupModel.id)
+			.limit(limit)
+		)
+		return await _page(query, limit, lambda row: (row["id"],))
+
+	@staticmethod
+	async def get_permissions(gid: int, cursor: str = None, limit: int = 100):
+		after, = _decode_cursor(cursor, 1)
+		query = (
+			ServerGroupPermissionModel
+			.select(ServerGroupPermissionModel.id, ServerGroupPermissionModel.value)
+			.where((ServerGroupPermissionModel.group == gid) & (ServerGroupPermissionModel.id > after))
+			.order_by(ServerGroupPermissionModel.id)
+			.limit(limit)
 		)
-		return query.exists()
+		return await _page(query, limit, lambda row: (row["id"],))
+
+	@staticmethod
+	async def has_permission(sid: int, uid: int, permission: str):
+		permissions = await Permission.resolve(sid, uid)
+		return permissions.has(permission)
+
+	@staticmethod
+	async def get_permission_set(sid: int, uid: int) -> PermissionSet:
+		return await Permission.resolve(sid, uid)
 
 	@staticmethod
-	def get_id_for_slug(slug: str, sid: int):
-		group = ServerGroupModel.select().where((ServerGroupModel.server == sid) & (ServerGroupModel.slug == slug)).first()
-		return group.id if group else None
\ No newline at end of file
+	async def get_id_for_slug(slug: str, sid: int):
+		groups = await Metadata.server_groups(sid)
+		if groups is not None:
+			return next((group["id"] for group in groups if group["slug"] == slug), None)
+		group = await ServerGroupModel.select(ServerGroupModel.id).where((ServerGroupModel.server == sid) & (ServerGroupModel.slug == slug)).aio_first()
+		return group.id if group else None
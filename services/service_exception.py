@@ -9,4 +9,7 @@ class ServiceException(Exception):
 
 	def __repr__(self) -> str:
 		class_name = self.__class__.__name__
-		return f"{class_name}(code={self.code!r}, detail={self.detail!r})"
\ No newline at end of file
+		return f"{class_name}(code={self.code!r}, detail={self.detail!r})"
+
+class ServiceUnavailableException(ServiceException):
+	pass
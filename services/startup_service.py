@@ -0,0 +1,29 @@
+import time
+from contextlib import contextmanager
+
+class StartupReport:
+	"""Wall time of every boot phase of the process, from the first import of main to serving"""
+
+	def __init__(self):
+		self.phases = []
+
+	def add(self, name: str, seconds: float):
+		self.phases.append((name, seconds))
+
+	@contextmanager
+	def phase(self, name: str):
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add(name, time.perf_counter() - started)
+
+	def stats(self) -> dict:
+		phases = {name: round(seconds * 1000, 3) for name, seconds in self.phases}
+		return {"phases_ms": phases, "total_ms": round(sum(phases.values()), 3)}
+
+	def summary(self) -> str:
+		stats = self.stats()
+		return "Startup " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in stats["phases_ms"].items()) + f", total {stats['total_ms']:.1f} ms"
+
+startup_report = StartupReport()
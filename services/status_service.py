@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import asyncio
+from datetime import datetime
+from models import ServerModel
+from dbm import read
+from . rcon_service import rcon_manager
+from . service_exception import ServiceException
+
+class StatusStore:
+	"""
+	Latest probe result per server id. Snapshots are kept in process and, once bind_redis() was
+	called, in one Redis hash so every worker serves the same view with a single HMGET
+	"""
+
+	local = {}
+	redis = None
+	redis_key = "myadminka:status"
+
+	@staticmethod
+	def bind_redis(connection):
+		StatusStore.redis = connection
+
+	@staticmethod
+	async def set_many(snapshots: dict):
+		StatusStore.local.update(snapshots)
+		if StatusStore.redis is not None and snapshots:
+			try:
+				await StatusStore.redis.hset(StatusStore.redis_key, mapping={sid: json.dumps(snapshot) for sid, snapshot in snapshots.items()})
+			except Exception:
+				pass
+
+	@staticmethod
+	async def get_many(sids: list) -> dict:
+		if StatusStore.redis is not None and sids:
+			try:
+				values = await StatusStore.redis.hmget(StatusStore.redis_key, sids)
+				return {sid: json.loads(value) for sid, value in zip(sids, values) if value is not None}
+			except Exception:
+				pass
+		return {sid: StatusStore.local[sid] for sid in sids if sid in StatusStore.local}
+
+	@staticmethod
+	async def retain(sids: set):
+		"""Drops snapshots of servers that no longer exist"""
+		removed = [sid for sid in StatusStore.local if sid not in sids]
+		for sid in removed:
+			del StatusStore.local[sid]
+		if StatusStore.redis is not None:
+			try:
+				stored = [int(sid) for sid in await StatusStore.redis.hkeys(StatusStore.redis_key)]
+				removed = [sid for sid in stored if sid not in sids]
+				if removed:
+					await StatusStore.redis.hdel(StatusStore.redis_key, *removed)
+			except Exception:
+				pass
+
+class StatusPoller:
+
+	interval = float(os.getenv("STATUS_POLL_INTERVAL", 30))
+	parallelism = int(os.getenv("STATUS_POLL_PARALLELISM", 32))
+	timeout = float(os.getenv("STATUS_POLL_TIMEOUT", 3))
+
+	last_run = None
+	last_duration = None
+	last_probed = 0
+
+	players_pattern = re.compile(r"^Id:\s*\d+", re.MULTILINE)
+
+	@staticmethod
+	async def probe(sid: int, module: str) -> dict:
+		started = time.perf_counter()
+		snapshot = {"status": "offline", "latency_ms": None, "players": None, "error": None, "checked_at": datetime.now().isoformat()}
+		try:
+			if module == "modmanager":
+				info = await asyncio.wait_for(rcon_manager.invoke(sid, "bf2cc si", StatusPoller.timeout), StatusPoller.timeout)
+				players = int(info.split("\t")[3]) if info else None
+			else:
+				listing = await asyncio.wait_for(rcon_manager.invoke(sid, "exec admin.listplayers", StatusPoller.timeout), StatusPoller.timeout)
+				players = len(StatusPoller.players_pattern.findall(listing or ""))
+		except asyncio.TimeoutError:
+			snapshot["error"] = "RCON command timed out"
+			return snapshot
+		except ServiceException as error:
+			snapshot["error"] = error.detail
+			return snapshot
+		except (IndexError, ValueError):
+			players = None
+		except Exception as error:
+			# a database or socket error marks this server unreachable, the other probes go on
+			snapshot["error"] = f"Probe failed: {error!r}"
+			return snapshot
+
+		snapshot |= {"status": "online", "latency_ms": round((time.perf_counter() - started) * 1000, 3), "players": players}
+		return snapshot
+
+	@staticmethod
+	async def poll():
+		"""
+		Probes every registered server once. Probe i of n starts i/n of the interval after the run
+		began, so the servers are not all hit in the same instant
+		"""
+		started = time.perf_counter()
+		servers = await read(ServerModel.select(ServerModel.id, ServerModel.module).order_by(ServerModel.id).tuples())
+		spread = StatusPoller.interval * 0.8 / (len(servers) or 1)
+		semaphore = asyncio.Semaphore(StatusPoller.parallelism)
+
+		async def run(position: int, sid: int, module: str):
+			await asyncio.sleep(position * spread)
+			async with semaphore:
+				snapshot = await StatusPoller.probe(sid, module)
+			await StatusStore.set_many({sid: snapshot})
+
+		await asyncio.gather(*(run(position, sid, module) for position, (sid, module) in enumerate(servers)))
+		await StatusStore.retain({sid for sid, _ in servers})
+
+		StatusPoller.last_run = datetime.now().isoformat()
+		StatusPoller.last_duration = round(time.perf_counter() - started, 3)
+		StatusPoller.last_probed = len(servers)
+
+	@staticmethod
+	def stats() -> dict:
+		return {
+			"interval": StatusPoller.interval,
+			"parallelism": StatusPoller.parallelism,
+			"last_run": StatusPoller.last_run,
+			"last_duration_seconds": StatusPoller.last_duration,
+			"last_probed": StatusPoller.last_probed,
+			"snapshots": len(StatusStore.local),
+			"shared": StatusStore.redis is not None,
+		}
+
+async def poll_servers():
+	await StatusPoller.poll()
@@ -0,0 +1,117 @@
+import os
+import time
+import hashlib
+from . cache import TTLCache
+from . metadata_service import invalidation_bus
+
+class TokenCache:
+	"""
+	Verified access tokens by digest, so a token is decoded and checked once instead of on every
+	request. Entries live until the token expires, at most `revalidate` seconds. Revocations are
+	kept locally, sent to every other worker through the invalidation bus and, once bind_redis()
+	was called, kept in Redis for as long as a revoked token could still be presented
+	"""
+
+	lifetime = max(int(os.getenv("ACCESS_TOKEN_EXPIRES", 15)), int(os.getenv("REFRESH_TOKEN_EXPIRES", 15))) * 60
+	revalidate = int(os.getenv("TOKEN_CACHE_REVALIDATE", 60))
+	local = TTLCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", 50000)), ttl=revalidate)
+	revoked = TTLCache(maxsize=int(os.getenv("TOKEN_REVOKED_SIZE", 50000)), ttl=lifetime)
+	# subject -> time up to which every token it was issued is revoked, compared with issued()
+	not_before = TTLCache(maxsize=int(os.getenv("TOKEN_REVOKED_SIZE", 50000)), ttl=lifetime)
+	redis = None
+	redis_prefix = "myadminka:revoked:"
+
+	@staticmethod
+	def bind_redis(connection):
+		TokenCache.redis = connection
+
+	@staticmethod
+	def digest(token: str) -> str:
+		return hashlib.blake2b(token.encode("utf8"), digest_size=16).hexdigest()
+
+	@staticmethod
+	def claims() -> dict:
+		"""Extra claims for a new token, iat only has a precision of one second"""
+		return {"issued": time.time()}
+
+	@staticmethod
+	def issued(payload) -> float:
+		# tokens created before the `issued` claim existed fall back to iat
+		return getattr(payload, "issued", None) or payload.iat
+
+	@staticmethod
+	def get(token: str):
+		payload = TokenCache.local.get(TokenCache.digest(token))
+		if payload is not None and TokenCache.issued(payload) <= TokenCache.not_before.get(payload.sub, 0):
+			return None
+		return payload
+
+	@staticmethod
+	def set(token: str, payload):
+		remaining = payload.exp.timestamp() - time.time() if payload.exp else TokenCache.revalidate
+		if remaining > 0:
+			TokenCache.local.set(TokenCache.digest(token), payload, ttl=min(remaining, TokenCache.revalidate))
+
+	@staticmethod
+	async def is_revoked(token: str, payload) -> bool:
+		digest = TokenCache.digest(token)
+		if digest in TokenCache.revoked or TokenCache.issued(payload) <= TokenCache.not_before.get(payload.sub, 0):
+			return True
+		if TokenCache.redis is None:
+			return False
+
+		try:
+			token_mark, subject_mark = await TokenCache.redis.mget(TokenCache.redis_prefix + digest, TokenCache.redis_prefix + payload.sub)
+		except Exception:
+			return False
+		if subject_mark is not None:
+			TokenCache.on_subject([payload.sub, float(subject_mark)])
+		return token_mark is not None or (subject_mark is not None and TokenCache.issued(payload) <= float(subject_mark))
+
+	@staticmethod
+	def on_token(digest: str):
+		TokenCache.local.pop(digest)
+		TokenCache.revoked.set(digest, True)
+
+	@staticmethod
+	def on_subject(key: list):
+		uuid, mark = key
+		if mark > TokenCache.not_before.get(uuid, 0):
+			TokenCache.not_before.set(uuid, mark)
+
+	@staticmethod
+	def reset():
+		TokenCache.local.clear()
+
+	@staticmethod
+	async def revoke(token: str):
+		digest = TokenCache.digest(token)
+		TokenCache.on_token(digest)
+		invalidation_bus.publish("token", digest)
+		if TokenCache.redis is not None:
+			try:
+				await TokenCache.redis.set(TokenCache.redis_prefix + digest, 1, ex=TokenCache.lifetime)
+			except Exception:
+				pass
+
+	@staticmethod
+	async def revoke_subject(uuid: str):
+		"""
+		Invalidates every token of the user issued up to now, tokens issued afterwards carry a later
+		`issued` claim and stay valid
+		"""
+		mark = time.time()
+		TokenCache.on_subject([uuid, mark])
+		invalidation_bus.publish("token_subject", [uuid, mark])
+		if TokenCache.redis is not None:
+			try:
+				await TokenCache.redis.set(TokenCache.redis_prefix + uuid, mark, ex=TokenCache.lifetime)
+			except Exception:
+				pass
+
+	@staticmethod
+	def stats() -> dict:
+		return TokenCache.local.stats() | {"revalidate": TokenCache.revalidate, "revoked": len(TokenCache.revoked), "revoked_subjects": len(TokenCache.not_before), "shared": TokenCache.redis is not None}
+
+invalidation_bus.register("token", TokenCache.on_token, reset=TokenCache.reset)
+invalidation_bus.register("token_subject", TokenCache.on_subject)
@@ -1,25 +1,236 @@
 import os
+import time
+import asyncio
+import statistics
+import json
+from typing import NamedTuple
 from datetime import datetime
 from models import UserModel, UserChronicleModel
 from . service_exception import ServiceException
-import bcrypt
+from . password_service import password_executor
+from . chronicle_service import chronicle_writer
+from . cache import TTLCache
+from . token_service import TokenCache
+from . version_service import Versions
+from . metadata_service import invalidation_bus
+from dbm import read, read_first
+from instrumentation import record
+from peewee import SQL
 import secrets
 
 class UserChronicle:
 
 	@staticmethod
 	async def register_event(user: int, event_code: str, user_agent: str, user_address: str, details: str = None, user_target: int = None):
-		await UserChronicleModel.aio_create(user_initiator=user, event_code=event_code, user_agent=user_agent, user_address=user_address, details=details, user_target=user_target)
+		await chronicle_writer.submit({
+			"user_initiator": user,
+			"event_code": event_code,
+			"user_agent": user_agent,
+			"user_address": user_address,
+			"details": details,
+			"user_target": user_target,
+			"datetime_create": datetime.now()
+		})
+
+	@staticmethod
+	async def history(uid: int, cursor: str = None, limit: int = 50, event_code: str = None):
+		"""Events the user initiated or was the target of, newest first, keyset-paginated on (datetime_create, id)"""
+		before = None
+		if cursor:
+			try:
+				moment, eid = cursor.rsplit("~", 1)
+				before = (datetime.fromisoformat(moment), int(eid))
+			except ValueError:
+				raise ServiceException("Malformed cursor")
+
+		def branch(field):
+			query = UserChronicleModel.select(
+				UserChronicleModel.id,
+				UserChronicleModel.datetime_create,
+				UserChronicleModel.event_code,
+				UserChronicleModel.details,
+				UserChronicleModel.user_initiator,
+				UserChronicleModel.user_target,
+				UserChronicleModel.user_agent,
+				UserChronicleModel.user_address,
+			).where(field == uid)
+			if event_code:
+				query = query.where(UserChronicleModel.event_code == event_code)
+			if before:
+				query = query.where(
+					(UserChronicleModel.datetime_create < before[0]) |
+					((UserChronicleModel.datetime_create == before[0]) & (UserChronicleModel.id < before[1]))
+				)
+			return query.order_by(UserChronicleModel.datetime_create.desc(), UserChronicleModel.id.desc()).limit(limit)
+
+		query = (branch(UserChronicleModel.user_initiator) | branch(UserChronicleModel.user_target)).order_by(SQL("datetime_create").desc(), SQL("id").desc()).limit(limit)
+		rows = await read(query.dicts())
+		next_cursor = f"{rows[-1]['datetime_create'].isoformat()}~{rows[-1]['id']}" if len(rows) == limit else None
+		return rows, next_cursor
 
 class Password:
 
 	@staticmethod
-	def encode(value: str) -> str:
-		return bcrypt.hashpw(value.encode("utf8"), bcrypt.gensalt())
+	async def encode(value: str) -> bytes:
+		return await password_executor.hash(value)
+
+	@staticmethod
+	async def verify(password: str, hash: str) -> bool:
+		return await password_executor.verify(password, hash)
+
+class LoginTiming:
+	"""
+	Makes every authentication take the same time: an unknown name still costs one bcrypt verify
+	against a dummy hash and the answer is held back until a fixed target latency, which is derived
+	from the measured verify cost by calibrate(). Logins that arrive before it finished wait for it
+	and are padded as if they had started when it did
+	"""
+
+	floor = int(os.getenv("LOGIN_TARGET_LATENCY_MS", 0)) / 1000
+	factor = float(os.getenv("LOGIN_TARGET_LATENCY_FACTOR", 1.5))
+	samples = 5
+
+	dummy_hash: str = None
+	verify_cost = 0.0
+	target = 0.0
+	calibration: asyncio.Task = None
+	calibrated_at = 0.0
+
+	padded = 0
+	overruns = 0
+	pad_seconds = 0.0
+
+	@staticmethod
+	async def calibrate():
+		LoginTiming.dummy_hash = (await Password.encode(secrets.token_urlsafe(16))).decode("utf8")
+		costs = []
+		for _ in range(LoginTiming.samples):
+			started = time.perf_counter()
+			await Password.verify(secrets.token_urlsafe(16), LoginTiming.dummy_hash)
+			costs.append(time.perf_counter() - started)
+		LoginTiming.verify_cost = statistics.median(costs)
+		LoginTiming.target = max(LoginTiming.floor, LoginTiming.verify_cost * LoginTiming.factor)
+		LoginTiming.calibrated_at = time.perf_counter()
+
+	@staticmethod
+	def start() -> asyncio.Task:
+		"""Runs calibrate() once in the background, the task is shared by everything waiting for it"""
+		calibration = LoginTiming.calibration
+		if calibration is None or (calibration.done() and (calibration.cancelled() or calibration.exception() is not None)):
+			LoginTiming.calibration = asyncio.create_task(LoginTiming.calibrate())
+		return LoginTiming.calibration
+
+	@staticmethod
+	async def verify_dummy(password: str):
+		await asyncio.shield(LoginTiming.start())
+		await Password.verify(password, LoginTiming.dummy_hash)
+
+	@staticmethod
+	async def pad(started: float):
+		await asyncio.shield(LoginTiming.start())
+		remaining = LoginTiming.target - (time.perf_counter() - max(started, LoginTiming.calibrated_at))
+		if remaining <= 0:
+			LoginTiming.overruns += 1
+			return
+		LoginTiming.padded += 1
+		LoginTiming.pad_seconds += remaining
+		record("delay", remaining)
+		await asyncio.sleep(remaining)
+
+	@staticmethod
+	def stats() -> dict:
+		return {
+			"calibrated": LoginTiming.calibration is not None and LoginTiming.calibration.done(),
+			"target_ms": round(LoginTiming.target * 1000, 3),
+			"verify_cost_ms": round(LoginTiming.verify_cost * 1000, 3),
+			"padded": LoginTiming.padded,
+			"overruns": LoginTiming.overruns,
+			"avg_pad_ms": round(LoginTiming.pad_seconds / (LoginTiming.padded or 1) * 1000, 3),
+		}
+
+class Subject(NamedTuple):
+	id: int
+	is_active: bool
+	is_admin: bool
+	version: int = 0
+
+class SubjectCache:
+	"""
+	uuid -> Subject lookups for authenticated requests. Entries live in a local LRU and, once
+	bind_redis() was called, in Redis as well so that workers warm each other up. A write stores
+	the new subject and drops the entry in every other worker through the invalidation bus. Redis
+	never takes a subject older than the one it holds, and a row loaded while an invalidation
+	arrived is returned but not cached
+	"""
+
+	local = TTLCache(maxsize=int(os.getenv("SUBJECT_CACHE_SIZE", 10000)), ttl=int(os.getenv("SUBJECT_CACHE_TTL", 15)))
+	redis = None
+	redis_ttl = int(os.getenv("SUBJECT_CACHE_REDIS_TTL", 300))
+	redis_prefix = "myadminka:subject:"
+	set_script = """local current = redis.call("GET", KEYS[1])
+if current then
+ local version = cjson.decode(current)[4]
+ if version and version > tonumber(ARGV[2]) then
+  return 0
+ end
+end
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[3])
+return 1"""
+	# raised by every invalidation
+	epoch = 0
+
+	@staticmethod
+	def bind_redis(connection):
+		SubjectCache.redis = connection
+
+	@staticmethod
+	async def get(uuid: str) -> Subject | None:
+		subject = SubjectCache.local.get(uuid)
+		if subject is not None or SubjectCache.redis is None:
+			return subject
+
+		epoch = SubjectCache.epoch
+		try:
+			raw = await SubjectCache.redis.get(SubjectCache.redis_prefix + uuid)
+		except Exception:
+			return None
+		if raw is None:
+			return None
+
+		subject = Subject(*json.loads(raw))
+		if epoch == SubjectCache.epoch:
+			SubjectCache.local.set(uuid, subject)
+		return subject
+
+	@staticmethod
+	async def set(uuid: str, subject: Subject):
+		SubjectCache.local.set(uuid, subject)
+		if SubjectCache.redis is not None:
+			try:
+				await SubjectCache.redis.eval(SubjectCache.set_script, 1, SubjectCache.redis_prefix + uuid, json.dumps(subject), subject.version, SubjectCache.redis_ttl)
+			except Exception:
+				pass
+
+	@staticmethod
+	async def invalidate(uuid: str, subject: Subject):
+		"""Stores `subject`, the row a write just produced, and drops the entry in every other worker"""
+		SubjectCache.epoch += 1
+		await SubjectCache.set(uuid, subject)
+		invalidation_bus.publish("subject", uuid)
+
+	@staticmethod
+	def on_subject(uuid: str):
+		SubjectCache.epoch += 1
+		SubjectCache.local.pop(uuid)
+
+	@staticmethod
+	def reset():
+		SubjectCache.epoch += 1
+		SubjectCache.local.clear()
 
 	@staticmethod
-	def verify(password: str, hash: str) -> str:
-		return bcrypt.checkpw(password.encode("utf8"), hash.encode("utf8"))
+	def stats() -> dict:
+		return SubjectCache.local.stats() | {"shared": SubjectCache.redis is not None}
 
 class User:
 
@@ -30,7 +241,7 @@ class User:
 		if await UserModel.select().where(UserModel.email == email).aio_exists():
 			raise ServiceException("Такой логин уже зареган")
 
-		hashed = Password.encode(password)
+		hashed = await Password.encode(password)
 		new_user = await UserModel.aio_create(name=name, email=email, hash=hashed)
 		return new_user.id
 
@@ -40,28 +251,62 @@ class User:
 		for user in result:
 			return user.id
 
+	@staticmethod
+	async def get_subject(value: str) -> Subject | None:
+		subject = await SubjectCache.get(value)
+		if subject is not None:
+			return subject
+
+		epoch = SubjectCache.epoch
+		row = await UserModel.select(UserModel.id, UserModel.is_active, UserModel.is_admin, UserModel.version).where(UserModel.uuid == value).tuples().aio_first()
+		if row is None:
+			return None
+
+		subject = Subject(row[0], bool(row[1]), bool(row[2]), row[3])
+		if epoch == SubjectCache.epoch:
+			await SubjectCache.set(value, subject)
+		return subject
+
 	@staticmethod
 	async def get_from_uuid(value: str) -> int:
-		user = await UserModel.aio_get_or_none(uuid=value)
-		return getattr(user, "id")
+		subject = await User.get_subject(value)
+		return subject.id if subject else None
 
 	@staticmethod
 	async def authentication(name_or_email: str, password: str) -> str:
+		started = time.perf_counter()
 		result = await UserModel.select().where((UserModel.name == name_or_email) | (UserModel.email == name_or_email)).aio_execute()
+		uuid = None
+		if not result:
+			await LoginTiming.verify_dummy(password)
 		for user in result:
-			if Password.verify(password, user.hash) and user.is_active:
+			if await Password.verify(password, user.hash) and user.is_active:
 				#User.add_agent(user.id, agent, address)
-				return str(user.uuid)
+				uuid = str(user.uuid)
+				break
+		await LoginTiming.pad(started)
+		return uuid
+
+	@staticmethod
+	async def _update(uid: int, fields: dict) -> int:
+		"""Applies `fields` and raises the row version in one UPDATE, returns the new version"""
+		fields[UserModel.version] = UserModel.version + 1
+		await UserModel.update(fields).where(UserModel.id == uid).aio_execute()
+		version = await UserModel.select(UserModel.version).where(UserModel.id == uid).aio_scalar()
+		await Versions.set("user", uid, version)
+		return version
 
 	@staticmethod
 	async def read_info(uid: int):
-		user = await UserModel.aio_get(id=uid)
+		user = await read_first(UserModel.select().where(UserModel.id == uid))
+		if user is None:
+			raise ServiceException("User not found")
 		data = {
 			"name": user.name,
 			"email": user.email,
 			"datetime_create": user.datetime_create,
 			"hash_datetime_update": user.hash_datetime_update,
-
+			"version": user.version,
 		}
 		if user.is_admin: data["is_admin"] = user.is_admin
 		return data
@@ -74,8 +319,7 @@ class User:
 
 		if await UserModel.select().where(UserModel.name == name).aio_exists():
 			raise ServiceException(f"Try a different name")
-		user.name = name
-		await user.aio_save()
+		await User._update(uid, {UserModel.name: name})
 
 	@staticmethod
 	async def change_email(uid: int, email: str):
@@ -85,14 +329,13 @@ class User:
 
 		if await UserModel.select().where(UserModel.email == email).aio_exists():
 			raise ServiceException(f"Try a different e-mail")
-		user.email = email
-		await user.aio_save()
+		await User._update(uid, {UserModel.email: email})
 
 	@staticmethod
 	async def change_password(uid: int, password: str, new_password: str):
 		user = await UserModel.aio_get(id=uid)
 
-		if not Password.verify(password, user.hash):
+		if not await Password.verify(password, user.hash):
 			raise ServiceException("Yeah, but the password's wrong")
 
 
@@ -102,11 +345,21 @@ class User:
 		if password == new_password:
 			raise ServiceException("You can't change the password to the same password")
 
-		user.hash = Password.encode(new_password)
-		user.hash_datetime_update = datetime.now()
-		await user.aio_save()
+		await User._update(uid, {UserModel.hash: await Password.encode(new_password), UserModel.hash_datetime_update: datetime.now()})
+		await TokenCache.revoke_subject(user.uuid)
+
+	@staticmethod
+	async def set_active(uid: int, value: bool):
+		user = await UserModel.aio_get(id=uid)
+		version = await User._update(uid, {UserModel.is_active: value})
+		await SubjectCache.invalidate(user.uuid, Subject(user.id, bool(value), bool(user.is_admin), version))
 
 	@staticmethod
 	async def delete(uid: int):
 		user = await UserModel.aio_get(id=uid)
-		await user.aio_delete_instance()
\ No newline at end of file
+		await user.aio_delete_instance()
+		# an inactive subject above every version of the row, a lookup that loaded it before the delete cannot bring it back
+		await SubjectCache.invalidate(user.uuid, Subject(user.id, False, False, user.version + 1))
+		await Versions.set("user", uid, user.version + 1)
+
+invalidation_bus.register("subject", SubjectCache.on_subject, reset=SubjectCache.reset)
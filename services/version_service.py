@@ -0,0 +1,49 @@
+import os
+from . cache import TTLCache
+
+class Versions:
+	"""
+	Last known row version per (kind, id), so a conditional GET can be answered without MySQL.
+	Once bind_redis() was called Redis is the only store and every worker sees the same versions,
+	otherwise they are kept in process. A version is only ever raised, a reader that loaded an old
+	row cannot overwrite the version a concurrent write just stored. Writers store the version they
+	read back from the primary, a deleted row gets one above its last
+	"""
+
+	local = TTLCache(maxsize=int(os.getenv("VERSION_CACHE_SIZE", 50000)), ttl=int(os.getenv("VERSION_CACHE_TTL", 300)))
+	redis = None
+	redis_prefix = "myadminka:version:"
+	raise_script = """local current = tonumber(redis.call("GET", KEYS[1]) or "0")
+if tonumber(ARGV[1]) >= current then
+ redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+end
+return 0"""
+
+	@staticmethod
+	def bind_redis(connection):
+		Versions.redis = connection
+
+	@staticmethod
+	async def get(kind: str, key: int) -> int | None:
+		if Versions.redis is None:
+			return Versions.local.get((kind, key))
+		try:
+			value = await Versions.redis.get(f"{Versions.redis_prefix}{kind}:{key}")
+		except Exception:
+			return None
+		return int(value) if value is not None else None
+
+	@staticmethod
+	async def set(kind: str, key: int, version: int):
+		if Versions.redis is None:
+			if version >= Versions.local.get((kind, key), 0):
+				Versions.local.set((kind, key), version)
+			return
+		try:
+			await Versions.redis.eval(Versions.raise_script, 1, f"{Versions.redis_prefix}{kind}:{key}", version, Versions.local.ttl)
+		except Exception:
+			pass
+
+	@staticmethod
+	def stats() -> dict:
+		return Versions.local.stats() | {"shared": Versions.redis is not None}
@@ -0,0 +1,12 @@
+import os
+import pytest
+from dotenv import load_dotenv
+load_dotenv()
+
+def pytest_collection_modifyitems(config, items):
+	if os.getenv("MYSQL_ADDRESS"):
+		return
+	skip = pytest.mark.skip(reason="needs a MySQL database, set MYSQL_*")
+	for item in items:
+		if "mysql" in item.keywords:
+			item.add_marker(skip)
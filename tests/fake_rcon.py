@@ -0,0 +1,43 @@
+import asyncio
+import hashlib
+
+class FakeRconServer:
+	"""
+	Speaks the BF2142 RCON handshake and answers every command with its own text after `delay`
+	seconds, or after `delays[command]` for the commands listed there. Also drives benchmarks.rcon_manager
+	"""
+
+	def __init__(self, password: str = "secret", delay: float = 0.001, delays: dict = None):
+		self.password = password
+		self.delay = delay
+		self.delays = delays or {}
+		self.sessions = 0
+		self.port = None
+		self.__server = None
+
+	async def start(self) -> int:
+		self.__server = await asyncio.start_server(self.__handle, "127.0.0.1", 0)
+		self.port = self.__server.sockets[0].getsockname()[1]
+		return self.port
+
+	async def close(self):
+		self.__server.close()
+		await self.__server.wait_closed()
+
+	async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		seed = b"0123456789abcdef"
+		writer.write(b"### Battlefield 2142 ModManager Rcon v1.0.\n### Digest seed: " + seed + b"\n\n")
+		login = await reader.readuntil(b"\n")
+		if login.strip() != b"\x02login " + hashlib.md5(seed + self.password.encode()).hexdigest().encode():
+			writer.write(b"Authentication failed.\n")
+			writer.close()
+			return
+		writer.write(b"Authentication successful, rcon ready.\n")
+		self.sessions += 1
+		try:
+			while True:
+				command = (await reader.readuntil(b"\n")).strip(b"\x02\n")
+				await asyncio.sleep(self.delays.get(command.decode("utf8"), self.delay))
+				writer.write(command + b"\n\x04")
+		except (asyncio.IncompleteReadError, ConnectionError):
+			writer.close()
@@ -0,0 +1,95 @@
+"""ConsoleHub fan-out of one upstream per server to many viewers, against the fake RCON server"""
+import json
+import asyncio
+from tests.fake_rcon import FakeRconServer
+from services.console_service import ConsoleHub
+from services.rcon_service import rcon_manager
+
+def run(scenario, module: str = "modmanager"):
+	fake = FakeRconServer()
+
+	async def main():
+		await fake.start()
+		rcon_manager.register(1, "127.0.0.1", fake.port, fake.password, module)
+		hub = ConsoleHub(interval=0.02, timeout=1, buffer=4)
+		try:
+			await scenario(hub, fake)
+		finally:
+			await hub.close()
+			await rcon_manager.close()
+			await fake.close()
+	asyncio.run(main())
+
+async def receive(viewer, timeout: float = 1.0) -> dict | None:
+	message = await asyncio.wait_for(viewer.queue.get(), timeout)
+	return None if message is None else json.loads(message)
+
+def test_viewers_of_a_server_share_one_upstream():
+	async def scenario(hub, fake):
+		first, second = hub.subscribe(1), hub.subscribe(1)
+		assert len(hub.channels) == 1
+		for viewer in (first, second):
+			message = await receive(viewer)
+			assert message["type"] == "lines"
+			assert message["lines"] == [ConsoleHub.commands["modmanager"]]
+		assert fake.sessions == 1
+		assert hub.stats()["viewers"] == 2
+	run(scenario)
+
+def test_slow_viewer_is_cut_off_and_the_others_keep_receiving():
+	async def scenario(hub, fake):
+		slow, fast = hub.subscribe(1), hub.subscribe(1)
+		received = []
+
+		async def read():
+			while True:
+				received.append(await receive(fast))
+
+		reader = asyncio.create_task(read())
+		try:
+			await asyncio.sleep(hub.interval * (hub.buffer + 4))
+			assert slow.dropped
+			assert slow.queue.qsize() == 1 and await receive(slow) is None
+			assert hub.dropped == 1
+			assert hub.stats()["viewers"] == 1
+			count = len(received)
+			await asyncio.sleep(hub.interval * 3)
+			assert len(received) > count
+			assert not fast.dropped
+		finally:
+			reader.cancel()
+	run(scenario)
+
+def test_upstream_stops_with_the_last_viewer():
+	async def scenario(hub, fake):
+		first, second = hub.subscribe(1), hub.subscribe(1)
+		task = hub.channels[1].task
+		hub.unsubscribe(1, first)
+		assert 1 in hub.channels
+		hub.unsubscribe(1, second)
+		assert 1 not in hub.channels
+		await asyncio.sleep(0)
+		assert task.cancelled() or task.done()
+	run(scenario)
+
+def test_shutdown_ends_full_viewers_without_dropping_them():
+	async def scenario(hub, fake):
+		viewer = hub.subscribe(1)
+		while not viewer.queue.full():
+			await asyncio.sleep(hub.interval / 2)
+		# the poller would cut the viewer off with its next output
+		hub.channels[1].task.cancel()
+		await hub.close()
+		assert not viewer.dropped
+		messages = [viewer.queue.get_nowait() for _ in range(viewer.queue.qsize())]
+		assert messages[-1] is None
+		assert hub.channels == {}
+	run(scenario)
+
+def test_server_without_a_console_reports_an_error():
+	async def scenario(hub, fake):
+		viewer = hub.subscribe(1)
+		message = await receive(viewer)
+		assert message["type"] == "error"
+		assert hub.channels[1].errors >= 1
+	run(scenario, module="default")
@@ -0,0 +1,9 @@
+"""benchmarks.explain_queries as a test, the service queries must not read a table by a full scan without a usable index"""
+import asyncio
+import pytest
+from benchmarks import explain_queries
+
+pytestmark = pytest.mark.mysql
+
+def test_no_full_scan_without_a_usable_index(tmp_path):
+	assert asyncio.run(explain_queries.main(str(tmp_path / "plans.json"))) == 0
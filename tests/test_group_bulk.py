@@ -0,0 +1,93 @@
+"""
+Group.assign_many, revoke_many and set_permissions against the MySQL database from the MYSQL_*
+environment, skipped without one. Every test removes what it created
+"""
+import asyncio
+import pytest
+import shortuuid
+from dbm import DataBaseManager
+from models import UserModel, UserServerGroupModel, ServerGroupPermissionModel
+from services.server_service import Server, Group
+from services.service_exception import ServiceException
+import models
+
+pytestmark = pytest.mark.mysql
+
+def run(scenario, users: int = 3):
+	"""Runs `scenario(gid, uids)` on a fresh server group with `users` users that are not members yet"""
+	async def main():
+		manager = DataBaseManager.from_env()
+		await manager.bind(models)
+		name = shortuuid.ShortUUID().random(length=12)
+		owner = await UserModel.aio_create(name=f"to{name}", email=f"to{name}@test.local", hash="-")
+		await UserModel.insert_many([(f"t{name}{i}", f"t{name}{i}@test.local", "-") for i in range(users)], fields=[UserModel.name, UserModel.email, UserModel.hash]).aio_execute()
+		uids = [row.id for row in await UserModel.select(UserModel.id).where(UserModel.name.startswith(f"t{name}")).order_by(UserModel.id).aio_execute()]
+		sid = None
+		try:
+			sid = await Server.create(name="test", module="default", address="127.0.0.1", port=4711, hash="-", uid=owner.id)
+			gid = await Group.create(name="Members", permissions=[], sid=sid)
+			await scenario(gid, uids)
+		finally:
+			if sid is not None:
+				await Server.delete(sid)
+			await UserModel.delete().where(UserModel.name.startswith(f"t{name}") | (UserModel.id == owner.id)).aio_execute()
+			await manager.close()
+	asyncio.run(main())
+
+async def members(gid: int) -> set:
+	return {uid for uid, in await UserServerGroupModel.select(UserServerGroupModel.user).where(UserServerGroupModel.group == gid).tuples().aio_execute()}
+
+async def permissions(gid: int) -> set:
+	return {value for value, in await ServerGroupPermissionModel.select(ServerGroupPermissionModel.value).where(ServerGroupPermissionModel.group == gid).tuples().aio_execute()}
+
+def test_assign_many():
+	async def scenario(gid, uids):
+		assert await Group.assign_many(gid, [uids[0]]) == {uids[0]: "assigned"}
+		missing = max(uids) + 1000000
+		outcomes = await Group.assign_many(gid, [uids[0], uids[1], uids[1], missing, uids[2]])
+		assert list(outcomes) == [uids[0], uids[1], missing, uids[2]]
+		assert outcomes == {uids[0]: "already_member", uids[1]: "assigned", missing: "user_not_found", uids[2]: "assigned"}
+		assert await members(gid) == set(uids)
+	run(scenario)
+
+def test_assign_many_without_users():
+	async def scenario(gid, uids):
+		assert await Group.assign_many(gid, []) == {}
+		assert await members(gid) == set()
+	run(scenario)
+
+def test_revoke_many():
+	async def scenario(gid, uids):
+		await Group.assign_many(gid, uids[:2])
+		outcomes = await Group.revoke_many(gid, [uids[0], uids[0], uids[2]])
+		assert outcomes == {uids[0]: "revoked", uids[2]: "not_member"}
+		assert await members(gid) == {uids[1]}
+	run(scenario)
+
+def test_bulk_operations_on_unknown_group():
+	async def scenario(gid, uids):
+		await Group.delete(gid)
+		with pytest.raises(ServiceException):
+			await Group.assign_many(gid, uids)
+		with pytest.raises(ServiceException):
+			await Group.revoke_many(gid, uids)
+		with pytest.raises(ServiceException):
+			await Group.set_permissions(gid, ["kick"])
+	run(scenario)
+
+def test_set_permissions():
+	async def scenario(gid, uids):
+		outcomes = await Group.set_permissions(gid, ["kick", "Kick ", "map*", "ban"])
+		assert outcomes == {"kick": "added", "map_*": "added", "ban": "added"}
+		outcomes = await Group.set_permissions(gid, ["ban", "say"])
+		assert outcomes == {"ban": "exists", "say": "added"}
+		assert await permissions(gid) == {"kick", "map_*", "ban", "say"}
+	run(scenario)
+
+def test_set_permissions_replace():
+	async def scenario(gid, uids):
+		await Group.set_permissions(gid, ["kick", "ban", "say"])
+		outcomes = await Group.set_permissions(gid, ["ban", "BAN", "warn"], replace=True)
+		assert outcomes == {"ban": "exists", "warn": "added", "kick": "removed", "say": "removed"}
+		assert await permissions(gid) == {"ban", "warn"}
+	run(scenario)
@@ -0,0 +1,116 @@
+"""The local token bucket of RateLimiter, its sync into the Redis window and the strict path, on fakeredis"""
+import asyncio
+import pytest
+import fakeredis.aioredis
+from fastapi import FastAPI, HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+from fastapi_limiter import FastAPILimiter
+from limiter import RateLimiter
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+	monkeypatch.setattr(RateLimiter, "enabled", True)
+	monkeypatch.setattr(RateLimiter, "sync_sha", None)
+	for counter in ("syncs", "local_rejections", "cluster_rejections", "sync_errors"):
+		monkeypatch.setattr(RateLimiter, counter, 0)
+	RateLimiter.buckets.clear()
+	yield
+	RateLimiter.buckets.clear()
+
+# the strict path of fastapi_limiter looks the route up in the app
+app = FastAPI()
+
+def request(address: str = "10.0.0.1", path: str = "/servers") -> Request:
+	return Request({"type": "http", "method": "GET", "path": path, "headers": [], "client": (address, 40000), "app": app})
+
+async def admitted(limiter: RateLimiter, calls: int, address: str = "10.0.0.1") -> int:
+	"""How many of `calls` requests the limiter lets through"""
+	count = 0
+	for _ in range(calls):
+		try:
+			await limiter(request(address), Response())
+			count += 1
+		except HTTPException as error:
+			assert error.status_code == 429
+	return count
+
+def key(limiter: RateLimiter, address: str = "10.0.0.1", path: str = "/servers") -> str:
+	return f"{FastAPILimiter.prefix}:{address}:{path}:{limiter.index}"
+
+def test_local_bucket_refuses_without_redis_once_empty():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		await FastAPILimiter.init(redis)
+		limiter = RateLimiter(times=20, seconds=60)
+		assert not limiter.strict
+		assert await admitted(limiter, 25) == 20
+		assert RateLimiter.local_rejections == 5
+		assert await admitted(limiter, 1, address="10.0.0.2") == 1
+	asyncio.run(main())
+
+def test_first_request_of_a_key_is_synced_at_once():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		await FastAPILimiter.init(redis)
+		limiter = RateLimiter(times=20, seconds=60)
+		await admitted(limiter, 1)
+		assert RateLimiter.syncs == 1
+		assert int(await redis.get(key(limiter))) == 1
+		assert 0 < await redis.pttl(key(limiter)) <= 60000
+		# within the sync interval the next requests are only counted locally
+		await admitted(limiter, 3)
+		assert int(await redis.get(key(limiter))) == 1
+	asyncio.run(main())
+
+def test_key_is_refused_once_the_cluster_is_over_the_limit():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		await FastAPILimiter.init(redis)
+		limiter = RateLimiter(times=20, seconds=60)
+		# the other workers already used the whole window
+		await redis.set(key(limiter), 20, px=60000)
+		assert await admitted(limiter, 1) == 1
+		assert await admitted(limiter, 3) == 0
+		assert RateLimiter.cluster_rejections == 3
+	asyncio.run(main())
+
+def test_pending_count_is_kept_while_redis_is_away():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		await FastAPILimiter.init(redis)
+		limiter = RateLimiter(times=20, milliseconds=400)
+		FastAPILimiter.redis = fakeredis.aioredis.FakeRedis(connected=False)
+		assert await admitted(limiter, 3) == 3
+		assert RateLimiter.sync_errors == 1
+		assert RateLimiter.buckets.get(key(limiter)).pending == 3
+
+		FastAPILimiter.redis = redis
+		await asyncio.sleep(limiter.interval)
+		await admitted(limiter, 1)
+		assert int(await redis.get(key(limiter))) == 4
+	asyncio.run(main())
+
+def test_small_limits_check_redis_on_every_request():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		await FastAPILimiter.init(redis)
+		limiter = RateLimiter(times=5, seconds=60)
+		assert limiter.strict
+		assert await admitted(limiter, 3) == 3
+		# another worker with its own buckets shares the same window
+		RateLimiter.buckets.clear()
+		assert await admitted(limiter, 4) == 2
+		assert RateLimiter.syncs == 0 and RateLimiter.local_rejections == 0
+	asyncio.run(main())
+
+def test_disabled_local_bucket_falls_back_to_redis(monkeypatch):
+	monkeypatch.setattr(RateLimiter, "enabled", False)
+
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		await FastAPILimiter.init(redis)
+		limiter = RateLimiter(times=20, seconds=60)
+		assert await admitted(limiter, 22) == 20
+		assert len(RateLimiter.buckets) == 0
+	asyncio.run(main())
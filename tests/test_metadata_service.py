@@ -0,0 +1,192 @@
+"""InvalidationBus delivery over fakeredis pub/sub and the epoch and eviction handling of Metadata"""
+import asyncio
+import pytest
+import fakeredis
+import fakeredis.aioredis
+from services import metadata_service
+from services.metadata_service import InvalidationBus, Metadata
+
+async def until(condition, timeout: float = 2.0):
+	loop = asyncio.get_running_loop()
+	deadline = loop.time() + timeout
+	while not condition():
+		assert loop.time() < deadline, "condition not met in time"
+		await asyncio.sleep(0.01)
+
+def buses(count: int, **kwargs) -> list:
+	server = fakeredis.FakeServer()
+	result = []
+	for _ in range(count):
+		bus = InvalidationBus(channel="test:invalidate", **kwargs)
+		bus.bind_redis(fakeredis.aioredis.FakeRedis(server=server))
+		result.append(bus)
+	return result
+
+class FlakyRedis:
+	"""Forwards publishes to a FakeRedis, the first `failures` of them fail"""
+
+	def __init__(self, connection, failures: int):
+		self.connection = connection
+		self.failures = failures
+		self.messages = []
+
+	async def publish(self, channel, message):
+		if self.failures:
+			self.failures -= 1
+			raise ConnectionError("redis is down")
+		self.messages.append(message)
+		return await self.connection.publish(channel, message)
+
+def test_invalidations_reach_every_other_worker():
+	async def main():
+		sender, receiver = buses(2)
+		received, echoed = [], []
+		receiver.register("server", received.append)
+		sender.register("server", echoed.append)
+		sender.start()
+		receiver.start()
+		try:
+			await until(lambda: sender.connected and receiver.connected)
+			sender.publish("server", 7)
+			await until(lambda: received)
+			assert received == [7]
+			await asyncio.sleep(0.05)
+			assert echoed == []
+			assert receiver.stats()["received"] == 1 and sender.stats()["published"] == 1
+		finally:
+			await sender.stop()
+			await receiver.stop()
+	asyncio.run(main())
+
+def test_subscribing_resets_what_may_have_been_missed():
+	async def main():
+		bus, = buses(1)
+		resets = []
+		bus.register("server", lambda key: None, reset=lambda: resets.append(1))
+		bus.start()
+		try:
+			await until(lambda: bus.connected)
+			assert resets == [1]
+		finally:
+			await bus.stop()
+	asyncio.run(main())
+
+def test_lost_publish_resets_every_other_worker():
+	async def main():
+		sender, receiver = buses(2, retry=0.01, attempts=2)
+		flaky = FlakyRedis(sender.redis, failures=3)
+		sender.bind_redis(flaky)
+		received, resets = [], []
+		receiver.register("server", received.append, reset=lambda: resets.append(1))
+		receiver.start()
+		try:
+			await until(lambda: receiver.connected)
+			resets.clear()
+			sender.publish("server", 7)
+			await until(lambda: resets)
+			assert received == []
+			assert sender.stats()["lost"] == 1
+			assert '"reset"' in flaky.messages[0]
+		finally:
+			await sender.stop()
+			await receiver.stop()
+	asyncio.run(main())
+
+def test_publish_without_redis_stays_in_the_process():
+	async def main():
+		bus = InvalidationBus()
+		bus.publish("server", 7)
+		bus.start()
+		await bus.stop()
+		assert bus.stats()["published"] == 0
+	asyncio.run(main())
+
+@pytest.fixture
+def metadata():
+	Metadata.reset()
+	yield Metadata
+	Metadata.reset()
+
+class GatedQuery:
+	"""Stands in for the server row query of Metadata.server(), it answers once `gate` is set"""
+
+	id = uuid = operator = None
+
+	def __init__(self, row):
+		self.row = row
+		self.gate = asyncio.Event()
+		self.waiting = asyncio.Event()
+
+	def select(self, *fields):
+		return self
+
+	def where(self, *conditions):
+		return self
+
+	def tuples(self):
+		return self
+
+	async def aio_first(self):
+		self.waiting.set()
+		await self.gate.wait()
+		return self.row
+
+def test_cached_server_row_is_dropped_by_id(metadata):
+	Metadata.servers.set("u1", (1, 10))
+	Metadata.uuids.set(1, "u1")
+	drops = Metadata.stale_drops
+	Metadata.on_server(1)
+	assert "u1" not in Metadata.servers
+	assert Metadata.stale_drops == drops + 1
+
+def test_server_row_is_dropped_after_its_id_entry_was_evicted(metadata):
+	Metadata.servers.set("u1", (1, 10))
+	Metadata.servers.set("u2", (2, 10))
+	Metadata.uuids.set(2, "u2")
+	Metadata.invalidate_server(1)
+	assert "u1" not in Metadata.servers
+	assert "u2" in Metadata.servers
+
+def test_reading_a_server_keeps_its_id_entry_in_use(metadata, monkeypatch):
+	monkeypatch.setattr(Metadata, "uuids", metadata_service.TTLCache(maxsize=2, ttl=60))
+
+	async def main():
+		Metadata.servers.set("u1", (1, 10))
+		Metadata.uuids.set(1, "u1")
+		Metadata.uuids.set(2, "u2")
+		assert await Metadata.server("u1") == (1, 10)
+		Metadata.uuids.set(3, "u3")
+		assert Metadata.uuids.get(1) == "u1"
+		assert Metadata.uuids.get(2) is None
+	asyncio.run(main())
+
+def test_row_loaded_across_an_invalidation_is_not_cached(metadata, monkeypatch):
+	async def main():
+		query = GatedQuery((1, 10))
+		monkeypatch.setattr(metadata_service, "ServerModel", query)
+		pending = asyncio.create_task(Metadata.server("u1"))
+		await query.waiting.wait()
+		Metadata.invalidate_server(1)
+		query.gate.set()
+		assert await pending == (1, 10)
+		assert "u1" not in Metadata.servers
+		assert 1 not in Metadata.uuids
+	asyncio.run(main())
+
+def test_loaded_row_is_cached_both_ways(metadata, monkeypatch):
+	async def main():
+		query = GatedQuery((1, 10))
+		query.gate.set()
+		monkeypatch.setattr(metadata_service, "ServerModel", query)
+		assert await Metadata.server("u1") == (1, 10)
+		assert Metadata.servers.get("u1") == (1, 10)
+		assert Metadata.uuids.get(1) == "u1"
+	asyncio.run(main())
+
+def test_group_invalidations_drop_the_cached_groups(metadata):
+	Metadata.groups.set(1, ({"id": 1},))
+	Metadata.on_groups(1)
+	assert 1 not in Metadata.groups
+	Metadata.groups.set(1, ({"id": 1},))
+	Metadata.invalidate_groups(1)
+	assert 1 not in Metadata.groups
@@ -0,0 +1,107 @@
+"""PermissionSet matching and the generation guard of Permission.resolve_many, no database needed"""
+import asyncio
+from services.permission_service import Permission, PermissionSet
+
+def test_exact_permissions():
+	permissions = PermissionSet(["kick", "ban"], member=True)
+	assert permissions.has("kick") and permissions.has("ban")
+	assert not permissions.has("say")
+	assert not permissions.has("kick_all")
+	assert permissions.member and not permissions.operator
+
+def test_everything():
+	permissions = PermissionSet(["*"])
+	assert permissions.has("kick") and permissions.has("map_change_next")
+
+def test_operator_has_everything():
+	permissions = PermissionSet(operator=True)
+	assert permissions.operator and permissions.member
+	assert permissions.has("anything")
+
+def test_prefix_permissions():
+	permissions = PermissionSet(["map_*", "kick"])
+	assert permissions.has("map_change")
+	assert permissions.has("map_change_next")
+	assert not permissions.has("map")
+	assert not permissions.has("maps_change")
+	assert not permissions.has("kick_all")
+
+def test_nested_prefix():
+	permissions = PermissionSet(["map_change_*"])
+	assert permissions.has("map_change_next")
+	assert not permissions.has("map_change")
+	assert not permissions.has("map_restart")
+
+def test_no_permissions():
+	permissions = PermissionSet()
+	assert not permissions.member
+	assert not permissions.has("kick")
+
+def test_has_all_any_and_check():
+	permissions = PermissionSet(["kick", "map_*"])
+	assert permissions.has_all("kick", "map_next")
+	assert not permissions.has_all("kick", "ban")
+	assert permissions.has_any("ban", "kick")
+	assert not permissions.has_any("ban", "say")
+	assert permissions.check(["kick", "ban", "map_next"]) == {"kick": True, "ban": False, "map_next": True}
+
+def test_normalize():
+	assert Permission.normalize(" Kick ") == "kick"
+	assert Permission.normalize("Map Change") == "map_change"
+	assert Permission.normalize("map*") == "map_*"
+	assert Permission.normalize("map_*") == "map_*"
+	assert Permission.normalize("*") == "*"
+
+def compile_with(monkeypatch, gate: asyncio.Event = None):
+	"""Replaces the database query by one returning a fresh set per call, optionally blocking on `gate`"""
+	calls = []
+
+	async def compile(uid, sids):
+		calls.append(list(sids))
+		if gate is not None:
+			await gate.wait()
+		return {sid: PermissionSet([f"call{len(calls)}"]) for sid in sids}
+
+	monkeypatch.setattr(Permission, "_Permission__compile", compile)
+	monkeypatch.setattr(Permission, "generations", {})
+	Permission.cache.clear()
+	return calls
+
+def test_resolved_sets_are_cached_until_the_server_is_invalidated(monkeypatch):
+	calls = compile_with(monkeypatch)
+
+	async def main():
+		assert (await Permission.resolve(1, 7)).has("call1")
+		assert (await Permission.resolve(1, 7)).has("call1")
+		Permission.on_server(1)
+		assert (await Permission.resolve(1, 7)).has("call2")
+
+	asyncio.run(main())
+	assert calls == [[1], [1]]
+
+def test_set_compiled_across_a_reset_is_not_cached(monkeypatch):
+	async def main():
+		gate = asyncio.Event()
+		calls = compile_with(monkeypatch, gate)
+		pending = asyncio.create_task(Permission.resolve(1, 7))
+		await asyncio.sleep(0)
+		Permission.reset()
+		gate.set()
+		assert (await pending).has("call1")
+		assert (await Permission.resolve(1, 7)).has("call2")
+		assert len(calls) == 2
+
+	asyncio.run(main())
+
+def test_deleted_server_drops_its_generation(monkeypatch):
+	calls = compile_with(monkeypatch)
+
+	async def main():
+		Permission.on_server(1)
+		await Permission.resolve(1, 7)
+		Permission.on_deleted(1)
+		assert 1 not in Permission.generations
+		assert (await Permission.resolve(1, 7)).has("call2")
+
+	asyncio.run(main())
+	assert len(calls) == 2
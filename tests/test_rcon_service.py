@@ -0,0 +1,223 @@
+"""RconConnection and RconManager against local fake BF2142 RCON servers, no database needed"""
+import time
+import socket
+import asyncio
+import pytest
+from tests.fake_rcon import FakeRconServer
+from services.rcon_service import RconConnection, RconManager, RconTarget, RconException
+
+def run(scenario, *fakes):
+	async def main():
+		for fake in fakes:
+			await fake.start()
+		try:
+			await scenario()
+		finally:
+			for fake in fakes:
+				await fake.close()
+	asyncio.run(main())
+
+def unused_port() -> int:
+	with socket.socket() as probe:
+		probe.bind(("127.0.0.1", 0))
+		return probe.getsockname()[1]
+
+def test_pipelined_replies_reach_their_commands():
+	fake = FakeRconServer(delays={"slow": 0.05})
+
+	async def scenario():
+		connection = RconConnection(RconTarget("127.0.0.1", fake.port, fake.password), max_in_flight=8)
+		await connection.connect(1)
+		try:
+			commands = ["slow"] + [f"echo {number}" for number in range(40)]
+			results = await asyncio.gather(*(connection.invoke(command, 1) for command in commands))
+			assert results == commands
+			assert connection.commands == len(commands)
+			assert connection.in_flight == 0
+		finally:
+			await connection.close()
+		assert fake.sessions == 1
+
+	run(scenario, fake)
+
+def test_timed_out_command_closes_the_session():
+	fake = FakeRconServer(delays={"slow": 0.2})
+
+	async def scenario():
+		connection = RconConnection(RconTarget("127.0.0.1", fake.port, fake.password))
+		await connection.connect(1)
+		try:
+			with pytest.raises(RconException) as error:
+				await connection.invoke("slow", 0.05)
+			assert error.value.code == "rcon_timeout"
+			assert connection.closed
+			with pytest.raises(RconException) as error:
+				await connection.invoke("fast", 1)
+			assert error.value.code == "rcon_disconnected"
+		finally:
+			await connection.close()
+
+	run(scenario, fake)
+
+def test_manager_reconnects_after_a_timed_out_command():
+	fake = FakeRconServer(delays={"slow": 0.2})
+
+	async def scenario():
+		manager = RconManager()
+		manager.register(1, "127.0.0.1", fake.port, fake.password)
+		try:
+			slow = asyncio.create_task(manager.invoke(1, "slow", 0.05))
+			await asyncio.sleep(0.01)
+			fast = asyncio.create_task(manager.invoke(1, "fast", 1))
+			with pytest.raises(RconException):
+				await slow
+			# queued behind the timed out command on the old session, it fails instead of getting "slow"
+			with pytest.raises(RconException) as error:
+				await fast
+			assert error.value.code == "rcon_disconnected"
+			assert await manager.invoke(1, "fast") == "fast"
+			assert fake.sessions == 2
+		finally:
+			await manager.close()
+
+	run(scenario, fake)
+
+def test_wrong_password_is_rejected():
+	fake = FakeRconServer()
+
+	async def scenario():
+		connection = RconConnection(RconTarget("127.0.0.1", fake.port, "wrong"))
+		with pytest.raises(RconException) as error:
+			await connection.connect(1)
+		assert error.value.code == "rcon_auth"
+		assert connection.closed
+
+	run(scenario, fake)
+
+def test_commands_share_one_session_per_server():
+	fake = FakeRconServer()
+
+	async def scenario():
+		manager = RconManager()
+		manager.register(1, "127.0.0.1", fake.port, fake.password)
+		try:
+			results = await asyncio.gather(*(manager.invoke(1, f"echo {number}") for number in range(20)))
+			assert results == [f"echo {number}" for number in range(20)]
+		finally:
+			await manager.close()
+		assert fake.sessions == 1
+		assert manager.stats()["connects"] == 1
+
+	run(scenario, fake)
+
+def test_unreachable_server_backs_off():
+	async def scenario():
+		manager = RconManager(connect_timeout=0.5, backoff=0.2, backoff_max=0.4)
+		manager.register(1, "127.0.0.1", unused_port(), "secret")
+		try:
+			with pytest.raises(RconException) as error:
+				await manager.invoke(1, "echo")
+			assert error.value.code == "rcon_unreachable"
+			with pytest.raises(RconException) as error:
+				await manager.invoke(1, "echo")
+			assert error.value.code == "rcon_backoff"
+			assert manager.stats()["backing_off"] == 1
+
+			await asyncio.sleep(0.25)
+			with pytest.raises(RconException) as error:
+				await manager.invoke(1, "echo")
+			assert error.value.code == "rcon_unreachable"
+			assert manager.stats()["connect_failures"] == 2
+
+			# the second failure doubled the backoff
+			await asyncio.sleep(0.25)
+			with pytest.raises(RconException) as error:
+				await manager.invoke(1, "echo")
+			assert error.value.code == "rcon_backoff"
+		finally:
+			await manager.close()
+
+	run(scenario)
+
+def test_backoff_ends_once_the_server_is_back():
+	fake = FakeRconServer()
+
+	async def scenario():
+		manager = RconManager(connect_timeout=0.5, backoff=0.1)
+		port = unused_port()
+		manager.register(1, "127.0.0.1", port, fake.password)
+		try:
+			with pytest.raises(RconException):
+				await manager.invoke(1, "echo")
+			await asyncio.sleep(0.15)
+			manager.register(1, "127.0.0.1", fake.port, fake.password)
+			assert await manager.invoke(1, "echo") == "echo"
+			assert manager.stats()["backing_off"] == 0
+		finally:
+			await manager.close()
+
+	run(scenario, fake)
+
+def test_least_recently_used_idle_session_is_evicted():
+	fakes = [FakeRconServer() for _ in range(3)]
+
+	async def scenario():
+		manager = RconManager(max_connections=2)
+		for sid, fake in enumerate(fakes):
+			manager.register(sid, "127.0.0.1", fake.port, fake.password)
+		try:
+			await manager.invoke(0, "echo")
+			await manager.invoke(1, "echo")
+			await manager.invoke(0, "echo")
+			await manager.invoke(2, "echo")
+			assert manager.stats()["evictions"] == 1
+			assert manager.stats()["connections"] == 2
+
+			await manager.invoke(0, "echo")
+			assert fakes[0].sessions == 1
+			await manager.invoke(1, "echo")
+			assert fakes[1].sessions == 2
+		finally:
+			await manager.close()
+
+	run(scenario, *fakes)
+
+def test_no_session_is_evicted_while_commands_are_in_flight():
+	fakes = [FakeRconServer(delays={"slow": 0.2}) for _ in range(2)]
+
+	async def scenario():
+		manager = RconManager(max_connections=1)
+		for sid, fake in enumerate(fakes):
+			manager.register(sid, "127.0.0.1", fake.port, fake.password)
+		try:
+			slow = asyncio.create_task(manager.invoke(0, "slow"))
+			await asyncio.sleep(0.05)
+			with pytest.raises(RconException) as error:
+				await manager.invoke(1, "echo")
+			assert error.value.code == "rcon_capacity"
+			assert await slow == "slow"
+		finally:
+			await manager.close()
+
+	run(scenario, *fakes)
+
+def test_idle_sessions_are_closed():
+	fake = FakeRconServer()
+
+	async def scenario():
+		manager = RconManager(idle_timeout=0.5)
+		manager.register(1, "127.0.0.1", fake.port, fake.password)
+		manager.start()
+		try:
+			await manager.invoke(1, "echo")
+			started = time.monotonic()
+			while manager.stats()["connections"] and time.monotonic() - started < 3:
+				await asyncio.sleep(0.1)
+			assert manager.stats()["connections"] == 0
+			assert manager.stats()["evictions"] == 1
+			assert await manager.invoke(1, "echo") == "echo"
+			assert fake.sessions == 2
+		finally:
+			await manager.close()
+
+	run(scenario, fake)
@@ -0,0 +1,101 @@
+"""versioned(): version ETags, 304 and cached bodies without loading, and the reload of a row from a lagging replica"""
+import asyncio
+import orjson
+import pytest
+import fakeredis.aioredis
+from starlette.requests import Request
+import dbm
+from responses import versioned, bodies
+from services.version_service import Versions
+
+@pytest.fixture(autouse=True)
+def stores():
+	Versions.local.clear()
+	bodies.clear()
+	yield
+	Versions.local.clear()
+	bodies.clear()
+	Versions.redis = None
+
+def request(etag: str = None) -> Request:
+	headers = [(b"if-none-match", etag.encode())] if etag else []
+	return Request({"type": "http", "method": "GET", "path": "/servers/abc", "headers": headers})
+
+class Rows:
+	"""load() of one row, `replica` is what a read returns until the request is pinned to the primary"""
+
+	def __init__(self, primary: int, replica: int = None):
+		self.primary = primary
+		self.replica = primary if replica is None else replica
+		self.loads = []
+
+	async def load(self):
+		pinned = dbm._primary_pinned.get()
+		self.loads.append("primary" if pinned else "replica")
+		version = self.primary if pinned else self.replica
+		return {"name": f"v{version}", "version": version}
+
+def test_known_version_is_answered_without_loading():
+	async def main():
+		rows = Rows(primary=1)
+		response = await versioned(request(), "server", 5, rows.load)
+		assert response.status_code == 200
+		assert response.headers["etag"] == '"server-5-1"'
+		assert orjson.loads(response.body) == {"name": "v1", "version": 1}
+
+		response = await versioned(request('"server-5-1"'), "server", 5, rows.load)
+		assert response.status_code == 304
+		assert response.headers["etag"] == '"server-5-1"'
+
+		response = await versioned(request(), "server", 5, rows.load)
+		assert response.status_code == 200
+		assert orjson.loads(response.body)["version"] == 1
+		assert rows.loads == ["replica"]
+	asyncio.run(main())
+
+def test_weak_and_listed_etags_match():
+	async def main():
+		rows = Rows(primary=2)
+		await versioned(request(), "server", 5, rows.load)
+		assert (await versioned(request('"other", W/"server-5-2"'), "server", 5, rows.load)).status_code == 304
+		assert (await versioned(request("*"), "server", 5, rows.load)).status_code == 304
+		assert (await versioned(request('"server-5-1"'), "server", 5, rows.load)).status_code == 200
+	asyncio.run(main())
+
+def test_write_outdates_the_cached_body():
+	async def main():
+		rows = Rows(primary=1)
+		await versioned(request(), "server", 5, rows.load)
+		rows.primary = rows.replica = 2
+		await Versions.set("server", 5, 2)
+		response = await versioned(request('"server-5-1"'), "server", 5, rows.load)
+		assert response.status_code == 200
+		assert response.headers["etag"] == '"server-5-2"'
+		assert len(rows.loads) == 2
+	asyncio.run(main())
+
+def test_lagging_replica_row_is_reloaded_from_the_primary():
+	async def main():
+		await Versions.set("server", 5, 3)
+		rows = Rows(primary=3, replica=2)
+		response = await versioned(request(), "server", 5, rows.load)
+		assert rows.loads == ["replica", "primary"]
+		assert response.headers["etag"] == '"server-5-3"'
+		assert orjson.loads(response.body)["name"] == "v3"
+		assert ("/servers/abc", "server", 5, 2) not in bodies
+	asyncio.run(main())
+
+def test_versions_are_shared_through_redis():
+	async def main():
+		Versions.bind_redis(fakeredis.aioredis.FakeRedis())
+		rows = Rows(primary=4)
+		await versioned(request(), "server", 5, rows.load)
+		# another worker has no local state but the same Redis
+		bodies.clear()
+		response = await versioned(request('"server-5-4"'), "server", 5, rows.load)
+		assert response.status_code == 304
+		assert rows.loads == ["replica"]
+		# a reader that loaded an old row cannot lower the version
+		await Versions.set("server", 5, 3)
+		assert await Versions.get("server", 5) == 4
+	asyncio.run(main())
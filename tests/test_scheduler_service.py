@@ -0,0 +1,173 @@
+"""SchedulerLeader election against fakeredis, with the Lua scripts run by fakeredis' Lua runtime"""
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+from services.scheduler_service import SchedulerLeader
+
+class RecordingScheduler:
+	"""Stands in for LazyScheduler and records what the leader asked of it"""
+
+	def __init__(self):
+		self.calls = []
+		self.running = False
+
+	def start(self):
+		self.calls.append("start")
+		self.running = True
+
+	def pause(self):
+		self.calls.append("pause")
+
+	def resume(self):
+		self.calls.append("resume")
+		self.running = True
+
+	def shutdown(self):
+		self.calls.append("shutdown")
+		self.running = False
+
+class FlakyRedis:
+	"""Forwards to a FakeRedis until `down` is set, then every call fails like a lost connection"""
+
+	def __init__(self, connection):
+		self.connection = connection
+		self.down = False
+
+	async def eval(self, *args):
+		if self.down:
+			raise ConnectionError("redis is down")
+		return await self.connection.eval(*args)
+
+	async def get(self, key):
+		if self.down:
+			raise ConnectionError("redis is down")
+		return await self.connection.get(key)
+
+def leader(connection, ttl: float = 0.3) -> SchedulerLeader:
+	elected = SchedulerLeader(RecordingScheduler(), key="test:leader", ttl=ttl)
+	elected.bind_redis(connection)
+	return elected
+
+def connections(count: int) -> list:
+	server = fakeredis.FakeServer()
+	return [fakeredis.aioredis.FakeRedis(server=server) for _ in range(count)]
+
+def test_one_of_many_workers_acquires():
+	async def main():
+		pool = connections(3)
+		redis = pool[0]
+		workers = [leader(connection) for connection in pool]
+		for worker in workers:
+			worker.start()
+		await asyncio.sleep(0.05)
+		try:
+			leaders = [worker for worker in workers if worker.leader]
+			assert len(leaders) == 1
+			assert (await redis.get("test:leader")).decode("utf8") == leaders[0].identity
+			assert leaders[0].scheduler.calls == ["resume"]
+			assert all(worker.scheduler.calls == [] for worker in workers if not worker.leader)
+			assert (await leaders[0].stats())["current_leader"] == leaders[0].identity
+		finally:
+			for worker in workers:
+				await worker.stop()
+	asyncio.run(main())
+
+def test_leader_renews_past_its_ttl():
+	async def main():
+		first, second = connections(2)
+		holder, follower = leader(first), leader(second)
+		holder.start()
+		await asyncio.sleep(0.05)
+		follower.start()
+		try:
+			await asyncio.sleep(1.0)
+			assert holder.leader and not follower.leader
+			assert 0 < await first.pttl("test:leader") <= 300
+			assert (await holder.stats())["elections"] == 1
+		finally:
+			await holder.stop()
+			await follower.stop()
+	asyncio.run(main())
+
+def test_leader_steps_down_when_the_lock_is_taken():
+	async def main():
+		redis, = connections(1)
+		holder = leader(redis)
+		holder.start()
+		await asyncio.sleep(0.05)
+		try:
+			assert holder.leader
+			await redis.set("test:leader", "someone else", px=300)
+			await asyncio.sleep(holder.interval * 1.5)
+			assert not holder.leader
+			assert holder.scheduler.calls == ["resume", "pause"]
+			assert (await redis.get("test:leader")) == b"someone else"
+		finally:
+			await holder.stop()
+	asyncio.run(main())
+
+def test_leader_steps_down_before_its_key_expires_without_redis():
+	async def main():
+		first, second = connections(2)
+		flaky = FlakyRedis(first)
+		holder, follower = leader(flaky), leader(second)
+		holder.start()
+		await asyncio.sleep(0.05)
+		follower.start()
+		try:
+			assert holder.leader
+			flaky.down = True
+			# the holder stops at ttl - interval after its last renewal, the key lives for the full ttl
+			await asyncio.sleep(holder.ttl - holder.interval / 2)
+			assert not holder.leader and not follower.leader
+			await asyncio.sleep(holder.interval * 2)
+			assert follower.leader
+			assert (await holder.stats())["errors"] > 0
+		finally:
+			flaky.down = False
+			await holder.stop()
+			await follower.stop()
+	asyncio.run(main())
+
+def test_stop_releases_the_lock():
+	async def main():
+		first, second = connections(2)
+		holder, follower = leader(first, ttl=3), leader(second, ttl=3)
+		holder.start()
+		await asyncio.sleep(0.05)
+		follower.start()
+		await asyncio.sleep(0.05)
+		try:
+			assert holder.leader and not follower.leader
+			await holder.stop()
+			assert await first.get("test:leader") is None
+			assert holder.scheduler.calls == ["resume", "shutdown"]
+			# well before the 3 s ttl would have expired
+			await asyncio.sleep(follower.interval * 1.5)
+			assert follower.leader
+		finally:
+			await follower.stop()
+	asyncio.run(main())
+
+def test_stop_keeps_a_lock_held_by_another_worker():
+	async def main():
+		redis, = connections(1)
+		holder = leader(redis)
+		holder.start()
+		await asyncio.sleep(0.05)
+		assert holder.leader
+		# taken over before the holder's next round noticed
+		await redis.set("test:leader", "someone else", px=1000)
+		await holder.stop()
+		assert (await redis.get("test:leader")) == b"someone else"
+	asyncio.run(main())
+
+def test_without_redis_the_worker_is_its_own_leader():
+	async def main():
+		alone = SchedulerLeader(RecordingScheduler(), ttl=0.3)
+		alone.start()
+		assert alone.leader
+		assert alone.scheduler.calls == ["start"]
+		await alone.stop()
+		assert not alone.leader
+	asyncio.run(main())
@@ -0,0 +1,97 @@
+"""TokenCache verification cache, single token revocation and per-subject not_before, on fakeredis"""
+import time
+import asyncio
+import datetime
+import pytest
+import fakeredis.aioredis
+from authx import TokenPayload
+from services.token_service import TokenCache
+
+@pytest.fixture(autouse=True)
+def cache():
+	for part in (TokenCache.local, TokenCache.revoked, TokenCache.not_before):
+		part.clear()
+	yield TokenCache
+	for part in (TokenCache.local, TokenCache.revoked, TokenCache.not_before):
+		part.clear()
+	TokenCache.redis = None
+
+def payload(sub: str = "u1", issued: float = None, expires_in: float = 900, claim: bool = True) -> TokenPayload:
+	issued = time.time() if issued is None else issued
+	extra = {"issued": issued} if claim else {}
+	return TokenPayload(sub=sub, type="access", iat=int(issued), exp=datetime.datetime.fromtimestamp(issued + expires_in, tz=datetime.timezone.utc), **extra)
+
+def other_worker():
+	"""Forgets what this worker knows, as a worker that only shares Redis would"""
+	for part in (TokenCache.local, TokenCache.revoked, TokenCache.not_before):
+		part.clear()
+
+def test_verified_token_is_served_from_the_cache():
+	token = payload()
+	TokenCache.set("token", token)
+	assert TokenCache.get("token") is token
+	assert TokenCache.get("another") is None
+
+def test_expired_token_is_not_cached():
+	TokenCache.set("token", payload(issued=time.time() - 1000))
+	assert TokenCache.get("token") is None
+
+def test_revoked_token_is_refused_in_every_worker():
+	async def main():
+		TokenCache.bind_redis(fakeredis.aioredis.FakeRedis())
+		token = payload()
+		TokenCache.set("token", token)
+		await TokenCache.revoke("token")
+		assert TokenCache.get("token") is None
+		assert await TokenCache.is_revoked("token", token)
+		other_worker()
+		assert await TokenCache.is_revoked("token", token)
+		assert not await TokenCache.is_revoked("another", payload())
+	asyncio.run(main())
+
+def test_revoke_subject_keeps_tokens_issued_afterwards():
+	async def main():
+		TokenCache.bind_redis(fakeredis.aioredis.FakeRedis())
+		before = payload()
+		TokenCache.set("before", before)
+		started = time.perf_counter()
+		await TokenCache.revoke_subject("u1")
+		assert time.perf_counter() - started < 0.5
+		after = payload()
+		TokenCache.set("after", after)
+
+		assert TokenCache.get("before") is None
+		assert TokenCache.get("after") is after
+		assert await TokenCache.is_revoked("before", before)
+		assert not await TokenCache.is_revoked("after", after)
+		assert not await TokenCache.is_revoked("other", payload(sub="u2", issued=before.issued))
+	asyncio.run(main())
+
+def test_other_workers_learn_the_subject_mark_from_redis():
+	async def main():
+		TokenCache.bind_redis(fakeredis.aioredis.FakeRedis())
+		before = payload()
+		await TokenCache.revoke_subject("u1")
+		other_worker()
+		assert await TokenCache.is_revoked("before", before)
+		# the mark is kept locally from then on
+		assert TokenCache.not_before.get("u1", 0) >= before.issued
+	asyncio.run(main())
+
+def test_tokens_without_the_issued_claim_fall_back_to_iat():
+	async def main():
+		legacy = payload(claim=False)
+		await TokenCache.revoke_subject("u1")
+		assert await TokenCache.is_revoked("legacy", legacy)
+	asyncio.run(main())
+
+def test_subject_mark_is_only_raised():
+	TokenCache.on_subject(["u1", 200.0])
+	TokenCache.on_subject(["u1", 100.0])
+	assert TokenCache.not_before.get("u1") == 200.0
+
+def test_revocations_are_not_checked_without_redis_reachable():
+	async def main():
+		TokenCache.bind_redis(fakeredis.aioredis.FakeRedis(connected=False))
+		assert not await TokenCache.is_revoked("token", payload())
+	asyncio.run(main())
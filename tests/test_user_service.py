@@ -0,0 +1,100 @@
+"""SubjectCache against fakeredis: the version guard in Redis and the epoch guard in the worker"""
+import asyncio
+import json
+import pytest
+import fakeredis.aioredis
+from services.user_service import SubjectCache, Subject
+
+@pytest.fixture(autouse=True)
+def cache():
+	SubjectCache.local.clear()
+	yield SubjectCache
+	SubjectCache.local.clear()
+	SubjectCache.redis = None
+
+class GatedRedis:
+	"""Forwards to a FakeRedis, a GET waits for `gate` so a test can act while it is in flight"""
+
+	def __init__(self, connection):
+		self.connection = connection
+		self.gate = asyncio.Event()
+		self.waiting = asyncio.Event()
+
+	async def get(self, key):
+		self.waiting.set()
+		await self.gate.wait()
+		return await self.connection.get(key)
+
+	async def eval(self, *args):
+		return await self.connection.eval(*args)
+
+def stored(redis, uuid: str):
+	async def read():
+		raw = await redis.get(SubjectCache.redis_prefix + uuid)
+		return Subject(*json.loads(raw)) if raw is not None else None
+	return read()
+
+def test_local_entries_without_redis():
+	async def main():
+		assert await SubjectCache.get("u1") is None
+		await SubjectCache.set("u1", Subject(1, True, False, 1))
+		assert await SubjectCache.get("u1") == Subject(1, True, False, 1)
+		SubjectCache.on_subject("u1")
+		assert await SubjectCache.get("u1") is None
+	asyncio.run(main())
+
+def test_redis_never_takes_an_older_subject():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		SubjectCache.bind_redis(redis)
+		await SubjectCache.set("u1", Subject(1, True, False, 3))
+		await SubjectCache.set("u1", Subject(1, False, False, 2))
+		assert await stored(redis, "u1") == Subject(1, True, False, 3)
+		await SubjectCache.set("u1", Subject(1, False, False, 4))
+		assert await stored(redis, "u1") == Subject(1, False, False, 4)
+	asyncio.run(main())
+
+def test_workers_warm_each_other_up_through_redis():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		SubjectCache.bind_redis(redis)
+		await SubjectCache.set("u1", Subject(1, True, True, 1))
+		# another worker has nothing locally
+		SubjectCache.local.clear()
+		assert await SubjectCache.get("u1") == Subject(1, True, True, 1)
+		assert "u1" in SubjectCache.local
+	asyncio.run(main())
+
+def test_subject_read_across_an_invalidation_is_not_cached():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		await redis.set(SubjectCache.redis_prefix + "u1", json.dumps(Subject(1, True, False, 1)))
+		gated = GatedRedis(redis)
+		SubjectCache.bind_redis(gated)
+		pending = asyncio.create_task(SubjectCache.get("u1"))
+		await gated.waiting.wait()
+		SubjectCache.on_subject("u1")
+		gated.gate.set()
+		assert await pending == Subject(1, True, False, 1)
+		assert "u1" not in SubjectCache.local
+	asyncio.run(main())
+
+def test_invalidate_stores_the_new_subject_and_raises_the_epoch():
+	async def main():
+		redis = fakeredis.aioredis.FakeRedis()
+		SubjectCache.bind_redis(redis)
+		await SubjectCache.set("u1", Subject(1, True, False, 1))
+		epoch = SubjectCache.epoch
+		await SubjectCache.invalidate("u1", Subject(1, False, False, 2))
+		assert SubjectCache.epoch > epoch
+		assert SubjectCache.local.get("u1") == Subject(1, False, False, 2)
+		assert await stored(redis, "u1") == Subject(1, False, False, 2)
+	asyncio.run(main())
+
+def test_reset_drops_every_local_entry():
+	async def main():
+		await SubjectCache.set("u1", Subject(1, True, False, 1))
+		await SubjectCache.set("u2", Subject(2, True, False, 1))
+		SubjectCache.reset()
+		assert len(SubjectCache.local) == 0
+	asyncio.run(main())